@@ -0,0 +1,119 @@
+import random
+from typing import List
+
+CODE_LINES = [
+    "def handle(request):",
+    "    payload = request.json()",
+    "    if not payload:",
+    "        return None",
+    "    for item in payload.get('items', []):",
+    "        total += item['price'] * item['quantity']",
+    "    logger.info(f'Processed {len(items)} items')",
+    "    result = compute(total, discount=0.1)",
+    "    return {'status': 'ok', 'total': total}",
+    "class Service:",
+    "    def __init__(self, client):",
+    "        self.client = client",
+    "",
+    "    }",
+    "import os",
+    "    # TODO: validate input",
+]
+
+
+def _line(rng: random.Random) -> str:
+    return rng.choice(CODE_LINES)
+
+
+def _modified_file(rng: random.Random, path: str, hunks: int, hunk_size: int) -> List[str]:
+    out = [
+        f"diff --git a/{path} b/{path}",
+        f"index {rng.getrandbits(28):07x}..{rng.getrandbits(28):07x} 100644",
+        f"--- a/{path}",
+        f"+++ b/{path}",
+    ]
+    start = 1
+    for _ in range(hunks):
+        start += rng.randint(5, 40)
+        body = []
+        old_count = new_count = 0
+        for _ in range(hunk_size):
+            kind = rng.random()
+            if kind < 0.45:
+                body.append(f"+{_line(rng)}")
+                new_count += 1
+            elif kind < 0.65:
+                body.append(f"-{_line(rng)}")
+                old_count += 1
+            else:
+                body.append(f" {_line(rng)}")
+                old_count += 1
+                new_count += 1
+        out.append(f"@@ -{start},{old_count} +{start},{new_count} @@ def handle(request):")
+        out.extend(body)
+        start += new_count
+    return out
+
+
+def _new_file(rng: random.Random, path: str, size: int) -> List[str]:
+    out = [
+        f"diff --git a/{path} b/{path}",
+        "new file mode 100644",
+        f"index 0000000..{rng.getrandbits(28):07x}",
+        "--- /dev/null",
+        f"+++ b/{path}",
+        f"@@ -0,0 +1,{size} @@",
+    ]
+    out.extend(f"+{_line(rng)}" for _ in range(size))
+    return out
+
+
+def _deleted_file(rng: random.Random, path: str, size: int) -> List[str]:
+    out = [
+        f"diff --git a/{path} b/{path}",
+        "deleted file mode 100644",
+        f"index {rng.getrandbits(28):07x}..0000000",
+        f"--- a/{path}",
+        "+++ /dev/null",
+        f"@@ -1,{size} +0,0 @@",
+    ]
+    out.extend(f"-{_line(rng)}" for _ in range(size))
+    return out
+
+
+def _renamed_file(rng: random.Random, path: str, hunks: int, hunk_size: int) -> List[str]:
+    old_path = path.replace(".py", "_old.py")
+    out = [
+        f"diff --git a/{old_path} b/{path}",
+        "similarity index 90%",
+        f"rename from {old_path}",
+        f"rename to {path}",
+    ]
+    if hunks:
+        body = _modified_file(rng, path, hunks, hunk_size)[4:]
+        out.extend([f"--- a/{old_path}", f"+++ b/{path}"])
+        out.extend(body)
+    return out
+
+
+def generate_diff(files: int = 10, hunks_per_file: int = 3, hunk_size: int = 12,
+                  rename_ratio: float = 0.1, delete_ratio: float = 0.1, new_ratio: float = 0.1,
+                  seed: int = 0) -> str:
+    """
+    Generates a synthetic unified diff with a mix of modified, new, deleted
+    and renamed files. The same arguments always produce the same diff.
+    """
+    rng = random.Random(seed)
+    out: List[str] = []
+    for i in range(files):
+        path = f"src/module_{i // 10}/file_{i}.py"
+        kind = rng.random()
+        if kind < rename_ratio:
+            out.extend(_renamed_file(rng, path, rng.randint(0, hunks_per_file), hunk_size))
+        elif kind < rename_ratio + delete_ratio:
+            out.extend(_deleted_file(rng, path, hunk_size * hunks_per_file))
+        elif kind < rename_ratio + delete_ratio + new_ratio:
+            out.extend(_new_file(rng, path, hunk_size * hunks_per_file))
+        else:
+            out.extend(_modified_file(rng, path, hunks_per_file, hunk_size))
+    return "\n".join(out) + "\n"
@@ -0,0 +1,505 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import socket
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from benchmarks.diff_generator import generate_diff
+
+prompt_file_pattern = re.compile(r'^File: (.+)\n(\d+): ', re.MULTILINE)
+
+
+@dataclass
+class MockConfig:
+    """Behaviour shared by the stand-in servers."""
+    latency: float = 0.0            # base seconds added to every request
+    jitter: float = 0.0             # extra uniform random seconds
+    rate_limit_every: int = 0       # every Nth request answers 429 (0 disables)
+    retry_after: float = 0.1        # Retry-After sent with injected 429s
+    diff_files: int = 10
+    diff_hunks: int = 3
+    diff_hunk_size: int = 12
+    issues_per_response: int = 2
+    open_prs: int = 20              # open PRs per repository, numbered from 1
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    rate_limited: int = 0
+    not_modified: int = 0
+    by_route: Dict[str, int] = field(default_factory=dict)
+
+
+def _make_app(name: str, config: MockConfig, stats: MockStats) -> FastAPI:
+    app = FastAPI(title=f"Mock {name}")
+
+    @app.middleware("http")
+    async def behaviour(request: Request, call_next):
+        stats.requests += 1
+        # Decide on this request's number now; the counter moves on during the sleep.
+        n = stats.requests
+        route = f"{request.method} {request.url.path.rsplit('/', 1)[-1]}"
+        stats.by_route[route] = stats.by_route.get(route, 0) + 1
+        delay = config.latency + random.uniform(0, config.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if config.rate_limit_every and n % config.rate_limit_every == 0:
+            stats.rate_limited += 1
+            return JSONResponse(
+                {"message": "rate limited"}, status_code=429,
+                headers={"Retry-After": str(config.retry_after)}
+            )
+        return await call_next(request)
+
+    return app
+
+
+def _diff_for(pr_id: int, config: MockConfig) -> str:
+    return generate_diff(config.diff_files, config.diff_hunks, config.diff_hunk_size, seed=pr_id)
+
+
+def _files_for(pr_id: int, config: MockConfig) -> List[Dict[str, Any]]:
+    """The PR's diff as GitHub's pulls/{n}/files entries."""
+    files = []
+    for section in _diff_for(pr_id, config).split("diff --git ")[1:]:
+        header, _, patch = section.partition("\n@@")
+        lines = header.split("\n")
+        old_path, path = (p[2:] for p in lines[0].split(" "))
+        status = "modified"
+        if "new file mode 100644" in lines:
+            status = "added"
+        elif "deleted file mode 100644" in lines:
+            status = "removed"
+        elif old_path != path:
+            status = "renamed"
+        entry = {"filename": path, "status": status, "additions": 0, "deletions": 0}
+        if patch:
+            entry["patch"] = "@@" + patch.rstrip("\n")
+            patch_lines = entry["patch"].split("\n")
+            entry["additions"] = sum(1 for line in patch_lines if line.startswith("+"))
+            entry["deletions"] = sum(1 for line in patch_lines if line.startswith("-"))
+        if status == "renamed":
+            entry["previous_filename"] = old_path
+        entry["changes"] = entry["additions"] + entry["deletions"]
+        files.append(entry)
+    return files
+
+
+def _sha_for(pr_id: int) -> str:
+    return hashlib.sha1(str(pr_id).encode()).hexdigest()
+
+
+def _conditional(request: Request, stats: MockStats, body: str, media_type: str) -> Response:
+    # Like GitHub: strong ETags, and 304 when If-None-Match matches.
+    etag = f'"{hashlib.sha1(body.encode()).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        stats.not_modified += 1
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type=media_type, headers={"ETag": etag})
+
+
+class CommentStore:
+    """Comments posted to a stand-in server, so later reviews can list and edit them."""
+
+    def __init__(self):
+        self._next_id = 1
+        self.comments: Dict[Tuple[int, str], Dict[int, Dict[str, Any]]] = {}
+
+    def add(self, pr_id: int, kind: str, comment: Dict[str, Any]) -> Dict[str, Any]:
+        comment["id"] = self._next_id
+        self._next_id += 1
+        self.comments.setdefault((pr_id, kind), {})[comment["id"]] = comment
+        return comment
+
+    def page(self, pr_id: int, kind: str, page: int, per_page: int) -> Tuple[List[Dict[str, Any]], int]:
+        items = list(self.comments.get((pr_id, kind), {}).values())
+        return items[(page - 1) * per_page:page * per_page], len(items)
+
+    def find(self, kind: str, comment_id: int) -> Optional[Dict[str, Any]]:
+        for (_, k), comments in self.comments.items():
+            if k == kind and comment_id in comments:
+                return comments[comment_id]
+        return None
+
+    def delete(self, kind: str, comment_id: int) -> bool:
+        for (_, k), comments in self.comments.items():
+            if k == kind and comments.pop(comment_id, None) is not None:
+                return True
+        return False
+
+
+def create_github_app(config: MockConfig, stats: MockStats) -> FastAPI:
+    app = _make_app("GitHub", config, stats)
+    store = CommentStore()
+
+    def listing(request: Request, pr_id: int, kind: str) -> Response:
+        per_page = int(request.query_params.get("per_page", 30))
+        page = int(request.query_params.get("page", 1))
+        items, total = store.page(pr_id, kind, page, per_page)
+        last = max(1, -(-total // per_page))
+        headers = {}
+        if last > 1:
+            headers["Link"] = f'<{request.url.include_query_params(page=last)}>; rel="last"'
+        return JSONResponse(items, headers=headers)
+
+    def edit(kind: str, comment_id: int, body: Dict[str, Any]) -> Response:
+        comment = store.find(kind, comment_id)
+        if comment is None:
+            return JSONResponse({"message": "Not Found"}, status_code=404)
+        comment["body"] = body["body"]
+        return JSONResponse(comment)
+
+    @app.get("/repos/{owner}/{repo}/pulls")
+    async def list_pulls(request: Request):
+        per_page = int(request.query_params.get("per_page", 30))
+        page = int(request.query_params.get("page", 1))
+        last = max(1, -(-config.open_prs // per_page))
+        headers = {}
+        if last > 1:
+            headers["Link"] = f'<{request.url.include_query_params(page=last)}>; rel="last"'
+        pulls = [
+            {"number": pr_id, "state": "open", "head": {"sha": _sha_for(pr_id)}}
+            for pr_id in range((page - 1) * per_page + 1, min(page * per_page, config.open_prs) + 1)
+        ]
+        return JSONResponse(pulls, headers=headers)
+
+    @app.get("/repos/{owner}/{repo}/pulls/{pr_id}")
+    async def get_pull(pr_id: int, request: Request):
+        if "diff" in request.headers.get("accept", ""):
+            return _conditional(request, stats, _diff_for(pr_id, config), "text/plain")
+        pull = {"number": pr_id, "head": {"sha": _sha_for(pr_id)}, "changed_files": config.diff_files}
+        return _conditional(request, stats, json.dumps(pull), "application/json")
+
+    @app.get("/repos/{owner}/{repo}/pulls/{pr_id}/files")
+    async def list_files(pr_id: int, request: Request):
+        per_page = int(request.query_params.get("per_page", 30))
+        page = int(request.query_params.get("page", 1))
+        files = _files_for(pr_id, config)
+        last = max(1, -(-len(files) // per_page))
+        headers = {}
+        if last > 1:
+            headers["Link"] = f'<{request.url.include_query_params(page=last)}>; rel="last"'
+        return JSONResponse(files[(page - 1) * per_page:page * per_page], headers=headers)
+
+    @app.get("/repos/{owner}/{repo}/compare/{spec}")
+    async def compare(spec: str, request: Request):
+        if "diff" in request.headers.get("accept", ""):
+            return PlainTextResponse(generate_diff(2, 1, config.diff_hunk_size, seed=len(spec)))
+        return {"status": "ahead"}
+
+    @app.post("/repos/{owner}/{repo}/pulls/{pr_id}/reviews")
+    async def create_review(pr_id: int, request: Request):
+        body = await request.json()
+        for comment in body.get("comments", []):
+            store.add(pr_id, "inline", {"body": comment["body"], "path": comment["path"], "line": comment["line"]})
+        return store.add(pr_id, "review", {"body": body.get("body", "")})
+
+    @app.post("/repos/{owner}/{repo}/pulls/{pr_id}/comments", status_code=201)
+    async def create_review_comment(pr_id: int, request: Request):
+        body = await request.json()
+        return store.add(pr_id, "inline", {"body": body["body"], "path": body["path"], "line": body["line"]})
+
+    @app.post("/repos/{owner}/{repo}/issues/{pr_id}/comments", status_code=201)
+    async def create_issue_comment(pr_id: int, request: Request):
+        return store.add(pr_id, "issue", {"body": (await request.json())["body"]})
+
+    @app.get("/repos/{owner}/{repo}/pulls/{pr_id}/reviews")
+    async def list_reviews(pr_id: int, request: Request):
+        return listing(request, pr_id, "review")
+
+    @app.get("/repos/{owner}/{repo}/pulls/{pr_id}/comments")
+    async def list_review_comments(pr_id: int, request: Request):
+        return listing(request, pr_id, "inline")
+
+    @app.get("/repos/{owner}/{repo}/issues/{pr_id}/comments")
+    async def list_issue_comments(pr_id: int, request: Request):
+        return listing(request, pr_id, "issue")
+
+    @app.put("/repos/{owner}/{repo}/pulls/{pr_id}/reviews/{comment_id}")
+    async def update_review(comment_id: int, request: Request):
+        return edit("review", comment_id, await request.json())
+
+    @app.patch("/repos/{owner}/{repo}/pulls/comments/{comment_id}")
+    async def update_review_comment(comment_id: int, request: Request):
+        return edit("inline", comment_id, await request.json())
+
+    @app.patch("/repos/{owner}/{repo}/issues/comments/{comment_id}")
+    async def update_issue_comment(comment_id: int, request: Request):
+        return edit("issue", comment_id, await request.json())
+
+    @app.delete("/repos/{owner}/{repo}/pulls/comments/{comment_id}")
+    async def delete_review_comment(comment_id: int):
+        return Response(status_code=204 if store.delete("inline", comment_id) else 404)
+
+    @app.delete("/repos/{owner}/{repo}/issues/comments/{comment_id}")
+    async def delete_issue_comment(comment_id: int):
+        return Response(status_code=204 if store.delete("issue", comment_id) else 404)
+
+    app.state.comments = store
+
+    return app
+
+
+def create_bitbucket_app(config: MockConfig, stats: MockStats) -> FastAPI:
+    app = _make_app("Bitbucket", config, stats)
+    store = CommentStore()
+
+    @app.get("/2.0/repositories/{workspace}/{repo}/pullrequests/{pr_id}/diff")
+    async def get_diff(pr_id: int):
+        return PlainTextResponse(_diff_for(pr_id, config))
+
+    @app.get("/2.0/repositories/{workspace}/{repo}/pullrequests")
+    async def list_pulls(request: Request):
+        pagelen = int(request.query_params.get("pagelen", 10))
+        page = int(request.query_params.get("page", 1))
+        values = [
+            {"id": pr_id, "state": "OPEN", "source": {"commit": {"hash": _sha_for(pr_id)[:12]}}}
+            for pr_id in range((page - 1) * pagelen + 1, min(page * pagelen, config.open_prs) + 1)
+        ]
+        return {"values": values, "size": config.open_prs, "page": page, "pagelen": pagelen}
+
+    @app.get("/2.0/repositories/{workspace}/{repo}/pullrequests/{pr_id}")
+    async def get_pull(pr_id: int):
+        return {"id": pr_id, "source": {"commit": {"hash": _sha_for(pr_id)[:12]}}}
+
+    @app.post("/2.0/repositories/{workspace}/{repo}/pullrequests/{pr_id}/comments", status_code=201)
+    async def create_comment(pr_id: int, request: Request):
+        body = await request.json()
+        return store.add(pr_id, "comment", {key: body[key] for key in ("content", "inline") if key in body})
+
+    @app.get("/2.0/repositories/{workspace}/{repo}/pullrequests/{pr_id}/comments")
+    async def list_comments(pr_id: int, request: Request):
+        pagelen = int(request.query_params.get("pagelen", 10))
+        page = int(request.query_params.get("page", 1))
+        items, total = store.page(pr_id, "comment", page, pagelen)
+        return {"values": items, "size": total, "page": page, "pagelen": pagelen}
+
+    @app.put("/2.0/repositories/{workspace}/{repo}/pullrequests/{pr_id}/comments/{comment_id}")
+    async def update_comment(comment_id: int, request: Request):
+        comment = store.find("comment", comment_id)
+        if comment is None:
+            return JSONResponse({"type": "error"}, status_code=404)
+        comment["content"] = (await request.json())["content"]
+        return comment
+
+    @app.delete("/2.0/repositories/{workspace}/{repo}/pullrequests/{pr_id}/comments/{comment_id}")
+    async def delete_comment(comment_id: int):
+        return Response(status_code=204 if store.delete("comment", comment_id) else 404)
+
+    app.state.comments = store
+
+    return app
+
+
+def _review_content(prompt: str, config: MockConfig) -> str:
+    issues = [
+        {
+            "file": match.group(1),
+            "line": int(match.group(2)),
+            "severity": "warning",
+            "message": "Synthetic finding from the mock router.",
+            "suggestion": "None"
+        }
+        for match in list(prompt_file_pattern.finditer(prompt))[:config.issues_per_response]
+    ]
+    return json.dumps({"summary": "Synthetic review.", "issues": issues})
+
+
+def create_router_app(config: MockConfig, stats: MockStats) -> FastAPI:
+    app = _make_app("HF Router", config, stats)
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        content = _review_content(body["messages"][-1]["content"], config)
+
+        if body.get("stream"):
+            async def events():
+                for i in range(0, len(content), 16):
+                    delta = {"choices": [{"delta": {"content": content[i:i + 16]}}]}
+                    yield f"data: {json.dumps(delta)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return {"choices": [{"message": {"content": content}}]}
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MockServer:
+    """Runs an ASGI app on a local port inside the current event loop."""
+
+    def __init__(self, app: FastAPI):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self._server: Optional[uvicorn.Server] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        # A uvicorn.Server cannot be restarted once it has exited, so each start gets a new one.
+        self._server = uvicorn.Server(self._config)
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            await asyncio.sleep(0.01)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+
+class MockCluster:
+    """The GitHub, Bitbucket and router stand-ins, started together."""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.stats = {"github": MockStats(), "bitbucket": MockStats(), "router": MockStats()}
+        self.github = MockServer(create_github_app(config, self.stats["github"]))
+        self.bitbucket = MockServer(create_bitbucket_app(config, self.stats["bitbucket"]))
+        self.router = MockServer(create_router_app(config, self.stats["router"]))
+
+    @property
+    def servers(self) -> List[MockServer]:
+        return [self.github, self.bitbucket, self.router]
+
+    def env(self) -> Dict[str, str]:
+        """Settings overrides that point the bot at the stand-in servers."""
+        return {
+            "GITHUB_API_URL": self.github.url,
+            "BITBUCKET_API_URL": f"{self.bitbucket.url}/2.0",
+            "HF_ROUTER_URL": f"{self.router.url}/v1/chat/completions",
+        }
+
+    async def start(self):
+        await asyncio.gather(*(server.start() for server in self.servers))
+
+    async def stop(self):
+        await asyncio.gather(*(server.stop() for server in self.servers))
+
+
+class MockRedisServer:
+    """
+    Minimal Redis-protocol stand-in supporting what the lease backend uses:
+    PING, AUTH, SELECT, GET, SET (NX/XX, PX/EX), DEL, PEXPIRE and EVAL of
+    the lease renew/release scripts.
+    """
+
+    def __init__(self):
+        self.port = _free_port()
+        self.url = f"redis://127.0.0.1:{self.port}/0"
+        self.commands = 0
+        self._data: Dict[str, tuple] = {}  # key -> (value, expires_at or None)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: List[asyncio.StreamWriter] = []
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= asyncio.get_running_loop().time():
+            del self._data[key]
+            return None
+        return value
+
+    def _execute(self, args: List[str]):
+        from src.leases import RELEASE_SCRIPT, RENEW_SCRIPT
+
+        self.commands += 1
+        command = args[0].upper()
+        now = asyncio.get_running_loop().time()
+        if command in ("PING",):
+            return "+PONG"
+        if command in ("AUTH", "SELECT"):
+            return "+OK"
+        if command == "GET":
+            return self._get(args[1])
+        if command == "DEL":
+            existed = self._get(args[1]) is not None
+            self._data.pop(args[1], None)
+            return int(existed)
+        if command == "PEXPIRE":
+            value = self._get(args[1])
+            if value is None:
+                return 0
+            self._data[args[1]] = (value, now + int(args[2]) / 1000)
+            return 1
+        if command == "SET":
+            key, value, options = args[1], args[2], [a.upper() for a in args[3:]]
+            exists = self._get(key) is not None
+            if ("NX" in options and exists) or ("XX" in options and not exists):
+                return None
+            expires_at = None
+            if "PX" in options:
+                expires_at = now + int(args[3 + options.index("PX") + 1]) / 1000
+            elif "EX" in options:
+                expires_at = now + int(args[3 + options.index("EX") + 1])
+            self._data[key] = (value, expires_at)
+            return "+OK"
+        if command == "EVAL":
+            script, key, owner = args[1], args[3], args[4]
+            if self._get(key) != owner:
+                return 0
+            if script == RENEW_SCRIPT:
+                return self._execute(["PEXPIRE", key, args[5]])
+            if script == RELEASE_SCRIPT:
+                return self._execute(["DEL", key])
+            return Exception("ERR unsupported script")
+        return Exception(f"ERR unknown command '{command}'")
+
+    @staticmethod
+    def _encode(reply) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return f"-{reply}\r\n".encode()
+        if isinstance(reply, int):
+            return f":{reply}\r\n".encode()
+        if reply.startswith("+"):
+            return f"{reply}\r\n".encode()
+        data = reply.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.append(writer)
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode())
+                writer.write(self._encode(self._execute(args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.remove(writer)
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
@@ -0,0 +1,350 @@
+"""
+End-to-end benchmarks for the review bot against local stand-in servers.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run --scenario all --files 50 --latency 0.02
+
+Scenarios:
+  parse    DiffParser.parse throughput on synthetic diffs
+  review   CommentMapper.process_review latency percentiles against mock
+           GitHub/Bitbucket/router servers
+  webhook  /webhook ingestion throughput and latency
+  leases   lease contract (acquire, refusal, renew, release, takeover after
+           the TTL) and cycle throughput for the SQLite backend and the Redis
+           backend against a local Redis-protocol stand-in
+  backfill src.backfill over one GitHub and one Bitbucket repository,
+           then a resumed run that finds everything checkpointed
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.diff_generator import generate_diff
+from benchmarks.mock_servers import MockCluster, MockConfig, MockRedisServer
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "min": ordered[0],
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+def _format_ms(stats: Dict[str, float]) -> str:
+    return "  ".join(f"{k}={v * 1000:.1f}ms" for k, v in stats.items())
+
+
+def configure_environment(cluster: MockCluster, args: argparse.Namespace):
+    """Points the bot at the stand-ins. Must run before any `src` import."""
+    state_dir = tempfile.mkdtemp(prefix="review-bot-bench-")
+    os.environ.update(cluster.env())
+    os.environ.update({
+        "GITHUB_TOKEN": "bench",
+        "BITBUCKET_USERNAME": "bench",
+        "BITBUCKET_APP_PASSWORD": "bench",
+        "HF_API_KEY": "bench",
+        "REVIEW_CACHE_ENABLED": "false",
+        "INCREMENTAL_REVIEW_ENABLED": "false",
+        "REVIEW_QUEUE_PATH": os.path.join(state_dir, "queue.sqlite3"),
+        "WEBHOOK_DEDUP_PATH": os.path.join(state_dir, "deliveries.sqlite3"),
+        "LEASE_SQLITE_PATH": os.path.join(state_dir, "leases.sqlite3"),
+        "REVIEW_QUEUE_MAX_SIZE": str(args.webhooks + 1),
+        "RATE_LIMIT_REQUESTS_PER_SECOND": str(args.rate_limit),
+        "RATE_LIMIT_BURST": str(args.rate_limit),
+        "HTTP_BACKOFF_BASE": "0.05",
+        "GITHUB_DIFF_MODE": args.github_diff_mode,
+        "BACKFILL_CHECKPOINT_PATH": os.path.join(state_dir, "backfill.sqlite3"),
+    })
+
+
+def bench_parse(args: argparse.Namespace) -> Dict[str, Any]:
+    from src.diff_parser import DiffParser
+
+    diff_text = generate_diff(args.files, args.hunks, args.hunk_size, seed=args.seed)
+    size_mb = len(diff_text.encode()) / 1e6
+    lines = diff_text.count("\n")
+
+    timings = []
+    for _ in range(args.parse_iterations):
+        start = time.perf_counter()
+        DiffParser.parse(diff_text)
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    result = {
+        "diff_mb": round(size_mb, 3),
+        "diff_lines": lines,
+        "mb_per_s": round(size_mb / best, 2),
+        "lines_per_s": round(lines / best),
+        "latency": percentiles(timings),
+    }
+    print(f"[parse]   {size_mb:.2f} MB, {lines} lines: {result['mb_per_s']} MB/s, "
+          f"{result['lines_per_s']} lines/s  ({_format_ms(result['latency'])})")
+    return result
+
+
+async def bench_review(args: argparse.Namespace, cluster: MockCluster) -> Dict[str, Any]:
+    from src.bitbucket import AsyncBitbucketClient
+    from src.comment_mapper import CommentMapper
+    from src.github import GitHubClient
+    from src.http_client import HTTPClientRegistry
+
+    http = HTTPClientRegistry()
+    mapper = CommentMapper(http)
+    providers = [GitHubClient(http), AsyncBitbucketClient(http)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+
+    async def review(pr_id: int):
+        provider = providers[pr_id % len(providers)]
+        async with semaphore:
+            start = time.perf_counter()
+            await mapper.process_review(provider, "bench", "repo", pr_id)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(review(pr_id) for pr_id in range(1, args.reviews + 1)))
+    elapsed = time.perf_counter() - start
+    await http.aclose()
+
+    result = {
+        "reviews": args.reviews,
+        "concurrency": args.concurrency,
+        "reviews_per_s": round(args.reviews / elapsed, 2),
+        "latency": percentiles(latencies),
+        "upstream_requests": {name: stats.requests for name, stats in cluster.stats.items()},
+        "upstream_429s": {name: stats.rate_limited for name, stats in cluster.stats.items()},
+        "upstream_304s": {name: stats.not_modified for name, stats in cluster.stats.items()},
+    }
+    print(f"[review]  {args.reviews} reviews @ concurrency {args.concurrency}: "
+          f"{result['reviews_per_s']} reviews/s  ({_format_ms(result['latency'])})")
+    print(f"          upstream requests {result['upstream_requests']}, injected 429s {result['upstream_429s']}, "
+          f"304s {result['upstream_304s']}")
+    return result
+
+
+async def bench_webhook(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    from src import main
+
+    async def noop(provider, workspace, repo_slug, pr_id):
+        pass
+
+    # Measure ingestion only; queued reviews are discarded.
+    main.review_queue.handler = noop
+    await main.review_queue.start()
+
+    transport = httpx.ASGITransport(app=main.app)
+    headers = {"X-GitHub-Event": "pull_request"}
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def deliver(pr_id: int):
+            payload = {
+                "action": "synchronize",
+                "pull_request": {"number": pr_id},
+                "repository": {"name": "repo", "owner": {"login": "bench"}},
+            }
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/webhook", json=payload, headers={**headers, "X-GitHub-Delivery": f"bench-{pr_id}"}
+                )
+                latencies.append(time.perf_counter() - start)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(deliver(pr_id) for pr_id in range(1, args.webhooks + 1)))
+        elapsed = time.perf_counter() - start
+
+    await main.review_queue.stop()
+
+    result = {
+        "webhooks": args.webhooks,
+        "requests_per_s": round(args.webhooks / elapsed),
+        "statuses": statuses,
+        "latency": percentiles(latencies),
+    }
+    print(f"[webhook] {args.webhooks} deliveries: {result['requests_per_s']} req/s, statuses {statuses}  "
+          f"({_format_ms(result['latency'])})")
+    return result
+
+
+async def check_leases(backend, ttl: float = 0.2):
+    """Raises if `backend` breaks the lease contract the review queue relies on."""
+    key = "bench:lease#1"
+    checks = [
+        ("first owner acquires", await backend.acquire(key, "a", ttl), True),
+        ("second owner is refused", await backend.acquire(key, "b", ttl), False),
+        ("holder renews", await backend.renew(key, "a", ttl), True),
+        ("non-holder cannot renew", await backend.renew(key, "b", ttl), False),
+    ]
+    await backend.release(key, "b")  # ignored: b does not hold it
+    checks.append(("non-holder cannot release", await backend.acquire(key, "b", ttl), False))
+    await backend.release(key, "a")
+    checks.append(("acquire after release", await backend.acquire(key, "b", ttl), True))
+    await asyncio.sleep(ttl * 1.5)
+    checks.append(("takeover after the TTL", await backend.acquire(key, "a", ttl), True))
+    checks.append(("expired holder cannot renew", await backend.renew(key, "b", ttl), False))
+    await backend.release(key, "a")
+    failed = [name for name, got, expected in checks if got != expected]
+    if failed:
+        raise RuntimeError(f"{type(backend).__name__} broke the lease contract: {', '.join(failed)}")
+
+
+async def bench_leases(args: argparse.Namespace) -> Dict[str, Any]:
+    from src.config import settings
+    from src.leases import RedisLeaseBackend, SQLiteLeaseBackend
+
+    redis = MockRedisServer()
+    await redis.start()
+    result: Dict[str, Any] = {}
+    try:
+        for name, backend in (("sqlite", SQLiteLeaseBackend(settings.LEASE_SQLITE_PATH)),
+                              ("redis", RedisLeaseBackend(redis.url))):
+            try:
+                await check_leases(backend)
+                start = time.perf_counter()
+                for i in range(args.lease_cycles):
+                    key = f"bench:cycle#{i}"
+                    await backend.acquire(key, "bench", 60)
+                    await backend.renew(key, "bench", 60)
+                    await backend.release(key, "bench")
+                elapsed = time.perf_counter() - start
+            finally:
+                await backend.aclose()
+            result[name] = {"cycles_per_s": round(args.lease_cycles / elapsed)}
+            print(f"[leases]  {name}: contract ok, {result[name]['cycles_per_s']} acquire/renew/release cycles/s")
+    finally:
+        await redis.stop()
+    return result
+
+
+async def bench_backfill(args: argparse.Namespace, cluster: MockCluster) -> Dict[str, Any]:
+    from src.backfill import Backfill, BackfillCheckpoint
+    from src.bitbucket import AsyncBitbucketClient
+    from src.comment_mapper import CommentMapper
+    from src.config import settings
+    from src.github import GitHubClient
+    from src.http_client import HTTPClientRegistry
+    from src.leases import SQLiteLeaseBackend
+
+    http = HTTPClientRegistry()
+    providers = {"bitbucket": lambda: AsyncBitbucketClient(http), "github": lambda: GitHubClient(http)}
+    checkpoint = BackfillCheckpoint(settings.BACKFILL_CHECKPOINT_PATH)
+    leases = SQLiteLeaseBackend(settings.LEASE_SQLITE_PATH)
+    backfill = Backfill(CommentMapper(http).process_review, providers, checkpoint,
+                        args.concurrency, settings.BACKFILL_PROVIDER_CONCURRENCY, leases=leases)
+    repos = [("github", "bench", "repo"), ("bitbucket", "bench", "repo")]
+
+    try:
+        first = await backfill.run(repos)
+        resumed = await backfill.run(repos)
+    finally:
+        checkpoint.close()
+        await leases.aclose()
+        await http.aclose()
+    if first.list_failures or resumed.list_failures:
+        raise RuntimeError(f"Backfill could not list {first.list_failures + resumed.list_failures} repositories")
+
+    reviewed = sum(first.outcomes.values())
+    result = {
+        "prs": first.listed,
+        "reviewed": reviewed,
+        "reviews_per_s": round(reviewed / first.elapsed, 2),
+        "outcomes": dict(first.outcomes),
+        "resumed_skipped": resumed.skipped,
+        "resumed_elapsed_s": round(resumed.elapsed, 3),
+    }
+    print(f"[backfill] {first.listed} open PRs: {result['reviews_per_s']} reviews/s, outcomes {result['outcomes']}; "
+          f"resumed run skipped {resumed.skipped} in {result['resumed_elapsed_s']}s")
+    return result
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    config = MockConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_every=args.rate_limit_every,
+        diff_files=args.files,
+        diff_hunks=args.hunks,
+        diff_hunk_size=args.hunk_size,
+        open_prs=args.open_prs,
+    )
+    cluster = MockCluster(config)
+    configure_environment(cluster, args)
+
+    results: Dict[str, Any] = {}
+    scenarios = ["parse", "review", "webhook", "leases", "backfill"] if args.scenario == "all" else [args.scenario]
+
+    if "parse" in scenarios:
+        results["parse"] = bench_parse(args)
+    if "review" in scenarios:
+        await cluster.start()
+        try:
+            results["review"] = await bench_review(args, cluster)
+        finally:
+            await cluster.stop()
+    if "webhook" in scenarios:
+        results["webhook"] = await bench_webhook(args)
+    if "leases" in scenarios:
+        results["leases"] = await bench_leases(args)
+    if "backfill" in scenarios:
+        await cluster.start()
+        try:
+            results["backfill"] = await bench_backfill(args, cluster)
+        finally:
+            await cluster.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AI review bot against local stand-in servers.")
+    parser.add_argument("--scenario", choices=["parse", "review", "webhook", "leases", "backfill", "all"], default="all")
+    parser.add_argument("--files", type=int, default=20, help="files per synthetic diff")
+    parser.add_argument("--hunks", type=int, default=3, help="hunks per modified file")
+    parser.add_argument("--hunk-size", type=int, default=12, help="lines per hunk")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parse-iterations", type=int, default=20)
+    parser.add_argument("--reviews", type=int, default=20)
+    parser.add_argument("--webhooks", type=int, default=500)
+    parser.add_argument("--lease-cycles", type=int, default=500, help="acquire/renew/release cycles per lease backend")
+    parser.add_argument("--open-prs", type=int, default=20, help="open PRs per repository for the backfill")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02, help="mock server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="extra random mock latency in seconds")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="inject a 429 every N upstream requests")
+    parser.add_argument("--rate-limit", type=float, default=1000.0, help="client-side requests/second per host")
+    parser.add_argument("--github-diff-mode", choices=["auto", "diff", "files"], default="auto",
+                        help="how GitHub PR diffs are fetched")
+    parser.add_argument("--json", dest="json_path", help="also write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,118 +1,478 @@
-import httpx
 import json
 import asyncio
-from typing import Dict, Any
+import time
+import httpx
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, Optional, Tuple
 from src.config import settings
 from src.utils.logger import logger
+from src.http_client import HTTPClientRegistry, http_clients
+from src.review_cache import ReviewCache
+from src.json_stream import IssueStreamParser
+from src.json_salvage import salvage, validate_issue
+from src.hedging import Commit, HedgePolicy, hedge_policy
+from src.metrics import (LLM_INPUT_TOKENS_TOTAL, LLM_ISSUES_DISCARDED_TOTAL, LLM_OUTPUT_TOKENS_TOTAL,
+                         LLM_REQUEST_SECONDS, LLM_RESPONSES_TOTAL, LLM_TIMEOUTS_TOTAL, record_span)
+from src.prompt_builder import PromptBuilder, TokenEstimator, estimate_tokens, get_token_estimator
+from src.scheduler import LLMScheduler, llm_scheduler
+
+DiffData = Dict[str, List[Tuple[int, str]]]
+IssueCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Bump whenever the review prompt changes so cached results are not reused.
+PROMPT_VERSION = "2"
+
+# Completions have no side effects, so failed router calls may be retried like GETs.
+ROUTER_EXTENSIONS = {"idempotent": True}
+
+# Follow-ups sent when nothing could be salvaged from a review response
+CONTINUE_INSTRUCTION = "Your answer was cut off. Continue it exactly where it stopped, without repeating anything."
+FIX_INSTRUCTION = "Your answer was not valid JSON. Reply with ONLY the JSON object in the requested format."
+
+
+class _DiffChunker:
+    """
+    Packs parsed files into batches whose rendered size fits within
+    `token_budget`. Whole files are kept together where possible; files that
+    are too large on their own are split at hunk boundaries (runs of
+    consecutive line numbers), and oversized hunks are split by line.
+    """
+
+    def __init__(self, token_budget: int, estimator: TokenEstimator = estimate_tokens):
+        self.token_budget = token_budget
+        self.estimator = estimator
+        self.current: DiffData = {}
+        self.current_tokens = 0
+
+    def add(self, file: str, lines: List[Tuple[int, str]]) -> List[DiffData]:
+        """Adds one file and returns any chunks that became full."""
+        completed: List[DiffData] = []
+        header_tokens = self.estimator(f"\nFile: {file}\n")
+        for hunk in self._split_hunks(lines):
+            for piece in self._split_lines(hunk, self.token_budget - header_tokens):
+                piece_tokens = sum(self.estimator(f"{n}: {c}\n") for n, c in piece)
+                cost = piece_tokens + (0 if file in self.current else header_tokens)
+                if self.current and self.current_tokens + cost > self.token_budget:
+                    completed.extend(self.finish())
+                    cost = piece_tokens + header_tokens
+                self.current.setdefault(file, []).extend(piece)
+                self.current_tokens += cost
+        if not lines:
+            self.current.setdefault(file, [])
+        return completed
+
+    def finish(self) -> List[DiffData]:
+        completed = [self.current] if self.current else []
+        self.current = {}
+        self.current_tokens = 0
+        return completed
+
+    @staticmethod
+    def _split_hunks(lines: List[Tuple[int, str]]) -> List[List[Tuple[int, str]]]:
+        hunks: List[List[Tuple[int, str]]] = []
+        for line_num, content in lines:
+            if hunks and hunks[-1][-1][0] + 1 == line_num:
+                hunks[-1].append((line_num, content))
+            else:
+                hunks.append([(line_num, content)])
+        return hunks
+
+    def _split_lines(self, hunk: List[Tuple[int, str]], token_budget: int) -> List[List[Tuple[int, str]]]:
+        pieces: List[List[Tuple[int, str]]] = [[]]
+        tokens = 0
+        for line_num, content in hunk:
+            cost = self.estimator(f"{line_num}: {content}\n")
+            if pieces[-1] and tokens + cost > token_budget:
+                pieces.append([])
+                tokens = 0
+            pieces[-1].append((line_num, content))
+            tokens += cost
+        return pieces
 
 
 class AIEngine:
-    def __init__(self):
+    def __init__(self, http: Optional[HTTPClientRegistry] = None, cache: Optional[ReviewCache] = None,
+                 scheduler: Optional[LLMScheduler] = None, hedging: Optional[HedgePolicy] = None):
         # Make sure your HF token has "Inference Providers" enabled
         self.model = settings.HF_MODEL
 
         # NEW Router API Endpoint
-        self.base_url = "https://router.huggingface.co/v1/chat/completions"
+        self.base_url = settings.HF_ROUTER_URL
 
         self.headers = {
             "Authorization": f"Bearer {settings.HF_API_KEY}",
             "Content-Type": "application/json"
         }
+        self.http = http or http_clients
+        self.scheduler = scheduler or llm_scheduler
+        self.hedging = hedging or hedge_policy
+        self.chunk_token_budget = settings.AI_CHUNK_TOKEN_BUDGET
+        self.max_concurrency = settings.AI_MAX_CONCURRENCY
+        self.streaming = settings.AI_STREAMING_ENABLED
+        self.max_output_tokens = settings.AI_MAX_OUTPUT_TOKENS
+        self.continuation = settings.AI_CONTINUATION_ENABLED
+        self.estimator = get_token_estimator(settings.PROMPT_TOKEN_ESTIMATOR)
+        self.prompt_builder = PromptBuilder(
+            settings.AI_CONTEXT_WINDOW,
+            self.max_output_tokens,
+            settings.PROMPT_EXCLUDE_GLOBS,
+            estimator=self.estimator
+        )
+
+        if cache is None and settings.REVIEW_CACHE_ENABLED:
+            cache = ReviewCache(
+                settings.REVIEW_CACHE_PATH,
+                max_entries=settings.REVIEW_CACHE_MAX_ENTRIES,
+                max_age_seconds=settings.REVIEW_CACHE_MAX_AGE_DAYS * 24 * 3600
+            )
+        self.cache = cache
+
+    async def analyze_changes(self, diff_data: Dict[str, Any], on_issue: Optional[IssueCallback] = None) -> Dict[str, Any]:
+        async def files():
+            for item in diff_data.items():
+                yield item
+
+        return await self.analyze_stream(files(), on_issue)
+
+    async def analyze_stream(self, files: AsyncIterator[Tuple[str, List[Tuple[int, str]]]],
+                             on_issue: Optional[IssueCallback] = None) -> Dict[str, Any]:
+        """
+        Analyzes parsed files as they arrive (e.g. from `DiffParser.parse_stream`).
+
+        Excluded files (lockfiles, generated code, ...) are skipped. The rest are
+        packed into token-budgeted chunks and each chunk is sent to
+        the router as soon as it is full, under a per-review concurrency limit
+        and a slot from the shared scheduler (map). The
+        per-chunk results are merged with a final summary pass (reduce). Files
+        whose added lines are unchanged since a previous review reuse their
+        cached issues instead of being sent to the model.
+
+        If `on_issue` is given, it is awaited with each issue as soon as it is
+        known (cached, or completed in the model's streamed output), before
+        the full result is returned.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        chunker = _DiffChunker(self.chunk_token_budget, self.estimator)
+        chunks: List[DiffData] = []
+        tasks: List[asyncio.Task] = []
+        keys: Dict[str, str] = {}
+        cached: Dict[str, Dict[str, Any]] = {}
+        omitted: List[Dict[str, str]] = []
+
+        async def run(chunk: DiffData) -> Dict[str, Any]:
+            async with semaphore, self.scheduler.slot():
+                return await self._analyze_chunk(chunk, on_issue)
+
+        def launch(chunk: DiffData):
+            chunks.append(chunk)
+            tasks.append(asyncio.create_task(run(chunk)))
+
+        try:
+            async for file, lines in files:
+                pattern = self.prompt_builder.excluded_by(file)
+                if pattern is not None:
+                    omitted.append({"file": file, "reason": f"excluded by {pattern}"})
+                    continue
+                if self.cache is not None:
+                    keys[file] = ReviewCache.make_key(file, lines, self.model, PROMPT_VERSION)
+                    entry = self.cache.get(keys[file])
+                    if entry is not None:
+                        cached[file] = entry
+                        if on_issue is not None:
+                            for issue in filter(None, map(validate_issue, entry.get("issues", []))):
+                                await on_issue(issue)
+                        continue
+                for chunk in chunker.add(file, lines):
+                    launch(chunk)
+            for chunk in chunker.finish():
+                launch(chunk)
+            results = list(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        if self.cache is not None:
+            logger.info(f"Review cache: {len(cached)} hits, {len(keys) - len(cached)} misses.")
+            self._store_cached(chunks, results, keys)
 
-    async def analyze_changes(self, diff_data: Dict[str, Any]) -> Dict[str, Any]:
-        prompt = self._construct_prompt(diff_data)
+        if not results:
+            summaries = dict.fromkeys(e.get("summary", "") for e in cached.values() if e.get("summary"))
+            result = {"summary": "\n\n".join(summaries) or "No summary provided.", "issues": []}
+        elif len(results) == 1:
+            result = results[0]
+        else:
+            logger.info(f"Analyzed diff in {len(results)} parallel chunks.")
+            result = await self._reduce(results)
 
-        payload = {
+        # Cached files are authoritative for their own issues.
+        result["issues"] = [i for i in result.get("issues", []) if i.get("file") not in cached]
+        for entry in cached.values():
+            result["issues"].extend(entry.get("issues", []))
+        result["omitted"] = omitted + result.get("omitted", [])
+        return result
+
+    def _store_cached(self, chunks: List[DiffData], results: List[Dict[str, Any]], keys: Dict[str, str]):
+        entries: Dict[str, Dict[str, Any]] = {}
+        failed = set()
+        for chunk, result in zip(chunks, results):
+            omitted = {o["file"] for o in result.get("omitted", [])}
+            for file in chunk:
+                if result.get("failed") or file in omitted:
+                    failed.add(file)
+                    continue
+                entry = entries.setdefault(file, {"summary": result.get("summary", ""), "issues": []})
+                entry["issues"].extend(i for i in result.get("issues", []) if i.get("file") == file)
+
+        for file, entry in entries.items():
+            if file not in failed:
+                self.cache.put(keys[file], entry)
+
+    async def _analyze_chunk(self, diff_data: DiffData, on_issue: Optional[IssueCallback] = None) -> Dict[str, Any]:
+        build = self.prompt_builder.build(diff_data)
+        if len(build.omitted) == len(diff_data):
+            return {"summary": "", "issues": [], "omitted": build.omitted}
+
+        if self.streaming and on_issue is not None:
+            generated_text = await self._complete_stream(build.prompt, self.max_output_tokens, on_issue)
+        else:
+            generated_text = await self._complete(build.prompt, max_tokens=self.max_output_tokens)
+        if generated_text is None:
+            return {"summary": "AI Analysis failed after retries.", "issues": [], "failed": True, "omitted": build.omitted}
+        result = await self._parse_review(build.prompt, generated_text)
+        result["omitted"] = build.omitted
+        return result
+
+    async def _reduce(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        issues = []
+        seen = set()
+        failed = any(r.get("failed") for r in results)
+        for result in results:
+            for issue in result.get("issues", []):
+                key = (issue.get("file"), issue.get("line"), issue.get("message"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                issues.append(issue)
+
+        omitted = [o for r in results for o in r.get("omitted", [])]
+        partial_summaries = [r.get("summary", "") for r in results if r.get("summary")]
+        async with self.scheduler.slot():
+            summary = await self._complete(
+                self._construct_summary_prompt(partial_summaries, issues),
+                max_tokens=800
+            )
+        if summary is None:
+            summary = "\n\n".join(partial_summaries) or "No summary provided."
+
+        return {"summary": summary.strip(), "issues": issues, "failed": failed, "omitted": omitted}
+
+    def _build_payload(self, prompt: str, max_tokens: int,
+                       followup: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        return {
             "model": self.model,
             "messages": [
                 {"role": "system", "content": "You are an expert code reviewer."},
-                {"role": "user", "content": prompt}
+                {"role": "user", "content": prompt},
+                *(followup or [])
             ],
-            "max_tokens": 2000,
+            "max_tokens": max_tokens,
             "temperature": 0.2
         }
 
-        for attempt in range(3):
+    async def _complete(self, prompt: str, max_tokens: int,
+                        followup: Optional[List[Dict[str, str]]] = None) -> Optional[str]:
+        payload = self._build_payload(prompt, max_tokens, followup)
+        units = self._size_units(prompt, max_tokens)
+        timeout = self.hedging.timeout(self.model, units)
+
+        async def attempt(commit: Commit) -> Optional[str]:
+            # Rate limits and transient failures are retried by the shared
+            # transport, within the adaptive timeout; a stalled request is
+            # covered by the hedge instead.
+            start = time.perf_counter()
+            text = None
+            usage = None
             try:
-                async with httpx.AsyncClient(timeout=120) as client:
-                    response = await client.post(
-                        self.base_url,
-                        headers=self.headers,
-                        json=payload
-                    )
+                client = self.http.get(self.base_url)
+                response = await asyncio.wait_for(
+                    client.post(self.base_url, headers=self.headers, json=payload, timeout=timeout,
+                                extensions=ROUTER_EXTENSIONS),
+                    timeout
+                )
+
+                response.raise_for_status()
+                data = response.json()
+                usage = data.get("usage")
+
+                text = data["choices"][0]["message"]["content"]
+                self.hedging.latency.observe(self.model, time.perf_counter() - start, units)
+                commit()
+                return text
+
+            except (asyncio.TimeoutError, httpx.TimeoutException):
+                self._timed_out(self.model, start, units, timeout)
+                return None
+            except Exception as e:
+                logger.error(f"HF Router API error: {e}")
+                return None
+            finally:
+                self._record_usage("complete", start, prompt, text, usage)
+
+        return await self.hedging.race(attempt, self.hedging.hedge_after(self.model, units))
+
+    async def _complete_stream(self, prompt: str, max_tokens: int, on_issue: IssueCallback) -> Optional[str]:
+        """
+        Streams the completion over server-sent events and hands each issue
+        to `on_issue` as soon as its JSON object is complete. Returns the
+        full generated text.
 
+        A stream is hedged on its time to first token: once a request has
+        produced output the other one is cancelled, so issues are only ever
+        reported by one stream.
+        """
+        payload = self._build_payload(prompt, max_tokens)
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+        units = self._size_units(prompt, max_tokens)
+        first_token_key = f"{self.model}:first_token"
+        timeout = self.hedging.timeout(self.model, units)
+
+        async def attempt(commit: Commit) -> Optional[str]:
+            parser = IssueStreamParser()
+            start = time.perf_counter()
+            usage = None
+
+            async def read() -> bool:
+                nonlocal usage
+                committed = False
+                client = self.http.get(self.base_url)
+                async with client.stream(
+                    "POST",
+                    self.base_url,
+                    headers=self.headers,
+                    json=payload,
+                    timeout=timeout,
+                    extensions=ROUTER_EXTENSIONS
+                ) as response:
                     response.raise_for_status()
-                    data = response.json()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        event = json.loads(data)
+                        usage = event.get("usage") or usage
+                        choices = event.get("choices") or [{}]
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if not delta:
+                            continue
+                        if not committed:
+                            self.hedging.latency.observe(first_token_key, time.perf_counter() - start, units)
+                            if not commit():
+                                return False
+                            committed = True
+                        # Malformed issues are dropped here and counted when the full response is parsed.
+                        for issue in filter(None, map(validate_issue, parser.feed(delta))):
+                            await on_issue(issue)
+                return True
 
-                    generated_text = data["choices"][0]["message"]["content"]
-                    return self._parse_json_response(generated_text)
+            try:
+                if await asyncio.wait_for(read(), timeout):
+                    self.hedging.latency.observe(self.model, time.perf_counter() - start, units)
+                    commit()
+                return parser.text
 
+            except (asyncio.TimeoutError, httpx.TimeoutException):
+                self._timed_out(self.model, start, units, timeout)
+                return parser.text or None
             except Exception as e:
-                logger.error(f"[Attempt {attempt+1}] HF Router API error: {e}")
-                await asyncio.sleep(1.5)
+                logger.error(f"HF Router API streaming error: {e}")
+                return parser.text or None
+            finally:
+                self._record_usage("stream", start, prompt, parser.text, usage)
 
-        return {"summary": "AI Analysis failed after retries.", "issues": []}
+        return await self.hedging.race(attempt, self.hedging.hedge_after(first_token_key, units))
 
-    def _construct_prompt(self, diff_data: Dict[str, Any]) -> str:
-        diff_str = ""
+    def _size_units(self, prompt: str, max_tokens: int) -> float:
+        """Request size in thousands of tokens, which latency percentiles are normalized by."""
+        return (self.estimator(prompt) + max_tokens) / 1000
 
-        for file, lines in diff_data.items():
-            diff_str += f"\nFile: {file}\n"
-            for line_num, content in lines:
-                diff_str += f"{line_num}: {content}\n"
+    def _timed_out(self, key: str, start: float, units: float, timeout: float):
+        # Count the stall as a sample so timeouts grow if the router slows down overall.
+        self.hedging.latency.observe(key, time.perf_counter() - start, units)
+        LLM_TIMEOUTS_TOTAL.inc(model=self.model)
+        logger.error(f"HF Router API request timed out after {timeout:.1f}s.")
 
-        return f"""
-You are an expert code reviewer. Analyze the following code diff and provide a review.
-Focus on correctness, bugs, security issues, performance issues, and best coding practices.
-
-Diff Input:
-{diff_str}
-
-Return ONLY valid JSON:
-
-{{
-  "summary": "text summary in markdown",
-  "issues": [
-    {{
-      "file": "path/to/file",
-      "line": 123,
-      "severity": "error|warning|info",
-      "message": "issue description",
-      "suggestion": "how to fix it"
-    }}
-  ]
-}}
-
-If no issues:
-
-{{
-  "summary": "summary",
-  "issues": []
-}}
-"""
+    def _record_usage(self, mode: str, start: float, prompt: str, text: Optional[str],
+                      usage: Optional[Dict[str, Any]]):
+        # Prefer the router's reported usage; estimate locally when it is absent.
+        duration = time.perf_counter() - start
+        usage = usage or {}
+        input_tokens = usage.get("prompt_tokens") or self.estimator(prompt)
+        output_tokens = usage.get("completion_tokens") or (self.estimator(text) if text else 0)
+        LLM_REQUEST_SECONDS.observe(duration, model=self.model, mode=mode)
+        LLM_INPUT_TOKENS_TOTAL.inc(input_tokens, model=self.model)
+        LLM_OUTPUT_TOKENS_TOTAL.inc(output_tokens, model=self.model)
+        record_span(f"llm:{mode}", time.time() - duration, duration,
+                    input_tokens=input_tokens, output_tokens=output_tokens)
 
-    def _parse_json_response(self, text: str) -> Dict[str, Any]:
-        try:
-            clean = text.strip()
+    def _construct_summary_prompt(self, partial_summaries: List[str], issues: List[Dict[str, Any]]) -> str:
+        summaries_str = "\n\n".join(f"- {s}" for s in partial_summaries)
+        issues_str = "\n".join(
+            f"- [{i.get('severity', 'info')}] {i.get('file')}:{i.get('line')} {i.get('message')}"
+            for i in issues
+        )
 
-            if clean.startswith("```json"):
-                clean = clean[7:]
-            if clean.startswith("```"):
-                clean = clean[3:]
-            if clean.endswith("```"):
-                clean = clean[:-3]
+        return f"""
+You are an expert code reviewer. A large pull request was reviewed in several parts.
+Combine the partial reviews below into one concise overall review summary in markdown.
+
+Partial summaries:
+{summaries_str}
 
-            parsed = json.loads(clean)
+Issues found:
+{issues_str or "None"}
 
-            if "issues" not in parsed:
-                parsed["issues"] = []
+Return ONLY the markdown summary text.
+"""
 
-            return parsed
+    async def _parse_review(self, prompt: str, text: str) -> Dict[str, Any]:
+        """
+        Parses the model's review JSON, salvaging what it can from malformed
+        or truncated output. Only when nothing is recoverable is the model
+        asked, in the same conversation, to finish or fix its answer.
+        """
+        salvaged = salvage(text)
+        outcome = salvaged.outcome
+        if salvaged.result is None and self.continuation:
+            instruction = CONTINUE_INSTRUCTION if salvaged.truncated else FIX_INSTRUCTION
+            followup = await self._complete(prompt, self.max_output_tokens, followup=[
+                {"role": "assistant", "content": text},
+                {"role": "user", "content": instruction},
+            ])
+            if followup is not None:
+                # A continuation normally resumes mid-document; some models start over.
+                candidates = [text + followup, followup] if salvaged.truncated else [followup]
+                for candidate in candidates:
+                    retry = salvage(candidate)
+                    if retry.result is not None:
+                        salvaged = retry
+                        outcome = "continued"
+                        break
 
-        except Exception as e:
-            logger.error(f"Failed to parse JSON AI response: {e}")
+        LLM_RESPONSES_TOTAL.inc(outcome=outcome)
+        if salvaged.discarded:
+            LLM_ISSUES_DISCARDED_TOTAL.inc(salvaged.discarded)
+            logger.warning(f"Discarded {salvaged.discarded} malformed issues from the AI response.")
+        if salvaged.result is None:
+            logger.error("Failed to parse JSON AI response.")
             logger.error(f"Raw Text: {text}")
             return {
                 "summary": "Failed to parse AI response.",
-                "issues": []
+                "issues": [],
+                "failed": True
             }
+        if outcome != "clean":
+            logger.info(f"Salvaged AI response ({outcome}) with {len(salvaged.result['issues'])} issues.")
+        return salvaged.result
@@ -0,0 +1,311 @@
+"""
+Bulk backfill: reviews every open PR of a set of repositories, for
+onboarding a repository or catching up after an outage.
+
+    python -m src.backfill github:owner/repo bitbucket:workspace/repo
+
+Progress is checkpointed to SQLite, so an interrupted run resumes where it
+stopped when the same command is run again.
+"""
+import argparse
+import asyncio
+import math
+import os
+import sqlite3
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from src.bitbucket import AsyncBitbucketClient
+from src.comment_mapper import CommentMapper
+from src.github import GitHubClient
+from src.http_client import http_clients
+from src.interfaces import GitProvider
+from src.job_queue import ReviewJob
+from src.leases import (LeaseBackend, acquire_lease, create_lease_backend, keep_lease, make_owner_id,
+                        release_lease)
+from src.offload import offloader
+from src.config import settings
+from src.utils.logger import logger
+
+# Review outcomes after which a PR needs no more work at the same head commit
+DONE_OUTCOMES = ("completed", "trivial", "no_changes", "unchanged")
+
+Repo = Tuple[str, str, str]  # (provider, workspace, repo_slug)
+BackfillHandler = Callable[[GitProvider, str, str, int], Awaitable[str]]
+
+
+def parse_repo(spec: str) -> Repo:
+    """Parses "github:owner/repo" or "bitbucket:workspace/repo"."""
+    provider, _, path = spec.partition(":")
+    workspace, _, repo_slug = path.partition("/")
+    if provider not in ("github", "bitbucket") or not workspace or not repo_slug or "/" in repo_slug:
+        raise ValueError(f"Invalid repository '{spec}'; expected github:owner/repo or bitbucket:workspace/repo")
+    return provider, workspace, repo_slug
+
+
+class BackfillCheckpoint:
+    """
+    Persistent progress of a backfill: the head commit each PR was last
+    backfilled at and how that review ended. A PR is skipped on resume only
+    if it finished at the same head; failed reviews and PRs pushed to since
+    are reviewed again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS backfill_progress ("
+                "pr_key TEXT PRIMARY KEY, head_sha TEXT NOT NULL, outcome TEXT NOT NULL, finished_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def done(self) -> Dict[str, str]:
+        """Maps the key of every finished PR to the head commit it was reviewed at."""
+        placeholders = ", ".join("?" for _ in DONE_OUTCOMES)
+        rows = self._connect().execute(
+            f"SELECT pr_key, head_sha FROM backfill_progress WHERE outcome IN ({placeholders})", DONE_OUTCOMES
+        ).fetchall()
+        return dict(rows)
+
+    def record(self, pr_key: str, head_sha: str, outcome: str):
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO backfill_progress (pr_key, head_sha, outcome, finished_at) VALUES (?, ?, ?, ?)",
+                (pr_key, head_sha, outcome, time.time())
+            )
+            conn.commit()
+        except Exception as e:
+            # Losing a checkpoint only means the PR is reviewed again on resume.
+            logger.error(f"Backfill checkpoint write failed: {e}")
+
+    def reset(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM backfill_progress")
+        conn.commit()
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+@dataclass
+class BackfillSummary:
+    repos: int = 0
+    listed: int = 0
+    skipped: int = 0                # finished at the same head by an earlier run
+    queued: int = 0
+    list_failures: int = 0
+    outcomes: Counter = field(default_factory=Counter)
+    latencies: List[float] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def render(self) -> str:
+        reviewed = sum(self.outcomes.values())
+        rate = reviewed / self.elapsed * 60 if self.elapsed else 0.0
+        lines = [
+            f"Backfill of {self.repos} repositories: {self.listed} open PRs, {self.skipped} already done, "
+            f"{self.queued} queued, {reviewed} reviewed in {self.elapsed:.1f}s ({rate:.1f} reviews/min)"
+        ]
+        if self.outcomes:
+            lines.append("  outcomes: " + ", ".join(f"{k}={v}" for k, v in self.outcomes.most_common()))
+        if self.latencies:
+            ordered = sorted(self.latencies)
+
+            def pick(q: float) -> float:
+                return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+            lines.append(f"  review time: p50={pick(0.5):.1f}s  p90={pick(0.9):.1f}s  max={ordered[-1]:.1f}s")
+        if self.list_failures:
+            lines.append(f"  {self.list_failures} repositories could not be listed")
+        return "\n".join(lines)
+
+
+class Backfill:
+    """
+    Reviews the open PRs of many repositories concurrently.
+
+    Repositories are listed concurrently and their PRs are queued for review
+    as each listing arrives. At most `concurrency` reviews run at once, and
+    at most `provider_concurrency` against any one provider, so a backfill
+    stays within each API's rate limits. Each review gets its own provider
+    instance, as the provider caches PR metadata for one review.
+
+    With a lease backend, each review holds the same per-PR lease as the
+    server's review queue, so a backfill run after an outage never reviews
+    a PR at the same time as a webhook redelivery. A PR leased elsewhere is
+    retried after `lease_retry_interval`, without holding a review slot.
+    """
+
+    def __init__(self, handler: BackfillHandler, providers: Dict[str, Callable[[], GitProvider]],
+                 checkpoint: BackfillCheckpoint, concurrency: int = 8, provider_concurrency: int = 4,
+                 leases: Optional[LeaseBackend] = None, lease_ttl: float = 60.0,
+                 lease_retry_interval: float = 5.0):
+        self.handler = handler
+        self.providers = providers
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.provider_concurrency = provider_concurrency
+        self.leases = leases
+        self.lease_ttl = lease_ttl
+        self.lease_retry_interval = lease_retry_interval
+        self.summary = BackfillSummary()
+
+    async def run(self, repos: List[Repo], dry_run: bool = False) -> BackfillSummary:
+        self.summary = BackfillSummary(repos=len(repos))
+        done = self.checkpoint.done()
+        limit = asyncio.Semaphore(self.concurrency)
+        provider_limits = {name: asyncio.Semaphore(self.provider_concurrency) for name in self.providers}
+        start = time.perf_counter()
+        listings = [asyncio.ensure_future(self._list(repo)) for repo in repos]
+        reviews: List[asyncio.Task] = []
+        try:
+            for listing in asyncio.as_completed(listings):
+                (provider_name, workspace, repo_slug), prs = await listing
+                for pr in prs:
+                    pr_key = ReviewJob.make_key(provider_name, workspace, repo_slug, pr["id"])
+                    if done.get(pr_key) == pr["head_sha"]:
+                        self.summary.skipped += 1
+                        continue
+                    self.summary.queued += 1
+                    if dry_run:
+                        logger.info(f"Would review {pr_key} at {pr['head_sha']}")
+                        continue
+                    reviews.append(asyncio.create_task(
+                        self._review(provider_name, workspace, repo_slug, pr, pr_key, limit,
+                                     provider_limits[provider_name])
+                    ))
+            await asyncio.gather(*reviews)
+        finally:
+            # On interruption, finished reviews are already checkpointed.
+            for task in listings + reviews:
+                task.cancel()
+            await asyncio.gather(*listings, *reviews, return_exceptions=True)
+            self.summary.elapsed = time.perf_counter() - start
+        return self.summary
+
+    async def _list(self, repo: Repo) -> Tuple[Repo, List[Dict[str, Any]]]:
+        provider_name, workspace, repo_slug = repo
+        try:
+            prs = await self.providers[provider_name]().list_open_prs(workspace, repo_slug)
+        except Exception as e:
+            logger.error(f"Failed to list open PRs of {provider_name}:{workspace}/{repo_slug}: {e}")
+            self.summary.list_failures += 1
+            return repo, []
+        logger.info(f"Found {len(prs)} open PRs in {provider_name}:{workspace}/{repo_slug}")
+        self.summary.listed += len(prs)
+        return repo, prs
+
+    async def _review(self, provider_name: str, workspace: str, repo_slug: str, pr: Dict[str, Any], pr_key: str,
+                      limit: asyncio.Semaphore, provider_limit: asyncio.Semaphore):
+        while True:
+            # Wait for the provider's limit first so a busy provider does not hold global slots.
+            async with provider_limit, limit:
+                start = time.perf_counter()
+                outcome = await self._review_leased(provider_name, workspace, repo_slug, pr["id"], pr_key)
+                if outcome is not None:
+                    self.summary.latencies.append(time.perf_counter() - start)
+                    break
+            logger.info(f"Retrying {pr_key} in {self.lease_retry_interval:g}s.")
+            await asyncio.sleep(self.lease_retry_interval)
+        self.summary.outcomes[outcome] += 1
+        self.checkpoint.record(pr_key, pr["head_sha"], outcome)
+        logger.info(f"Backfill {sum(self.summary.outcomes.values())}/{self.summary.queued}: {pr_key} {outcome}")
+
+
+    async def _review_leased(self, provider_name: str, workspace: str, repo_slug: str, pr_id: int,
+                             pr_key: str) -> Optional[str]:
+        """Runs one review under the PR's lease; returns None if the lease was unavailable or lost."""
+        owner = None
+        if self.leases is not None:
+            owner = make_owner_id()
+            if not await acquire_lease(self.leases, pr_key, owner, self.lease_ttl):
+                return None
+
+        heartbeat = None
+        try:
+            review = asyncio.ensure_future(self.handler(self.providers[provider_name](), workspace, repo_slug, pr_id))
+            if owner is not None:
+                heartbeat = asyncio.create_task(keep_lease(self.leases, pr_key, owner, self.lease_ttl, review))
+            return await review
+        except asyncio.CancelledError:
+            if heartbeat is not None and heartbeat.done():
+                # The heartbeat stopped the review after losing the lease.
+                return None
+            raise
+        except Exception as e:
+            logger.error(f"Backfill review for {pr_key} failed: {e}")
+            return "error"
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            if owner is not None:
+                await release_lease(self.leases, pr_key, owner)
+
+
+PROVIDERS = {
+    "bitbucket": lambda: AsyncBitbucketClient(http_clients),
+    "github": lambda: GitHubClient(http_clients),
+}
+
+
+async def _run(backfill: Backfill, repos: List[Repo], dry_run: bool):
+    try:
+        await backfill.run(repos, dry_run)
+    finally:
+        if backfill.leases is not None:
+            await backfill.leases.aclose()
+        await http_clients.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src.backfill",
+                                     description="Review every open PR of the given repositories.")
+    parser.add_argument("repos", nargs="*", metavar="PROVIDER:OWNER/REPO",
+                        help="e.g. github:owner/repo or bitbucket:workspace/repo (default: BACKFILL_REPOS)")
+    parser.add_argument("--concurrency", type=int, default=settings.BACKFILL_CONCURRENCY)
+    parser.add_argument("--provider-concurrency", type=int, default=settings.BACKFILL_PROVIDER_CONCURRENCY)
+    parser.add_argument("--checkpoint", default=settings.BACKFILL_CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="forget the progress of earlier runs")
+    parser.add_argument("--dry-run", action="store_true", help="list the PRs that would be reviewed")
+    args = parser.parse_args()
+
+    specs = args.repos or settings.BACKFILL_REPOS
+    if not specs:
+        parser.error("no repositories given and BACKFILL_REPOS is empty")
+    try:
+        repos = [parse_repo(spec) for spec in specs]
+    except ValueError as e:
+        parser.error(str(e))
+
+    checkpoint = BackfillCheckpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.reset()
+    mapper = CommentMapper(http_clients)
+    leases = create_lease_backend(settings.LEASE_BACKEND, settings.LEASE_SQLITE_PATH, settings.LEASE_REDIS_URL)
+    backfill = Backfill(mapper.process_review, PROVIDERS, checkpoint, args.concurrency, args.provider_concurrency,
+                        leases=leases, lease_ttl=settings.LEASE_TTL,
+                        lease_retry_interval=settings.LEASE_RETRY_INTERVAL)
+    try:
+        asyncio.run(_run(backfill, repos, args.dry_run))
+    except KeyboardInterrupt:
+        logger.warning("Backfill interrupted; run the same command again to resume.")
+    finally:
+        checkpoint.close()
+        offloader.shutdown()
+        print(backfill.summary.render())
+
+
+if __name__ == "__main__":
+    main()
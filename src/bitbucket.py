@@ -1,19 +1,80 @@
-import httpx
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from src.config import settings
 from src.utils.logger import logger
 from src.interfaces import GitProvider
+from src.http_client import HTTPClientRegistry, http_clients
+from src.reconcile import MARKER_TAG
 
 class AsyncBitbucketClient(GitProvider):
-    def __init__(self):
-        self.base_url = "https://api.bitbucket.org/2.0"
+    def __init__(self, http: Optional[HTTPClientRegistry] = None):
+        self.base_url = settings.BITBUCKET_API_URL
         self.auth = (settings.BITBUCKET_USERNAME, settings.BITBUCKET_APP_PASSWORD)
+        self.http = http or http_clients
+        # PR objects fetched by this client, shared by every call in a review
+        self._prs: Dict[Tuple[str, str, int], asyncio.Task] = {}
+
+    async def get_pr(self, workspace: str, repo_slug: str, pr_id: int) -> Dict[str, Any]:
+        key = (workspace, repo_slug, pr_id)
+        task = self._prs.get(key)
+        if task is None:
+            task = self._prs[key] = asyncio.ensure_future(self._fetch_pr(workspace, repo_slug, pr_id))
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            if self._prs.get(key) is task:
+                del self._prs[key]
+            raise
+
+    async def _fetch_pr(self, workspace: str, repo_slug: str, pr_id: int) -> Dict[str, Any]:
+        url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}"
+        client = self.http.get(url)
+        response = await client.get(url, auth=self.auth)
+        response.raise_for_status()
+        return response.json()
 
     async def get_pr_diff(self, workspace: str, repo_slug: str, pr_id: int) -> str:
         url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}/diff"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, auth=self.auth)
+        client = self.http.get(url)
+        response = await client.get(url, auth=self.auth)
+        response.raise_for_status()
+        return response.text
+
+    async def stream_pr_diff(self, workspace: str, repo_slug: str, pr_id: int) -> AsyncIterator[str]:
+        url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}/diff"
+        client = self.http.get(url)
+        async with client.stream("GET", url, auth=self.auth) as response:
             response.raise_for_status()
-            return response.text
+            async for line in response.aiter_lines():
+                yield line
+
+    async def list_open_prs(self, workspace: str, repo_slug: str) -> List[Dict[str, Any]]:
+        # The pullrequests listing defaults to state=OPEN.
+        url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests"
+        return [{"id": pr["id"], "head_sha": pr["source"]["commit"]["hash"]} for pr in await self._list_pages(url)]
+
+    async def get_pr_head_sha(self, workspace: str, repo_slug: str, pr_id: int) -> str:
+        pr = await self.get_pr(workspace, repo_slug, pr_id)
+        return pr["source"]["commit"]["hash"]
+
+    async def get_incremental_diff(self, workspace: str, repo_slug: str, base_sha: str, head_sha: str) -> Optional[str]:
+        repo_url = f"{self.base_url}/repositories/{workspace}/{repo_slug}"
+        client = self.http.get(repo_url)
+
+        # 1. base must be an ancestor of head, otherwise history was rewritten.
+        #    Bitbucket may return abbreviated hashes, so compare by prefix.
+        response = await client.get(f"{repo_url}/merge-base/{head_sha}..{base_sha}", auth=self.auth)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        merge_base = response.json().get("hash", "")
+        if not merge_base or not (merge_base.startswith(base_sha) or base_sha.startswith(merge_base)):
+            return None
+
+        # 2. Diff of the commits on head that are not on base
+        response = await client.get(f"{repo_url}/diff/{head_sha}..{base_sha}", auth=self.auth)
+        response.raise_for_status()
+        return response.text
 
     async def post_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str):
         url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}/comments"
@@ -22,14 +83,15 @@ class AsyncBitbucketClient(GitProvider):
                 "raw": content
             }
         }
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, auth=self.auth)
-            if response.status_code != 201:
-                logger.error(f"Failed to post comment: {response.text}")
-                response.raise_for_status()
-            return response.json()
+        client = self.http.get(url)
+        response = await client.post(url, json=payload, auth=self.auth)
+        if response.status_code != 201:
+            logger.error(f"Failed to post comment: {response.text}")
+            response.raise_for_status()
+        return response.json()
 
-    async def post_inline_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str, path: str, line: int):
+    async def post_inline_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str, path: str, line: int,
+                                  commit_id: Optional[str] = None):
         url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}/comments"
         payload = {
             "content": {
@@ -40,10 +102,85 @@ class AsyncBitbucketClient(GitProvider):
                 "to": line
             }
         }
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, auth=self.auth)
-            if response.status_code != 201:
-                logger.error(f"Failed to post inline comment: {response.text}")
-                # We might not want to raise here to avoid failing the whole review for one bad comment
-                # but for now let's log it.
+        client = self.http.get(url)
+        response = await client.post(url, json=payload, auth=self.auth)
+        if response.status_code != 201:
+            logger.error(f"Failed to post inline comment: {response.text}")
+            # We might not want to raise here to avoid failing the whole review for one bad comment
+            # but for now let's log it.
+        return response.json()
+
+    async def _list_pages(self, url: str) -> List[Dict[str, Any]]:
+        # Bitbucket reports the total "size" on the first page, so the rest
+        # can be fetched concurrently; otherwise follow "next" links.
+        client = self.http.get(url)
+        pagelen = 100
+
+        async def fetch(page: int) -> Dict[str, Any]:
+            response = await client.get(url, auth=self.auth, params={"pagelen": pagelen, "page": page})
+            response.raise_for_status()
             return response.json()
+
+        data = await fetch(1)
+        items = list(data.get("values", []))
+        if "size" in data:
+            pages = -(-data["size"] // pagelen)
+            for page in await asyncio.gather(*(fetch(page) for page in range(2, pages + 1))):
+                items.extend(page.get("values", []))
+            return items
+        while data.get("next"):
+            response = await client.get(data["next"], auth=self.auth)
+            response.raise_for_status()
+            data = response.json()
+            items.extend(data.get("values", []))
+        return items
+
+    async def list_bot_comments(self, workspace: str, repo_slug: str, pr_id: int) -> List[Dict[str, Any]]:
+        url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}/comments"
+        comments = []
+        for c in await self._list_pages(url):
+            body = (c.get("content") or {}).get("raw") or ""
+            if c.get("deleted") or MARKER_TAG not in body:
+                continue
+            inline = c.get("inline") or {}
+            comments.append({
+                "id": c["id"], "kind": "comment", "body": body, "path": inline.get("path"),
+                "line": inline.get("to") or inline.get("from"), "outdated": bool(inline.get("outdated")),
+            })
+        return comments
+
+    async def update_comment(self, workspace: str, repo_slug: str, pr_id: int, comment: Dict[str, Any], body: str):
+        url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}/comments/{comment['id']}"
+        client = self.http.get(url)
+        response = await client.put(url, json={"content": {"raw": body}}, auth=self.auth)
+        if response.status_code != 200:
+            logger.error(f"Failed to update comment {comment['id']}: {response.text}")
+            response.raise_for_status()
+        return response.json()
+
+    async def delete_comment(self, workspace: str, repo_slug: str, pr_id: int, comment: Dict[str, Any]):
+        url = f"{self.base_url}/repositories/{workspace}/{repo_slug}/pullrequests/{pr_id}/comments/{comment['id']}"
+        client = self.http.get(url)
+        response = await client.delete(url, auth=self.auth)
+        if response.status_code != 204:
+            logger.error(f"Failed to delete comment {comment['id']}: {response.text}")
+            response.raise_for_status()
+
+    async def publish_review(self, workspace: str, repo_slug: str, pr_id: int, summary: str,
+                             comments: List[Dict[str, Any]], commit_id: Optional[str] = None):
+        # Bitbucket has no batch endpoint, so post inline comments concurrently with a cap.
+        if summary:
+            await self.post_comment(workspace, repo_slug, pr_id, summary)
+
+        semaphore = asyncio.Semaphore(settings.COMMENT_POST_CONCURRENCY)
+
+        async def post(comment: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    await self.post_inline_comment(
+                        workspace, repo_slug, pr_id, comment["body"], comment["path"], comment["line"]
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to post inline comment on {comment['path']}:{comment['line']}: {e}")
+
+        await asyncio.gather(*(post(comment) for comment in comments))
@@ -1,56 +1,367 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from src.interfaces import GitProvider
 from src.ai_engine import AIEngine
-from src.diff_parser import DiffParser
+from src.diff_parser import DiffParser, FileDiff
+from src.offload import offloader
+from src.http_client import HTTPClientRegistry
+from src.review_state import ReviewStateStore
+from src.triage import DiffTriage
+from src.scheduler import ReviewCost, current_review
+from src.reconcile import (SUMMARY_MARKER, CommentReconciler, fingerprint, issue_marker, resolved_body,
+                           with_marker)
+from src.metrics import (COMMENTS_POSTED_TOTAL, COMMENTS_RECONCILED_TOTAL, COMMENTS_REMAPPED_TOTAL,
+                         COMMENTS_SKIPPED_TOTAL, REVIEW_SECONDS, REVIEW_STAGE_SECONDS, REVIEWS_TOTAL,
+                         TRIAGE_FILES_TOTAL, ReviewTrace, current_trace, stage)
+from src.config import settings
 from src.utils.logger import logger
 
-class CommentMapper:
-    def __init__(self):
-        self.ai = AIEngine()
+async def _parse_text(text: str) -> AsyncIterator[Tuple[str, FileDiff]]:
+    # A diff that is already in memory is parsed in one call, off the event
+    # loop if it is large.
+    parsed = await offloader.run("parse", DiffParser.parse, text, size=len(text))
+    for item in parsed.items():
+        yield item
 
-    async def process_review(self, provider: GitProvider, workspace: str, repo_slug: str, pr_id: int):
-        logger.info(f"Starting review for PR #{pr_id} in {workspace}/{repo_slug}")
-        
-        # 1. Fetch Diff
+class DiffFetchError(Exception):
+    """The PR diff could not be downloaded or parsed."""
+
+async def _fetched(items: AsyncIterator) -> AsyncIterator:
+    """Yields from `items`, re-raising its errors as DiffFetchError so they are told apart from analysis errors."""
+    iterator = items.__aiter__()
+    while True:
         try:
-            diff_text = await provider.get_pr_diff(workspace, repo_slug, pr_id)
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
+            return
         except Exception as e:
-            logger.error(f"Failed to fetch diff: {e}")
+            raise DiffFetchError(e) from e
+        yield item
+
+async def _timed(items: AsyncIterator, elapsed: List[float]) -> AsyncIterator:
+    """Yields from `items`, adding the time spent waiting on each item to elapsed[0]."""
+    iterator = items.__aiter__()
+    while True:
+        start = time.perf_counter()
+        try:
+            item = await iterator.__anext__()
+        except StopAsyncIteration:
             return
+        finally:
+            elapsed[0] += time.perf_counter() - start
+        yield item
+
+TRIVIAL_SUMMARY = (
+    "All changes in this PR look trivial (documentation, formatting, comments, "
+    "renames or version bumps), so no AI review was needed."
+)
+
+class CommentMapper:
+    def __init__(self, http: Optional[HTTPClientRegistry] = None, state: Optional[ReviewStateStore] = None):
+        self.ai = AIEngine(http)
+        if state is None and settings.INCREMENTAL_REVIEW_ENABLED:
+            state = ReviewStateStore(settings.REVIEW_STATE_PATH)
+        self.state = state
+
+    async def process_review(self, provider: GitProvider, workspace: str, repo_slug: str, pr_id: int) -> str:
+        """Reviews a PR and returns the review's outcome label (see `_review`)."""
+        pr_key = ReviewStateStore.make_key(type(provider).__name__, workspace, repo_slug, pr_id)
+        trace = ReviewTrace(pr_key) if settings.TRACE_PATH else None
+        token = current_trace.set(trace)
+        # Router slots are shared fairly between repositories.
+        review = current_review.set(ReviewCost(f"{type(provider).__name__}:{workspace}/{repo_slug}"))
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            outcome = await self._review(provider, workspace, repo_slug, pr_id, pr_key)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            REVIEW_SECONDS.observe(time.perf_counter() - start)
+            REVIEWS_TOTAL.inc(outcome=outcome)
+            current_trace.reset(token)
+            current_review.reset(review)
+            if trace is not None:
+                trace.spans.append({"name": "outcome", "value": outcome})
+                trace.write(settings.TRACE_PATH)
+        return outcome
+
+    async def _review(self, provider: GitProvider, workspace: str, repo_slug: str, pr_id: int, pr_key: str) -> str:
+        """Runs one review and returns its outcome label for metrics."""
+        logger.info(f"Starting review for PR #{pr_id} in {workspace}/{repo_slug}")
+        
+        # 1. Fetch Diff (only the commits pushed since the last review, if possible)
+        head_sha = None
+        base_sha = None
+        diff_text = None
+        with stage("fetch"):
+            # The head commit is fetched once and passed to every call that
+            # needs it (inline comments, the review itself).
+            try:
+                head_sha = await provider.get_pr_head_sha(workspace, repo_slug, pr_id)
+                if self.state is not None:
+                    base_sha = self.state.get_last_reviewed_sha(pr_key)
+            except Exception as e:
+                logger.error(f"Failed to fetch PR head, falling back to a full review: {e}")
+            if head_sha and base_sha == head_sha:
+                logger.info(f"PR #{pr_id} already reviewed at {head_sha}; nothing to do.")
+                return "unchanged"
+
+            try:
+                if base_sha:
+                    diff_text = await provider.get_incremental_diff(workspace, repo_slug, base_sha, head_sha)
+                    if diff_text is None:
+                        logger.info(f"History of PR #{pr_id} was rewritten since {base_sha}; falling back to a full review.")
+                        base_sha = None
+            except Exception as e:
+                logger.error(f"Failed to fetch diff: {e}")
+                return "fetch_failed"
 
         # 2. Parse Diff
-        parsed_diff = DiffParser.parse(diff_text)
-        if not parsed_diff:
-            logger.info("No relevant changes found to analyze.")
-            return
+        # The full PR diff is streamed, so each file is parsed and handed to the
+        # AI engine as soon as it has downloaded. Download, parsing and analysis
+        # overlap, so they are timed together as the "analyze" stage; the time
+        # spent in the parser itself (minus waiting on the network) is
+        # reported separately as "parse".
+        parsed_diff: Dict[str, FileDiff] = {}
+        download_wait = [0.0]
+        parser_wait = [0.0]
+        if diff_text is not None:
+            files = _parse_text(diff_text)
+        else:
+            lines = _timed(provider.stream_pr_diff(workspace, repo_slug, pr_id), download_wait)
+            files = DiffParser.parse_stream(lines)
+
+        # Local triage: files with only trivial changes never reach the model,
+        # nor do deleted and binary files, which have nothing to comment on.
+        triage = DiffTriage(settings.TRIAGE_DOC_GLOBS) if settings.TRIAGE_ENABLED else None
+        trivial: List[Dict[str, str]] = []
+
+        async def parsed_files():
+            async for file_path, changes in _timed(_fetched(files), parser_wait):
+                parsed_diff[file_path] = changes
+                reason = changes.unreviewable()
+                if reason is None and triage is not None:
+                    # Python files are re-parsed into ASTs, which is slow for big changes.
+                    size = changes.content_size
+                    if size < offloader.min_bytes:
+                        reason = triage.classify(file_path, changes)
+                    else:
+                        reason = await offloader.run(
+                            "triage", triage.classify_lines, file_path, changes.change_blocks(), size=size
+                        )
+                TRIAGE_FILES_TOTAL.inc(result=reason or "model")
+                if reason is not None:
+                    trivial.append({"file": file_path, "reason": reason})
+                    continue
+                # The review's size so far ranks its requests for router slots.
+                current_review.get().add(changes.content_size)
+                yield file_path, changes
+
+        # The bot's comments from earlier reviews are listed while the diff is
+        # analyzed, so issues already on the PR are not posted again.
+        reconciler_task = None
+        if settings.COMMENT_RECONCILE_ENABLED:
+            reconciler_task = asyncio.create_task(self._load_reconciler(provider, workspace, repo_slug, pr_id))
 
         # 3. Analyze with AI
-        ai_response = await self.ai.analyze_changes(parsed_diff)
-        
-        # 4. Post Summary
-        summary = ai_response.get("summary", "No summary provided.")
-        await provider.post_comment(workspace, repo_slug, pr_id, f"**AI Review Summary**\n\n{summary}")
+        # In streaming mode each issue is posted as soon as the model finishes
+        # writing it, instead of waiting for the whole review.
+        posted = set()
+        post_tasks: List[asyncio.Task] = []
+        post_semaphore = asyncio.Semaphore(settings.COMMENT_POST_CONCURRENCY)
 
-        # 5. Post Inline Comments
-        issues = ai_response.get("issues", [])
-        for issue in issues:
-            file_path = issue.get("file")
-            line_number = issue.get("line")
-            message = f"**[{issue.get('severity', 'info').upper()}]** {issue.get('message')}\n\n*Suggestion:* {issue.get('suggestion')}"
-            
-            # Verify that the file and line exist in our parsed diff to ensure valid inline comment
-            if file_path in parsed_diff:
-                # Check if line number is valid (exists in the added lines)
-                # This is a basic check. In a real scenario, we might want to be more flexible 
-                # or map to the nearest valid line, but for now we stick to strict matching
-                # to avoid API errors.
-                valid_lines = [l[0] for l in parsed_diff[file_path]]
-                if line_number in valid_lines:
+        async def post_early(comment: Dict[str, Any]):
+            reconciler = await reconciler_task if reconciler_task is not None else None
+            if reconciler is not None and reconciler.match(comment) is not None:
+                COMMENTS_RECONCILED_TOTAL.inc(action="kept")
+                return
+            async with post_semaphore:
+                try:
                     await provider.post_inline_comment(
-                        workspace, repo_slug, pr_id, message, file_path, line_number
+                        workspace, repo_slug, pr_id, comment["body"], comment["path"], comment["line"],
+                        commit_id=head_sha
                     )
-                else:
-                    logger.warning(f"Skipping inline comment: Line {line_number} in {file_path} not found in added lines.")
-            else:
-                logger.warning(f"Skipping inline comment: File {file_path} not found in parsed diff.")
+                    COMMENTS_POSTED_TOTAL.inc(mode="early")
+                except Exception as e:
+                    logger.error(f"Failed to post inline comment on {comment['path']}:{comment['line']}: {e}")
+
+        async def on_issue(issue: Dict[str, Any]):
+            comment = self._to_comment(issue, parsed_diff, warn=False)
+            if comment is None or self._comment_key(comment) in posted:
+                return
+            posted.add(self._comment_key(comment))
+            post_tasks.append(asyncio.create_task(post_early(comment)))
+
+        try:
+            with stage("analyze"):
+                ai_response = await self.ai.analyze_stream(
+                    parsed_files(), on_issue if settings.AI_STREAMING_ENABLED else None
+                )
+                await asyncio.gather(*post_tasks)
+        except DiffFetchError as e:
+            logger.error(f"Failed to fetch diff: {e}")
+            if reconciler_task is not None:
+                reconciler_task.cancel()
+            return "fetch_failed"
+        except Exception as e:
+            logger.error(f"Failed to analyze diff: {e}")
+            if reconciler_task is not None:
+                reconciler_task.cancel()
+            return "analysis_failed"
+        finally:
+            for task in post_tasks:
+                task.cancel()
+            REVIEW_STAGE_SECONDS.observe(parser_wait[0] - download_wait[0], stage="parse")
+
+        if not parsed_diff:
+            logger.info("No relevant changes found to analyze.")
+            if reconciler_task is not None:
+                reconciler_task.cancel()
+            return "no_changes"
+        
+        # 4. Map issues to inline comments, dropping those already on the PR
+        comments = []
+        issues = ai_response.get("issues", [])
+        reconciler = await reconciler_task if reconciler_task is not None else None
+        with stage("map"):
+            for issue in issues:
+                comment = self._to_comment(issue, parsed_diff)
+                if comment is None or self._comment_key(comment) in posted:
+                    continue
+                posted.add(self._comment_key(comment))
+                if reconciler is not None and reconciler.match(comment) is not None:
+                    COMMENTS_RECONCILED_TOTAL.inc(action="kept")
+                    continue
+                comments.append(comment)
+
+        # 5. Publish summary and inline comments as one review
+        all_trivial = len(trivial) == len(parsed_diff)
+        if all_trivial:
+            logger.info(f"All {len(trivial)} changed files in PR #{pr_id} are trivial; skipped AI analysis.")
+            summary = TRIVIAL_SUMMARY
+        else:
+            summary = ai_response.get("summary", "No summary provided.")
+        omitted = trivial + ai_response.get("omitted", [])
+        if omitted:
+            listed = ", ".join(f"`{o['file']}` ({o['reason']})" for o in omitted[:20])
+            more = f" and {len(omitted) - 20} more" if len(omitted) > 20 else ""
+            summary += f"\n\n_Not reviewed: {listed}{more}._"
+        title = "**AI Review Summary**"
+        if base_sha:
+            title = f"**AI Review Summary** (changes since {base_sha[:7]})"
+        body = with_marker(f"{title}\n\n{summary}", SUMMARY_MARKER)
+        with stage("publish"):
+            await self._publish(provider, workspace, repo_slug, pr_id, reconciler, body, comments, head_sha)
+            if reconciler is not None and not ai_response.get("failed"):
+                # Only comments on code this review re-analyzed can be judged
+                # stale: on an incremental review that is the changed lines.
+                omitted_files = {o["file"] for o in omitted}
+
+                def covered(comment: Dict[str, Any]) -> bool:
+                    if comment["path"] in omitted_files:
+                        return False
+                    if not base_sha:
+                        return True
+                    changes = parsed_diff.get(comment["path"])
+                    if changes is None:
+                        return False
+                    return comment.get("outdated") or (comment.get("line") or 0) in changes.index
+
+                await self._retire_stale(provider, workspace, repo_slug, pr_id, reconciler.stale(covered), head_sha)
+        COMMENTS_POSTED_TOTAL.inc(len(comments), mode="review")
+
+        if self.state is not None and head_sha and not ai_response.get("failed"):
+            self.state.set_last_reviewed_sha(pr_key, head_sha)
         
         logger.info(f"Completed review for PR #{pr_id}")
+        if ai_response.get("failed"):
+            return "analysis_failed"
+        return "trivial" if all_trivial else "completed"
+
+    @staticmethod
+    async def _load_reconciler(provider: GitProvider, workspace: str, repo_slug: str,
+                               pr_id: int) -> Optional[CommentReconciler]:
+        try:
+            with stage("list_comments"):
+                existing = await provider.list_bot_comments(workspace, repo_slug, pr_id)
+        except Exception as e:
+            logger.error(f"Failed to list existing review comments; posting every comment: {e}")
+            return None
+        return CommentReconciler(existing, settings.COMMENT_MATCH_LINE_WINDOW)
+
+    @staticmethod
+    async def _publish(provider: GitProvider, workspace: str, repo_slug: str, pr_id: int,
+                       reconciler: Optional[CommentReconciler], summary: str, comments: List[Dict[str, Any]],
+                       head_sha: Optional[str]):
+        """Edits the previous summary in place if there is one, otherwise posts it with the new comments."""
+        if reconciler is not None and reconciler.summary is not None:
+            try:
+                await provider.update_comment(workspace, repo_slug, pr_id, reconciler.summary, summary)
+                COMMENTS_RECONCILED_TOTAL.inc(action="summary_updated")
+                summary = ""
+            except Exception as e:
+                logger.error(f"Failed to update the previous summary; posting a new one: {e}")
+        if summary or comments:
+            await provider.publish_review(workspace, repo_slug, pr_id, summary, comments, commit_id=head_sha)
+
+    @staticmethod
+    async def _retire_stale(provider: GitProvider, workspace: str, repo_slug: str, pr_id: int,
+                            stale: List[Dict[str, Any]], head_sha: Optional[str]):
+        """Resolves or deletes comments whose issue the latest review no longer reports."""
+        action = settings.STALE_COMMENT_ACTION
+        if not stale or action == "keep":
+            return
+        semaphore = asyncio.Semaphore(settings.COMMENT_POST_CONCURRENCY)
+
+        async def retire(comment: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    if action == "delete":
+                        await provider.delete_comment(workspace, repo_slug, pr_id, comment)
+                        COMMENTS_RECONCILED_TOTAL.inc(action="deleted")
+                    else:
+                        body = resolved_body(comment["body"], comment["fingerprint"], head_sha)
+                        await provider.update_comment(workspace, repo_slug, pr_id, comment, body)
+                        COMMENTS_RECONCILED_TOTAL.inc(action="resolved")
+                except Exception as e:
+                    logger.error(f"Failed to {action} stale comment on {comment['path']}:{comment['line']}: {e}")
+
+        logger.info(f"Retiring {len(stale)} stale comments on PR #{pr_id} ({action}).")
+        await asyncio.gather(*(retire(comment) for comment in stale))
+
+    @staticmethod
+    def _comment_key(comment: Dict[str, Any]):
+        return (comment["path"], comment["line"], comment["body"])
+
+    @staticmethod
+    def _to_comment(issue: Dict[str, Any], parsed_diff: Dict[str, FileDiff], warn: bool = True) -> Optional[Dict[str, Any]]:
+        file_path = issue.get("file")
+        try:
+            line_number = int(issue.get("line"))
+        except (TypeError, ValueError):
+            line_number = None
+        message = f"**[{(issue.get('severity') or 'info').upper()}]** {issue.get('message')}\n\n*Suggestion:* {issue.get('suggestion')}"
+
+        # Inline comments must land inside a hunk (added or context lines) or
+        # the API rejects them. Models are often off by a line or two, so an
+        # issue just outside a hunk is moved to the nearest line in it.
+        changes = parsed_diff.get(file_path)
+        if changes is None:
+            if warn:
+                COMMENTS_SKIPPED_TOTAL.inc(reason="file_not_in_diff")
+                logger.warning(f"Skipping inline comment: File {file_path} not found in parsed diff.")
+            return None
+        line = changes.index.nearest(line_number, settings.COMMENT_LINE_SNAP_DISTANCE) if line_number is not None else None
+        if line is None:
+            if warn:
+                COMMENTS_SKIPPED_TOTAL.inc(reason="line_not_in_diff")
+                logger.warning(f"Skipping inline comment: Line {line_number} in {file_path} is not near any hunk.")
+            return None
+        if line != line_number and warn:
+            COMMENTS_REMAPPED_TOTAL.inc()
+            logger.debug(f"Moved inline comment on {file_path} from line {line_number} to {line}.")
+        fp = fingerprint(file_path, str(issue.get("message")))
+        return {"path": file_path, "line": line, "body": with_marker(message, issue_marker(fp)), "fingerprint": fp}
@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import List, Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings
 
@@ -11,6 +11,134 @@ class Settings(BaseSettings):
     HF_MODEL: str = Field("Qwen/Qwen2.5-Coder-7B-Instruct", env="HF_MODEL")
     PORT: int = Field(8000, env="PORT")
 
+    # API endpoints (override for GitHub Enterprise or local stand-in servers)
+    GITHUB_API_URL: str = Field("https://api.github.com", env="GITHUB_API_URL")
+    BITBUCKET_API_URL: str = Field("https://api.bitbucket.org/2.0", env="BITBUCKET_API_URL")
+    HF_ROUTER_URL: str = Field("https://router.huggingface.co/v1/chat/completions", env="HF_ROUTER_URL")
+
+    # How GitHub PR diffs are fetched: "diff" (one unified diff), "files" (paginated
+    # per-file patches) or "auto" (files for PRs past the diff endpoint's limits)
+    GITHUB_DIFF_MODE: str = Field("auto", env="GITHUB_DIFF_MODE")
+    GITHUB_DIFF_MAX_FILES: int = Field(300, env="GITHUB_DIFF_MAX_FILES")
+    GITHUB_DIFF_MAX_LINES: int = Field(20000, env="GITHUB_DIFF_MAX_LINES")
+    # Files whose patch GitHub leaves out are diffed locally up to this size
+    GITHUB_FILE_FETCH_MAX_BYTES: int = Field(1024 * 1024, env="GITHUB_FILE_FETCH_MAX_BYTES")
+
+    # Shared HTTP client pool
+    HTTP_MAX_CONNECTIONS: int = Field(100, env="HTTP_MAX_CONNECTIONS")
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = Field(20, env="HTTP_MAX_KEEPALIVE_CONNECTIONS")
+    HTTP_KEEPALIVE_EXPIRY: float = Field(30.0, env="HTTP_KEEPALIVE_EXPIRY")
+    HTTP_TIMEOUT: float = Field(30.0, env="HTTP_TIMEOUT")
+    HTTP2_ENABLED: bool = Field(True, env="HTTP2_ENABLED")
+    # Outbound rate limiting and retries (per host)
+    RATE_LIMIT_REQUESTS_PER_SECOND: float = Field(10.0, env="RATE_LIMIT_REQUESTS_PER_SECOND")
+    RATE_LIMIT_BURST: int = Field(20, env="RATE_LIMIT_BURST")
+    HTTP_MAX_RETRIES: int = Field(4, env="HTTP_MAX_RETRIES")
+    HTTP_BACKOFF_BASE: float = Field(1.0, env="HTTP_BACKOFF_BASE")
+    HTTP_BACKOFF_MAX: float = Field(60.0, env="HTTP_BACKOFF_MAX")
+    HTTP_RATE_LIMIT_MAX_WAIT: float = Field(300.0, env="HTTP_RATE_LIMIT_MAX_WAIT")
+
+    # Conditional-request (ETag / Last-Modified) cache for GET requests
+    HTTP_CACHE_ENABLED: bool = Field(True, env="HTTP_CACHE_ENABLED")
+    HTTP_CACHE_MAX_BYTES: int = Field(64 * 1024 * 1024, env="HTTP_CACHE_MAX_BYTES")
+    HTTP_CACHE_MAX_ENTRY_BYTES: int = Field(8 * 1024 * 1024, env="HTTP_CACHE_MAX_ENTRY_BYTES")
+
+    COMMENT_POST_CONCURRENCY: int = Field(5, env="COMMENT_POST_CONCURRENCY")
+    # Issues outside every hunk are moved to the nearest hunk line within this distance
+    COMMENT_LINE_SNAP_DISTANCE: int = Field(3, env="COMMENT_LINE_SNAP_DISTANCE")
+    # Reconciliation with the bot's comments from earlier reviews
+    COMMENT_RECONCILE_ENABLED: bool = Field(True, env="COMMENT_RECONCILE_ENABLED")
+    COMMENT_MATCH_LINE_WINDOW: int = Field(10, env="COMMENT_MATCH_LINE_WINDOW")
+    STALE_COMMENT_ACTION: str = Field("resolve", env="STALE_COMMENT_ACTION")  # "resolve", "delete" or "keep"
+
+    # Durable review queue
+    REVIEW_QUEUE_PATH: str = Field(".cache/review_queue.sqlite3", env="REVIEW_QUEUE_PATH")
+    # Workers mostly wait on I/O; router load is bounded by LLM_MAX_CONCURRENCY
+    REVIEW_WORKERS: int = Field(16, env="REVIEW_WORKERS")
+    REVIEW_QUEUE_MAX_SIZE: int = Field(100, env="REVIEW_QUEUE_MAX_SIZE")
+
+    # Bulk backfill of open PRs (python -m src.backfill); repos are "github:owner/repo"
+    # or "bitbucket:workspace/repo"
+    BACKFILL_REPOS: List[str] = Field([], env="BACKFILL_REPOS")
+    BACKFILL_CONCURRENCY: int = Field(8, env="BACKFILL_CONCURRENCY")
+    BACKFILL_PROVIDER_CONCURRENCY: int = Field(4, env="BACKFILL_PROVIDER_CONCURRENCY")
+    BACKFILL_CHECKPOINT_PATH: str = Field(".cache/backfill.sqlite3", env="BACKFILL_CHECKPOINT_PATH")
+
+    # Per-PR leases coordinating workers and nodes ("sqlite", "redis" or "none")
+    LEASE_BACKEND: str = Field("sqlite", env="LEASE_BACKEND")
+    LEASE_SQLITE_PATH: str = Field(".cache/leases.sqlite3", env="LEASE_SQLITE_PATH")
+    LEASE_REDIS_URL: str = Field("redis://localhost:6379/0", env="LEASE_REDIS_URL")
+    LEASE_TTL: float = Field(60.0, env="LEASE_TTL")
+    LEASE_RETRY_INTERVAL: float = Field(5.0, env="LEASE_RETRY_INTERVAL")
+
+    # Chunked (map-reduce) analysis of large diffs
+    AI_CHUNK_TOKEN_BUDGET: int = Field(6000, env="AI_CHUNK_TOKEN_BUDGET")
+    AI_MAX_CONCURRENCY: int = Field(4, env="AI_MAX_CONCURRENCY")
+    # Router requests across all reviews; free slots go to the smallest reviews first
+    LLM_MAX_CONCURRENCY: int = Field(8, env="LLM_MAX_CONCURRENCY")
+    LLM_AGING_BYTES_PER_SECOND: float = Field(50_000, env="LLM_AGING_BYTES_PER_SECOND")
+    AI_STREAMING_ENABLED: bool = Field(False, env="AI_STREAMING_ENABLED")
+    # Ask the model once to finish or fix a response nothing could be salvaged from
+    AI_CONTINUATION_ENABLED: bool = Field(True, env="AI_CONTINUATION_ENABLED")
+
+    # Hedged router requests: calls slower than the AI_HEDGE_QUANTILE latency get a
+    # duplicate (at most AI_HEDGE_BUDGET of all calls); timeouts follow the p99 latency
+    AI_HEDGING_ENABLED: bool = Field(True, env="AI_HEDGING_ENABLED")
+    AI_HEDGE_QUANTILE: float = Field(0.95, env="AI_HEDGE_QUANTILE")
+    AI_HEDGE_BUDGET: float = Field(0.05, env="AI_HEDGE_BUDGET")
+    AI_TIMEOUT_MULTIPLIER: float = Field(3.0, env="AI_TIMEOUT_MULTIPLIER")
+    AI_TIMEOUT_MIN: float = Field(10.0, env="AI_TIMEOUT_MIN")
+    AI_TIMEOUT_MAX: float = Field(120.0, env="AI_TIMEOUT_MAX")
+    AI_LATENCY_WINDOW: int = Field(200, env="AI_LATENCY_WINDOW")
+
+    # Prompt construction
+    AI_CONTEXT_WINDOW: int = Field(32768, env="AI_CONTEXT_WINDOW")
+    AI_MAX_OUTPUT_TOKENS: int = Field(2000, env="AI_MAX_OUTPUT_TOKENS")
+    PROMPT_TOKEN_ESTIMATOR: str = Field("chars", env="PROMPT_TOKEN_ESTIMATOR")
+    PROMPT_EXCLUDE_GLOBS: List[str] = Field([
+        # Lockfiles
+        "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "Pipfile.lock",
+        "Cargo.lock", "Gemfile.lock", "composer.lock", "go.sum",
+        # Vendored and build output
+        "vendor/*", "third_party/*", "node_modules/*", "dist/*", "build/*",
+        # Minified and generated
+        "*.min.js", "*.min.css", "*.map", "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.generated.*",
+    ], env="PROMPT_EXCLUDE_GLOBS")
+
+    # Per-file review result cache
+    REVIEW_CACHE_ENABLED: bool = Field(True, env="REVIEW_CACHE_ENABLED")
+    REVIEW_CACHE_PATH: str = Field(".cache/review_cache.sqlite3", env="REVIEW_CACHE_PATH")
+    REVIEW_CACHE_MAX_ENTRIES: int = Field(10000, env="REVIEW_CACHE_MAX_ENTRIES")
+    REVIEW_CACHE_MAX_AGE_DAYS: float = Field(7, env="REVIEW_CACHE_MAX_AGE_DAYS")
+
+    # Incremental review of commits pushed since the last reviewed head
+    INCREMENTAL_REVIEW_ENABLED: bool = Field(True, env="INCREMENTAL_REVIEW_ENABLED")
+    REVIEW_STATE_PATH: str = Field(".cache/review_state.sqlite3", env="REVIEW_STATE_PATH")
+
+    # Webhook ingestion
+    GITHUB_WEBHOOK_SECRET: Optional[str] = Field(None, env="GITHUB_WEBHOOK_SECRET")
+    BITBUCKET_WEBHOOK_SECRET: Optional[str] = Field(None, env="BITBUCKET_WEBHOOK_SECRET")
+    WEBHOOK_DEDUP_PATH: str = Field(".cache/webhook_deliveries.sqlite3", env="WEBHOOK_DEDUP_PATH")
+    WEBHOOK_DEDUP_CACHE_SIZE: int = Field(10000, env="WEBHOOK_DEDUP_CACHE_SIZE")
+    WEBHOOK_DEDUP_MAX_AGE_DAYS: int = Field(3, env="WEBHOOK_DEDUP_MAX_AGE_DAYS")
+
+    # Local triage of trivial changes
+    TRIAGE_ENABLED: bool = Field(True, env="TRIAGE_ENABLED")
+    TRIAGE_DOC_GLOBS: List[str] = Field([
+        "*.md", "*.rst", "*.adoc", "docs/*", "LICENSE*", "CHANGELOG*", "AUTHORS*", "CONTRIBUTING*",
+    ], env="TRIAGE_DOC_GLOBS")
+
+    # CPU-bound work above OFFLOAD_MIN_BYTES runs in a pool ("thread", "process" or "none")
+    OFFLOAD_EXECUTOR: str = Field("thread", env="OFFLOAD_EXECUTOR")
+    OFFLOAD_WORKERS: int = Field(2, env="OFFLOAD_WORKERS")
+    OFFLOAD_MIN_BYTES: int = Field(256 * 1024, env="OFFLOAD_MIN_BYTES")
+
+    # Observability
+    TRACE_PATH: Optional[str] = Field(None, env="TRACE_PATH")
+    LOOP_LAG_MONITOR_ENABLED: bool = Field(True, env="LOOP_LAG_MONITOR_ENABLED")
+    LOOP_LAG_INTERVAL: float = Field(0.1, env="LOOP_LAG_INTERVAL")
+    LOOP_LAG_THRESHOLD: float = Field(0.1, env="LOOP_LAG_THRESHOLD")
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Optional
+from src.utils.logger import logger
+
+
+class DeliveryStore:
+    """
+    Remembers webhook delivery IDs so redelivered events are ignored.
+
+    Recent IDs are answered from an in-memory LRU; older ones from SQLite,
+    so redeliveries are still recognised after a restart. Rows older than
+    `max_age_seconds` are pruned periodically.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, cache_size: int = 10000, max_age_seconds: float = 3 * 86400):
+        self.path = path
+        self.cache_size = cache_size
+        self.max_age_seconds = max_age_seconds
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._inserts = 0
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            # Webhook ingestion is latency-sensitive: don't fsync every commit.
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS webhook_deliveries ("
+                "delivery_id TEXT PRIMARY KEY, received_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_received_at "
+                "ON webhook_deliveries (received_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _remember(self, delivery_id: str):
+        self._recent[delivery_id] = None
+        self._recent.move_to_end(delivery_id)
+        while len(self._recent) > self.cache_size:
+            self._recent.popitem(last=False)
+
+    def add(self, delivery_id: str) -> bool:
+        """Records a delivery; returns False if it was already seen."""
+        if delivery_id in self._recent:
+            self._recent.move_to_end(delivery_id)
+            return False
+        self._remember(delivery_id)
+
+        try:
+            conn = self._connect()
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO webhook_deliveries (delivery_id, received_at) VALUES (?, ?)",
+                (delivery_id, time.time())
+            )
+            self._inserts += 1
+            if self._inserts % self.PRUNE_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM webhook_deliveries WHERE received_at < ?",
+                    (time.time() - self.max_age_seconds,)
+                )
+            conn.commit()
+            return cursor.rowcount == 1
+        except Exception as e:
+            # Failing open only risks a duplicate review, which the queue coalesces.
+            logger.error(f"Webhook delivery store write failed: {e}")
+            return True
+
+    def discard(self, delivery_id: str):
+        """Forgets a delivery, e.g. when it could not be queued, so a redelivery is accepted."""
+        self._recent.pop(delivery_id, None)
+        try:
+            conn = self._connect()
+            conn.execute("DELETE FROM webhook_deliveries WHERE delivery_id = ?", (delivery_id,))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Webhook delivery store write failed: {e}")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,55 +1,405 @@
 import re
-from typing import List, Dict, Tuple
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+# Regex to capture the paths from lines like "diff --git a/path/to/file.py b/path/to/file.py"
+git_header_pattern = re.compile(r'^diff --git "?a/(.*?)"? "?b/(.*?)"?$')
+# Regex to capture chunk headers like "@@ -1,5 +1,5 @@"
+chunk_header_pattern = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+ADDED = ord("+")
+REMOVED = ord("-")
+CONTEXT = ord(" ")
+
+# Written by providers in place of the hunks of a file whose patch the API
+# left out and that was not fetched; not part of git's diff format.
+TOO_LARGE_LINE = "Diff too large to fetch"
+
+
+class FileStatus:
+    ADDED = "added"
+    DELETED = "deleted"
+    MODIFIED = "modified"
+    RENAMED = "renamed"
+    BINARY = "binary"
+    TOO_LARGE = "too large"
+
+
+def _header_path(rest: str) -> Optional[str]:
+    """The path from a "--- a/x" / "+++ b/x" header, or None for /dev/null."""
+    path = rest.split("\t", 1)[0].strip().strip('"')
+    if path == "/dev/null":
+        return None
+    if path[:2] in ("a/", "b/"):
+        path = path[2:]
+    return path
+
+
+class LineIndex:
+    """
+    The new-file line ranges covered by a file's hunks (added and context
+    lines), which are the lines both APIs accept inline comments on. Ranges
+    are kept sorted in compact arrays and looked up by binary search.
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts = array("l")
+        self.ends = array("l")
+
+    def add(self, start: int, count: int):
+        if count <= 0:
+            return  # Pure deletion: nothing to comment on in the new file
+        # Hunks arrive in order, so this is an append in practice.
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, start + count - 1)
+
+    def __contains__(self, line: int) -> bool:
+        i = bisect_right(self.starts, line) - 1
+        return i >= 0 and line <= self.ends[i]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def nearest(self, line: int, max_distance: int) -> Optional[int]:
+        """Returns `line` if it is inside a hunk, else the closest hunk line within `max_distance`."""
+        i = bisect_right(self.starts, line) - 1
+        if i >= 0 and line <= self.ends[i]:
+            return line
+        best = None
+        if i >= 0 and line - self.ends[i] <= max_distance:
+            best = self.ends[i]
+        if i + 1 < len(self.starts) and self.starts[i + 1] - line <= max_distance:
+            if best is None or self.starts[i + 1] - line < line - best:
+                best = self.starts[i + 1]
+        return best
+
+
+class Hunk:
+    """One `@@` section; `first`/`last` delimit its lines in the owning FileDiff's arrays."""
+
+    __slots__ = ("old_start", "old_count", "new_start", "new_count", "first", "last")
+
+    def __init__(self, old_start: int, old_count: int, new_start: int, new_count: int, first: int):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        self.first = first
+        self.last = first
+
+    def __repr__(self) -> str:
+        return f"Hunk(-{self.old_start},{self.old_count} +{self.new_start},{self.new_count})"
+
+
+class FileDiff(Sequence):
+    """
+    One file of a parsed diff. Every hunk line is stored as a kind byte and
+    the offsets of its content in a shared buffer, so no per-line objects
+    are kept; line numbers follow from the hunk headers.
+
+    As a sequence it yields `(new_line_number, content)` for the added lines,
+    which is all the review prompt needs.
+    """
+
+    __slots__ = ("path", "old_path", "status", "hunks", "kinds", "starts", "ends",
+                 "added", "added_lines", "buffer", "_index")
+
+    def __init__(self, path: str, old_path: Optional[str] = None, status: str = FileStatus.MODIFIED):
+        self.path = path
+        self.old_path = old_path or path
+        self.status = status
+        self.hunks: List[Hunk] = []
+        self.kinds = bytearray()
+        self.starts = array("I")
+        self.ends = array("I")
+        # Positions and new-file line numbers of the added lines
+        self.added = array("i")
+        self.added_lines = array("i")
+        self.buffer = ""
+        self._index: Optional[LineIndex] = None
+
+    def content(self, i: int) -> str:
+        return self.buffer[self.starts[i]:self.ends[i]]
+
+    def __len__(self) -> int:
+        return len(self.added)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self.added)))]
+        return self.added_lines[k], self.content(self.added[k])
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        for line_number, i in zip(self.added_lines, self.added):
+            yield line_number, self.content(i)
+
+    def lines(self) -> Iterator[Tuple[str, int, int, str]]:
+        """
+        Every hunk line as (kind, old_line_number, new_line_number, content),
+        kind one of "+", "-", " " and line numbers 0 where not applicable.
+        """
+        for hunk in self.hunks:
+            old_line, new_line = hunk.old_start, hunk.new_start
+            for i in range(hunk.first, hunk.last):
+                kind = self.kinds[i]
+                if kind == ADDED:
+                    yield "+", 0, new_line, self.content(i)
+                    new_line += 1
+                elif kind == REMOVED:
+                    yield "-", old_line, 0, self.content(i)
+                    old_line += 1
+                else:
+                    yield " ", old_line, new_line, self.content(i)
+                    old_line += 1
+                    new_line += 1
+
+    @property
+    def content_size(self) -> int:
+        """Total characters of the file's hunk lines."""
+        return sum(self.ends) - sum(self.starts)
+
+    def removed(self) -> List[str]:
+        return [self.content(i) for i, kind in enumerate(self.kinds) if kind == REMOVED]
+
+    def change_blocks(self) -> List[Tuple[List[str], List[str]]]:
+        """The runs of changed lines between context lines, in order, as (removed, added) pairs."""
+        blocks = []
+        for hunk in self.hunks:
+            removed: List[str] = []
+            added: List[str] = []
+            for i in range(hunk.first, hunk.last):
+                kind = self.kinds[i]
+                if kind == REMOVED:
+                    removed.append(self.content(i))
+                elif kind == ADDED:
+                    added.append(self.content(i))
+                elif removed or added:
+                    blocks.append((removed, added))
+                    removed, added = [], []
+            if removed or added:
+                blocks.append((removed, added))
+        return blocks
+
+    @property
+    def index(self) -> LineIndex:
+        if self._index is None:
+            self._index = LineIndex()
+            for hunk in self.hunks:
+                self._index.add(hunk.new_start, hunk.new_count)
+        return self._index
+
+    def unreviewable(self) -> Optional[str]:
+        """Why the new version has nothing to review, if so."""
+        if self.status in (FileStatus.DELETED, FileStatus.BINARY, FileStatus.TOO_LARGE):
+            return self.status
+        if not self.hunks:
+            return "rename only" if self.status == FileStatus.RENAMED else "no content change"
+        return None
+
+    def __repr__(self) -> str:
+        return f"FileDiff({self.path!r}, {self.status}, {len(self.hunks)} hunks, {len(self.added)} added lines)"
+
+
+class _FileAccumulator:
+    """
+    Line-at-a-time parsing state shared by `DiffParser.parse` and
+    `DiffParser.parse_stream`. Only the file currently being parsed is held.
+
+    With `buffer` (the whole diff text), line contents are recorded as
+    offsets into it. Without, each file's contents are joined into a buffer
+    of their own when the file ends.
+    """
+
+    def __init__(self, buffer: Optional[str] = None):
+        self.buffer = buffer
+        self.file: Optional[FileDiff] = None
+        self.parts: List[str] = []
+        self.size = 0
+        self.hunk: Optional[Hunk] = None
+        self.old_left = self.new_left = 0
+        self.new_line = 0
+        self.seen_new_header = False
+
+    def _start(self, path: str, old_path: Optional[str] = None) -> Optional[FileDiff]:
+        completed = self.finish()
+        self.file = FileDiff(path, old_path)
+        self.seen_new_header = False
+        return completed
+
+    def feed(self, line: str, offset: int = 0) -> Optional[FileDiff]:
+        """Consumes one diff line (at `offset` in the buffer, if any); returns the previous file once a new one starts."""
+        if self.hunk is not None:
+            if self._feed_hunk(line, offset):
+                return None
+            self.hunk.last = len(self.file.kinds)
+            self.hunk = None
+
+        if line.startswith("diff --git "):
+            match = git_header_pattern.match(line)
+            if match:
+                return self._start(match.group(2), match.group(1))
+            return self._start("")
+
+        # Plain unified diffs have no "diff --git" line; "---" opens a file.
+        if line.startswith("--- ") and (self.file is None or self.seen_new_header):
+            completed = self._start("")
+            old_path = _header_path(line[4:])
+            if old_path is None:
+                self.file.status = FileStatus.ADDED
+            else:
+                self.file.old_path = self.file.path = old_path
+            return completed
+
+        if self.file is None:
+            return None
+        file = self.file
+
+        chunk_match = chunk_header_pattern.match(line)
+        if chunk_match:
+            old_start, old_count, new_start, new_count = chunk_match.groups()
+            self.old_left = 1 if old_count is None else int(old_count)
+            self.new_left = 1 if new_count is None else int(new_count)
+            self.new_line = int(new_start)
+            self.hunk = Hunk(int(old_start), self.old_left, self.new_line, self.new_left, len(file.kinds))
+            file.hunks.append(self.hunk)
+            if not self.old_left and not self.new_left:
+                self.hunk = None
+            return None
+
+        if line.startswith("--- "):
+            old_path = _header_path(line[4:])
+            if old_path is None:
+                file.status = FileStatus.ADDED
+            else:
+                file.old_path = old_path
+        elif line.startswith("+++ "):
+            self.seen_new_header = True
+            new_path = _header_path(line[4:])
+            if new_path is None:
+                file.status = FileStatus.DELETED
+                file.path = file.path or file.old_path
+            else:
+                file.path = new_path
+                if file.status == FileStatus.MODIFIED and file.old_path not in ("", new_path):
+                    file.status = FileStatus.RENAMED
+        elif line.startswith("new file mode"):
+            file.status = FileStatus.ADDED
+        elif line.startswith("deleted file mode"):
+            file.status = FileStatus.DELETED
+        elif line.startswith("rename from "):
+            file.old_path = line[12:]
+            file.status = FileStatus.RENAMED
+        elif line.startswith("rename to "):
+            file.path = line[10:]
+            file.status = FileStatus.RENAMED
+        elif line.startswith("Binary files ") or line.startswith("GIT binary patch"):
+            file.status = FileStatus.BINARY
+        elif line == TOO_LARGE_LINE:
+            file.status = FileStatus.TOO_LARGE
+        return None
+
+    def _feed_hunk(self, line: str, offset: int) -> bool:
+        """Records one hunk line; returns False if `line` is not part of the hunk."""
+        # This runs for nearly every line of a diff, so it is kept flat.
+        file = self.file
+        kind = line[:1]
+        if kind == "+" and self.new_left:
+            file.added.append(len(file.kinds))
+            file.added_lines.append(self.new_line)
+            file.kinds.append(ADDED)
+            self.new_line += 1
+            self.new_left -= 1
+        elif kind == "-" and self.old_left:
+            file.kinds.append(REMOVED)
+            self.old_left -= 1
+        elif (kind == " " or not line) and self.old_left and self.new_left:
+            # Some tools strip the space from empty context lines.
+            file.kinds.append(CONTEXT)
+            self.new_line += 1
+            self.old_left -= 1
+            self.new_left -= 1
+        elif kind == "\\":
+            return True  # "\ No newline at end of file"
+        else:
+            return False
+
+        if self.buffer is not None:
+            file.starts.append(offset + 1)
+            file.ends.append(offset + max(len(line), 1))
+        else:
+            content = line[1:]
+            self.parts.append(content)
+            file.starts.append(self.size)
+            self.size += len(content)
+            file.ends.append(self.size)
+            self.size += 1
+
+        if not self.old_left and not self.new_left:
+            self.hunk.last = len(file.kinds)
+            self.hunk = None
+        return True
+
+    def finish(self) -> Optional[FileDiff]:
+        file = self.file
+        if file is None:
+            return None
+        if self.buffer is not None:
+            file.buffer = self.buffer
+        else:
+            file.buffer = "\n".join(self.parts)
+        if self.hunk is not None:
+            self.hunk.last = len(file.kinds)
+        self.file = None
+        self.hunk = None
+        self.parts = []
+        self.size = 0
+        return file if file.path else None
+
 
 class DiffParser:
     @staticmethod
-    def parse(diff_text: str) -> Dict[str, List[Tuple[int, str]]]:
+    def parse(diff_text: str) -> Dict[str, FileDiff]:
         """
         Parses a unified diff string and returns a dictionary where:
-        - Key: File path
-        - Value: List of tuples (line_number, line_content) for added/modified lines.
-        
-        We only care about lines added in the new version for inline comments.
+        - Key: File path (in the new version; the old path for deleted files)
+        - Value: FileDiff, a sequence of (line_number, line_content) for added lines.
+
+        Line contents are offsets into `diff_text`, which the result keeps alive.
         """
         changes = {}
-        current_file = None
-        current_line_number = 0
-        
-        # Regex to capture the new file path from lines like "+++ b/path/to/file.py"
-        file_header_pattern = re.compile(r'^\+\+\+ b/(.*)')
-        # Regex to capture chunk headers like "@@ -1,5 +1,5 @@"
-        chunk_header_pattern = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@')
-
-        lines = diff_text.split('\n')
-        
-        for line in lines:
-            # Check for file header
-            file_match = file_header_pattern.match(line)
-            if file_match:
-                current_file = file_match.group(1)
-                changes[current_file] = []
-                continue
-            
-            # Check for chunk header
-            chunk_match = chunk_header_pattern.match(line)
-            if chunk_match:
-                current_line_number = int(chunk_match.group(1))
-                continue
-            
-            # Process content lines
-            if current_file:
-                if line.startswith('+') and not line.startswith('+++'):
-                    # Added line
-                    content = line[1:] # Remove the '+'
-                    changes[current_file].append((current_line_number, content))
-                    current_line_number += 1
-                elif line.startswith(' ') or (line.startswith('-') and not line.startswith('---')):
-                    # Context line or removed line (removed lines don't increment new file line number, 
-                    # but context lines do)
-                    if not line.startswith('-'):
-                         current_line_number += 1
-                
-                # We ignore lines starting with '-' for line counting purposes in the NEW file,
-                # except to note that they don't advance the new file's line counter.
-                
+        accumulator = _FileAccumulator(diff_text)
+
+        offset = 0
+        for line in diff_text.split('\n'):
+            completed = accumulator.feed(line, offset)
+            if completed is not None:
+                changes[completed.path] = completed
+            offset += len(line) + 1
+
+        completed = accumulator.finish()
+        if completed is not None:
+            changes[completed.path] = completed
         return changes
+
+    @staticmethod
+    async def parse_stream(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[str, FileDiff]]:
+        """
+        Incremental variant of `parse` that consumes an async iterator of diff
+        lines (e.g. a streamed HTTP response) and yields (file_path, changes)
+        as soon as each file ends, so memory stays proportional to one file.
+        """
+        accumulator = _FileAccumulator()
+
+        async for line in lines:
+            completed = accumulator.feed(line.rstrip('\n'))
+            if completed is not None:
+                yield completed.path, completed
+
+        completed = accumulator.finish()
+        if completed is not None:
+            yield completed.path, completed
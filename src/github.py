@@ -1,63 +1,412 @@
-import httpx
+import asyncio
+import difflib
+import itertools
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
 from src.config import settings
 from src.utils.logger import logger
 from src.interfaces import GitProvider
+from src.http_client import HTTPClientRegistry, http_clients
+from src.diff_parser import TOO_LARGE_LINE
+from src.offload import offloader
+from src.prompt_builder import match_glob
+from src.reconcile import MARKER_TAG
+
+# Statuses the diff media type answers with when a PR is past its size limits
+DIFF_TOO_LARGE_STATUSES = (406, 422)
+
+
+def _unified_patch(old: str, new: str) -> str:
+    """The hunks of a unified diff between two versions of a file, like the files API's "patch"."""
+    lines = difflib.unified_diff(old.splitlines(), new.splitlines(), lineterm="")
+    return "\n".join(itertools.islice(lines, 2, None))  # without the ---/+++ headers
+
 
 class GitHubClient(GitProvider):
-    def __init__(self):
-        self.base_url = "https://api.github.com"
+    def __init__(self, http: Optional[HTTPClientRegistry] = None):
+        self.base_url = settings.GITHUB_API_URL
         self.headers = {
             "Authorization": f"token {settings.GITHUB_TOKEN}",
             "Accept": "application/vnd.github.v3+json"
         }
+        self.http = http or http_clients
+        # PR objects fetched by this client, shared by every call in a review
+        self._prs: Dict[Tuple[str, str, int], asyncio.Task] = {}
+        self._merge_bases: Dict[Tuple[str, str, int], asyncio.Task] = {}
+
+    async def get_pr(self, workspace: str, repo_slug: str, pr_id: int) -> Dict[str, Any]:
+        key = (workspace, repo_slug, pr_id)
+        task = self._prs.get(key)
+        if task is None:
+            task = self._prs[key] = asyncio.ensure_future(self._fetch_pr(workspace, repo_slug, pr_id))
+        try:
+            return await asyncio.shield(task)
+        except Exception:
+            if self._prs.get(key) is task:
+                del self._prs[key]
+            raise
+
+    async def _fetch_pr(self, workspace: str, repo_slug: str, pr_id: int) -> Dict[str, Any]:
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}"
+        client = self.http.get(url)
+        response = await client.get(url, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
 
     async def get_pr_diff(self, workspace: str, repo_slug: str, pr_id: int) -> str:
+        if await self._use_files_endpoint(workspace, repo_slug, pr_id):
+            return "\n".join([line async for line in self._stream_pr_files(workspace, repo_slug, pr_id)])
+
         # workspace in GitHub context is usually the owner
         url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}"
         headers = self.headers.copy()
         headers["Accept"] = "application/vnd.github.v3.diff"
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers)
+        client = self.http.get(url)
+        response = await client.get(url, headers=headers)
+        if response.status_code in DIFF_TOO_LARGE_STATUSES:
+            logger.info(f"Diff of PR #{pr_id} is too large for the diff endpoint; fetching it per file.")
+            return "\n".join([line async for line in self._stream_pr_files(workspace, repo_slug, pr_id)])
+        response.raise_for_status()
+        return response.text
+
+    async def stream_pr_diff(self, workspace: str, repo_slug: str, pr_id: int) -> AsyncIterator[str]:
+        if await self._use_files_endpoint(workspace, repo_slug, pr_id):
+            async for line in self._stream_pr_files(workspace, repo_slug, pr_id):
+                yield line
+            return
+
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}"
+        headers = self.headers.copy()
+        headers["Accept"] = "application/vnd.github.v3.diff"
+
+        client = self.http.get(url)
+        too_large = False
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code in DIFF_TOO_LARGE_STATUSES:
+                too_large = True
+            else:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    yield line
+        if too_large:
+            logger.info(f"Diff of PR #{pr_id} is too large for the diff endpoint; fetching it per file.")
+            async for line in self._stream_pr_files(workspace, repo_slug, pr_id):
+                yield line
+
+    async def _use_files_endpoint(self, workspace: str, repo_slug: str, pr_id: int) -> bool:
+        mode = settings.GITHUB_DIFF_MODE
+        if mode != "auto":
+            return mode == "files"
+        try:
+            pr = await self.get_pr(workspace, repo_slug, pr_id)
+        except Exception as e:
+            logger.warning(f"Failed to fetch the size of PR #{pr_id}; using the diff endpoint: {e}")
+            return False
+        changed_lines = pr.get("additions", 0) + pr.get("deletions", 0)
+        return pr.get("changed_files", 0) > settings.GITHUB_DIFF_MAX_FILES or changed_lines > settings.GITHUB_DIFF_MAX_LINES
+
+    async def _stream_pr_files(self, workspace: str, repo_slug: str, pr_id: int) -> AsyncIterator[str]:
+        """
+        Yields the PR diff assembled from the paginated pulls/{n}/files
+        endpoint, one page at a time as pages arrive. This works past the
+        diff endpoint's limits, up to GitHub's 3000 listed files.
+        """
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}/files"
+        listed = 0
+        async for files in self._iter_pages(url):
+            listed += len(files)
+            for entry in files:
+                for line in await self._file_diff_lines(workspace, repo_slug, pr_id, entry):
+                    yield line
+        if listed >= 3000:
+            logger.warning(f"PR #{pr_id} lists {listed} files, GitHub's maximum; later files are not reviewed.")
+
+    async def _file_diff_lines(self, workspace: str, repo_slug: str, pr_id: int, entry: Dict[str, Any]) -> List[str]:
+        """Renders one pulls/{n}/files entry as the lines of a git diff."""
+        path = entry["filename"]
+        old_path = entry.get("previous_filename") or path
+        status = entry.get("status")
+        lines = [f"diff --git a/{old_path} b/{path}"]
+        if status == "added":
+            lines.append("new file mode 100644")
+        elif status == "removed":
+            lines.append("deleted file mode 100644")
+        elif old_path != path:
+            lines.extend((f"rename from {old_path}", f"rename to {path}"))
+
+        patch = entry.get("patch")
+        if patch is None:
+            # GitHub leaves the patch out of binary files (which count no
+            # changed lines) and of diffs too large to render.
+            if status == "removed" or (old_path != path and not entry.get("changes")):
+                return lines
+            if not entry.get("changes"):
+                lines.append(f"Binary files a/{old_path} and b/{path} differ")
+                return lines
+            patch = await self._fetch_missing_patch(workspace, repo_slug, pr_id, entry, old_path)
+            if patch is None:
+                lines.append(TOO_LARGE_LINE)
+                return lines
+
+        lines.append("--- /dev/null" if status == "added" else f"--- a/{old_path}")
+        lines.append("+++ /dev/null" if status == "removed" else f"+++ b/{path}")
+        lines.extend(patch.split("\n"))
+        return lines
+
+    async def _fetch_missing_patch(self, workspace: str, repo_slug: str, pr_id: int, entry: Dict[str, Any],
+                                   old_path: str) -> Optional[str]:
+        """Diffs both versions of a file whose patch GitHub left out, unless the model would never see it."""
+        path = entry["filename"]
+        if match_glob(path, settings.PROMPT_EXCLUDE_GLOBS) is not None:
+            return None
+        try:
+            pr = await self.get_pr(workspace, repo_slug, pr_id)
+            head = pr["head"]["sha"]
+            if entry.get("status") == "added":
+                old, new = "", await self._fetch_contents(workspace, repo_slug, path, head)
+            else:
+                base = await self._merge_base(workspace, repo_slug, pr_id)
+                old, new = await asyncio.gather(
+                    self._fetch_contents(workspace, repo_slug, old_path, base),
+                    self._fetch_contents(workspace, repo_slug, path, head)
+                )
+        except Exception as e:
+            logger.warning(f"Failed to fetch the contents of {path}: {e}")
+            return None
+        if new is None or old is None:
+            logger.info(f"Skipping {path}: larger than {settings.GITHUB_FILE_FETCH_MAX_BYTES} bytes or not text.")
+            return None
+        return await offloader.run("diff", _unified_patch, old, new, size=len(old) + len(new))
+
+    async def _merge_base(self, workspace: str, repo_slug: str, pr_id: int) -> str:
+        # Patches are relative to the merge base, not the current base branch.
+        # It is looked up once per review, and only if a patch is missing.
+        key = (workspace, repo_slug, pr_id)
+        task = self._merge_bases.get(key)
+        if task is None:
+            task = self._merge_bases[key] = asyncio.ensure_future(self._fetch_merge_base(workspace, repo_slug, pr_id))
+        return await asyncio.shield(task)
+
+    async def _fetch_merge_base(self, workspace: str, repo_slug: str, pr_id: int) -> str:
+        pr = await self.get_pr(workspace, repo_slug, pr_id)
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/compare/{pr['base']['sha']}...{pr['head']['sha']}"
+        client = self.http.get(url)
+        response = await client.get(url, headers=self.headers, params={"per_page": 1})
+        response.raise_for_status()
+        return response.json()["merge_base_commit"]["sha"]
+
+    async def _fetch_contents(self, workspace: str, repo_slug: str, path: str, ref: str) -> Optional[str]:
+        """The file at `ref`, or None if it is larger than GITHUB_FILE_FETCH_MAX_BYTES or not UTF-8 text."""
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/contents/{quote(path)}"
+        headers = self.headers.copy()
+        headers["Accept"] = "application/vnd.github.v3.raw"
+
+        client = self.http.get(url)
+        chunks = []
+        size = 0
+        async with client.stream("GET", url, headers=headers, params={"ref": ref}) as response:
             response.raise_for_status()
-            return response.text
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > settings.GITHUB_FILE_FETCH_MAX_BYTES:
+                    return None
+                chunks.append(chunk)
+        try:
+            return b"".join(chunks).decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+
+    async def list_open_prs(self, workspace: str, repo_slug: str) -> List[Dict[str, Any]]:
+        # The pulls listing defaults to open PRs.
+        pulls = await self._list_pages(f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls")
+        return [{"id": pr["number"], "head_sha": pr["head"]["sha"]} for pr in pulls]
+
+    async def get_pr_head_sha(self, workspace: str, repo_slug: str, pr_id: int) -> str:
+        pr = await self.get_pr(workspace, repo_slug, pr_id)
+        return pr["head"]["sha"]
+
+    async def get_incremental_diff(self, workspace: str, repo_slug: str, base_sha: str, head_sha: str) -> Optional[str]:
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/compare/{base_sha}...{head_sha}"
+        client = self.http.get(url)
+
+        # 1. Make sure head is strictly ahead of base; "diverged" or "behind"
+        #    means history was rewritten and the delta is meaningless.
+        response = await client.get(url, headers=self.headers)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        if response.json().get("status") not in ("ahead", "identical"):
+            return None
+
+        # 2. Fetch the delta as a unified diff
+        headers = self.headers.copy()
+        headers["Accept"] = "application/vnd.github.v3.diff"
+        response = await client.get(url, headers=headers)
+        response.raise_for_status()
+        return response.text
 
     async def post_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str):
         # GitHub PRs are issues, so we post to the issues endpoint for general comments
         url = f"{self.base_url}/repos/{workspace}/{repo_slug}/issues/{pr_id}/comments"
         payload = {"body": content}
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=self.headers)
-            if response.status_code != 201:
-                logger.error(f"Failed to post GitHub comment: {response.text}")
-                response.raise_for_status()
-            return response.json()
+        client = self.http.get(url)
+        response = await client.post(url, json=payload, headers=self.headers)
+        if response.status_code != 201:
+            logger.error(f"Failed to post GitHub comment: {response.text}")
+            response.raise_for_status()
+        return response.json()
 
-    async def post_inline_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str, path: str, line: int):
+    async def post_inline_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str, path: str, line: int,
+                                  commit_id: Optional[str] = None):
         # For inline comments, we need the commit_id. 
-        # We'll fetch the PR details first to get the head commit SHA.
-        pr_url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}"
+        # If the caller doesn't know it, fetch the PR details to get the head commit SHA.
+        if commit_id is None:
+            commit_id = await self.get_pr_head_sha(workspace, repo_slug, pr_id)
+
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}/comments"
+        payload = {
+            "body": content,
+            "path": path,
+            "line": line,
+            "side": "RIGHT", # Assume commenting on the new version
+            "commit_id": commit_id
+        }
         
-        async with httpx.AsyncClient() as client:
-            # 1. Get PR details for commit_id
-            pr_resp = await client.get(pr_url, headers=self.headers)
-            pr_resp.raise_for_status()
-            pr_data = pr_resp.json()
-            commit_id = pr_data["head"]["sha"]
-
-            # 2. Post review comment
-            url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}/comments"
-            payload = {
-                "body": content,
-                "path": path,
-                "line": line,
-                "side": "RIGHT", # Assume commenting on the new version
-                "commit_id": commit_id
+        client = self.http.get(url)
+        response = await client.post(url, json=payload, headers=self.headers)
+        if response.status_code != 201:
+            logger.error(f"Failed to post GitHub inline comment: {response.text}")
+            # Log but don't crash
+        return response.json()
+
+    async def _iter_pages(self, url: str) -> AsyncIterator[List[Dict[str, Any]]]:
+        # The first page's Link header names the last page, so the remaining
+        # pages are fetched concurrently rather than by following "next".
+        # Pages are still yielded in order.
+        client = self.http.get(url)
+
+        async def fetch(page: int):
+            response = await client.get(url, headers=self.headers, params={"per_page": 100, "page": page})
+            response.raise_for_status()
+            return response
+
+        first = await fetch(1)
+        yield first.json()
+        last_url = first.links.get("last", {}).get("url")
+        if not last_url:
+            return
+        last_page = int(parse_qs(urlsplit(last_url).query).get("page", ["1"])[0])
+        tasks = [asyncio.ensure_future(fetch(page)) for page in range(2, last_page + 1)]
+        try:
+            for task in tasks:
+                yield (await task).json()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _list_pages(self, url: str) -> List[Dict[str, Any]]:
+        items = []
+        async for page in self._iter_pages(url):
+            items.extend(page)
+        return items
+
+    async def list_bot_comments(self, workspace: str, repo_slug: str, pr_id: int) -> List[Dict[str, Any]]:
+        # The summary is a review body (or an issue comment if the review
+        # fell back to individual comments); findings are review comments.
+        repo_url = f"{self.base_url}/repos/{workspace}/{repo_slug}"
+        reviews, issue_comments, review_comments = await asyncio.gather(
+            self._list_pages(f"{repo_url}/pulls/{pr_id}/reviews"),
+            self._list_pages(f"{repo_url}/issues/{pr_id}/comments"),
+            self._list_pages(f"{repo_url}/pulls/{pr_id}/comments"),
+        )
+        comments = []
+        for kind, items in (("review", reviews), ("issue", issue_comments)):
+            comments.extend(
+                {"id": c["id"], "kind": kind, "body": c["body"]}
+                for c in items if MARKER_TAG in (c.get("body") or "")
+            )
+        comments.extend(
+            {
+                "id": c["id"], "kind": "inline", "body": c["body"], "path": c.get("path"),
+                # GitHub clears "line" once the code under a comment changes.
+                "line": c.get("line") or c.get("original_line"), "outdated": c.get("line") is None,
             }
-            
-            response = await client.post(url, json=payload, headers=self.headers)
-            if response.status_code != 201:
-                logger.error(f"Failed to post GitHub inline comment: {response.text}")
-                # Log but don't crash
+            for c in review_comments if MARKER_TAG in (c.get("body") or "")
+        )
+        return comments
+
+    def _comment_url(self, workspace: str, repo_slug: str, pr_id: int, comment: Dict[str, Any]) -> str:
+        repo_url = f"{self.base_url}/repos/{workspace}/{repo_slug}"
+        if comment["kind"] == "review":
+            return f"{repo_url}/pulls/{pr_id}/reviews/{comment['id']}"
+        if comment["kind"] == "issue":
+            return f"{repo_url}/issues/comments/{comment['id']}"
+        return f"{repo_url}/pulls/comments/{comment['id']}"
+
+    async def update_comment(self, workspace: str, repo_slug: str, pr_id: int, comment: Dict[str, Any], body: str):
+        url = self._comment_url(workspace, repo_slug, pr_id, comment)
+        client = self.http.get(url)
+        # Review bodies are replaced with PUT, comments are edited with PATCH.
+        method = "PUT" if comment["kind"] == "review" else "PATCH"
+        response = await client.request(method, url, json={"body": body}, headers=self.headers)
+        if response.status_code != 200:
+            logger.error(f"Failed to update GitHub comment {comment['id']}: {response.text}")
+            response.raise_for_status()
+        return response.json()
+
+    async def delete_comment(self, workspace: str, repo_slug: str, pr_id: int, comment: Dict[str, Any]):
+        if comment["kind"] == "review":
+            raise ValueError("Submitted GitHub reviews cannot be deleted")
+        url = self._comment_url(workspace, repo_slug, pr_id, comment)
+        client = self.http.get(url)
+        response = await client.delete(url, headers=self.headers)
+        if response.status_code != 204:
+            logger.error(f"Failed to delete GitHub comment {comment['id']}: {response.text}")
+            response.raise_for_status()
+
+    async def publish_review(self, workspace: str, repo_slug: str, pr_id: int, summary: str,
+                             comments: List[Dict[str, Any]], commit_id: Optional[str] = None):
+        # A single pull request review carries the summary and every inline comment.
+        url = f"{self.base_url}/repos/{workspace}/{repo_slug}/pulls/{pr_id}/reviews"
+        payload = {
+            "body": summary,
+            "event": "COMMENT",
+            "comments": [
+                {"path": c["path"], "line": c["line"], "side": "RIGHT", "body": c["body"]}
+                for c in comments
+            ]
+        }
+        if commit_id:
+            payload["commit_id"] = commit_id
+
+        client = self.http.get(url)
+        response = await client.post(url, json=payload, headers=self.headers)
+        if response.status_code == 200:
             return response.json()
+
+        logger.error(f"Failed to publish GitHub review: {response.text}")
+        if response.status_code != 422 or not comments:
+            response.raise_for_status()
+
+        # GitHub rejects the whole review if any comment can't be placed, so
+        # fall back to posting the comments individually (and concurrently).
+        if summary:
+            await self.post_comment(workspace, repo_slug, pr_id, summary)
+        if commit_id is None:
+            commit_id = await self.get_pr_head_sha(workspace, repo_slug, pr_id)
+
+        semaphore = asyncio.Semaphore(settings.COMMENT_POST_CONCURRENCY)
+
+        async def post(comment: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    await self.post_inline_comment(
+                        workspace, repo_slug, pr_id, comment["body"], comment["path"], comment["line"],
+                        commit_id=commit_id
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to post GitHub inline comment on {comment['path']}:{comment['line']}: {e}")
+
+        await asyncio.gather(*(post(comment) for comment in comments))
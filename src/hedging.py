@@ -0,0 +1,148 @@
+import asyncio
+import math
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+from src.config import settings
+from src.metrics import LLM_HEDGES_TOTAL
+
+T = TypeVar("T")
+
+# Called by an attempt once it has a result the caller may observe (a
+# complete response, or the first streamed token). Returns False if another
+# attempt got there first, in which case the attempt should stop.
+Commit = Callable[[], bool]
+
+
+class LatencyTracker:
+    """
+    Rolling window of request latencies per key (e.g. model), normalized by
+    request size so one distribution serves small and large prompts.
+    `units` is the request size in thousands of tokens, prompt plus
+    completion budget.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, key: str, seconds: float, units: float):
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.window)
+        samples.append(seconds / max(units, 0.1))
+
+    def quantile(self, key: str, q: float, units: float) -> Optional[float]:
+        """Expected `q` quantile in seconds for a request of `units`, or None until enough samples exist."""
+        samples = self._samples.get(key)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        rank = max(0, math.ceil(q * len(ordered)) - 1)  # nearest-rank
+        return ordered[rank] * max(units, 0.1)
+
+
+class HedgeBudget:
+    """
+    Limits hedged requests to `ratio` of all requests: every request earns
+    `ratio` of a token, up to `burst`, and each hedge spends one. A router
+    that stalls across the board is not sent twice the traffic.
+    """
+
+    def __init__(self, ratio: float, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+
+    def record_request(self):
+        self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class HedgePolicy:
+    """Adaptive timeouts and hedge delays for router calls, from observed latencies."""
+
+    def __init__(self, enabled: bool, quantile: float, budget: float, timeout_multiplier: float,
+                 timeout_min: float, timeout_max: float, window: int):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.timeout_multiplier = timeout_multiplier
+        self.timeout_min = timeout_min
+        self.timeout_max = timeout_max
+        self.latency = LatencyTracker(window)
+        self.budget = HedgeBudget(budget)
+
+    def timeout(self, key: str, units: float) -> float:
+        """A multiple of the p99 latency for this size, clamped; `timeout_max` until there is data."""
+        p99 = self.latency.quantile(key, 0.99, units)
+        if p99 is None:
+            return self.timeout_max
+        return min(self.timeout_max, max(self.timeout_min, p99 * self.timeout_multiplier))
+
+    def hedge_after(self, key: str, units: float) -> Optional[float]:
+        """Seconds after which a duplicate request is sent, or None to never hedge."""
+        if not self.enabled:
+            return None
+        return self.latency.quantile(key, self.quantile, units)
+
+    async def race(self, attempt: Callable[[Commit], Awaitable[T]], hedge_after: Optional[float]) -> T:
+        """
+        Runs `attempt`; if it has not committed after `hedge_after` seconds
+        and the budget allows, starts a duplicate. The first attempt to
+        commit wins and the other is cancelled. If no attempt commits, the
+        first one's result is returned.
+        """
+        winner: asyncio.Future = asyncio.get_running_loop().create_future()
+
+        def start(index: int) -> asyncio.Task:
+            def commit() -> bool:
+                if not winner.done():
+                    winner.set_result(index)
+                return winner.result() == index
+            return asyncio.create_task(attempt(commit))
+
+        self.budget.record_request()
+        tasks: List[asyncio.Task] = [start(0)]
+        try:
+            if hedge_after is not None:
+                await asyncio.wait([tasks[0], winner], timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED)
+                if not winner.done() and not tasks[0].done():
+                    if self.budget.try_spend():
+                        tasks.append(start(1))
+                    else:
+                        LLM_HEDGES_TOTAL.inc(result="over_budget")
+
+            pending = set(tasks)
+            while pending and not winner.done():
+                _, pending = await asyncio.wait(pending | {winner}, return_when=asyncio.FIRST_COMPLETED)
+                pending.discard(winner)
+
+            if not winner.done():
+                return tasks[0].result()
+            index = winner.result()
+            if len(tasks) > 1:
+                LLM_HEDGES_TOTAL.inc(result="won" if index == 1 else "lost")
+            for i, task in enumerate(tasks):
+                if i != index:
+                    task.cancel()
+            return await tasks[index]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+hedge_policy = HedgePolicy(
+    settings.AI_HEDGING_ENABLED,
+    settings.AI_HEDGE_QUANTILE,
+    settings.AI_HEDGE_BUDGET,
+    settings.AI_TIMEOUT_MULTIPLIER,
+    settings.AI_TIMEOUT_MIN,
+    settings.AI_TIMEOUT_MAX,
+    settings.AI_LATENCY_WINDOW,
+)
@@ -0,0 +1,129 @@
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional, Tuple
+import httpx
+from src.metrics import HTTP_CACHE_TOTAL
+
+
+@dataclass
+class CachedResponse:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    headers: List[Tuple[bytes, bytes]]
+    content: bytes
+
+
+class ConditionalCache:
+    """
+    In-memory LRU of GET responses that carry an `ETag` or `Last-Modified`
+    validator, bounded by total body size.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._size = 0
+
+    @staticmethod
+    def make_key(request: httpx.Request) -> str:
+        # Responses differ by representation and by who is asking.
+        auth = hashlib.sha256(request.headers.get("Authorization", "").encode()).hexdigest()
+        return f"{request.url}|{request.headers.get('Accept', '')}|{auth}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse):
+        if len(entry.content) > self.max_entry_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous.content)
+        self._entries[key] = entry
+        self._size += len(entry.content)
+        while self._size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted.content)
+
+
+class _CachingStream(httpx.AsyncByteStream):
+    """Passes a response body through, storing it in the cache once fully read."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, cache: ConditionalCache, key: str,
+                 etag: Optional[str], last_modified: Optional[str], headers: List[Tuple[bytes, bytes]]):
+        self.stream = stream
+        self.cache = cache
+        self.key = key
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        chunks: Optional[List[bytes]] = []
+        size = 0
+        async for chunk in self.stream:
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.cache.max_entry_bytes:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            self.cache.put(self.key, CachedResponse(self.etag, self.last_modified, self.headers, b"".join(chunks)))
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+class ConditionalCacheTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that revalidates cached GET responses with
+    `If-None-Match` / `If-Modified-Since` and replays the cached body when
+    the server answers `304 Not Modified`. GitHub does not count 304s
+    against the rate limit, so unchanged PR metadata and diffs are free.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, cache: ConditionalCache):
+        self.transport = transport
+        self.cache = cache
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET" or "If-None-Match" in request.headers or "If-Modified-Since" in request.headers:
+            return await self.transport.handle_async_request(request)
+
+        key = self.cache.make_key(request)
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry.etag:
+                request.headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                request.headers["If-Modified-Since"] = entry.last_modified
+
+        response = await self.transport.handle_async_request(request)
+        host = request.url.host
+
+        if response.status_code == 304 and entry is not None:
+            await response.aclose()
+            HTTP_CACHE_TOTAL.inc(host=host, result="not_modified")
+            return httpx.Response(200, headers=entry.headers, content=entry.content,
+                                  extensions=response.extensions, request=request)
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code != 200 or not (etag or last_modified):
+            HTTP_CACHE_TOTAL.inc(host=host, result="uncacheable")
+            return response
+
+        HTTP_CACHE_TOTAL.inc(host=host, result="miss")
+        stream = _CachingStream(response.stream, self.cache, key, etag, last_modified, response.headers.raw)
+        return httpx.Response(response.status_code, headers=response.headers, stream=stream,
+                              extensions=response.extensions, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,75 @@
+import httpx
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+from src.config import settings
+from src.http_cache import ConditionalCache, ConditionalCacheTransport
+from src.rate_limiter import RateLimitedTransport, TokenBucket
+from src.utils.logger import logger
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class HTTPClientRegistry:
+    """
+    Process-wide registry of pooled httpx.AsyncClient instances, one per host.
+
+    Clients are created lazily on first use and keep their connections alive
+    between requests, so repeated calls to the same API reuse TLS sessions
+    instead of opening a new socket each time. Every request is scheduled
+    through a per-host rate limiter with retries, and GET responses are
+    revalidated with ETags when cached. Call `aclose()` on shutdown.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self.cache: Optional[ConditionalCache] = None
+        if settings.HTTP_CACHE_ENABLED:
+            self.cache = ConditionalCache(settings.HTTP_CACHE_MAX_BYTES, settings.HTTP_CACHE_MAX_ENTRY_BYTES)
+        self.http2 = settings.HTTP2_ENABLED and _http2_available()
+        if settings.HTTP2_ENABLED and not self.http2:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed; falling back to HTTP/1.1.")
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        """Returns the shared client for the host of `url`, creating it if needed."""
+        key = self._host_key(url)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(
+                max_connections=settings.HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+            )
+            transport = RateLimitedTransport(
+                httpx.AsyncHTTPTransport(limits=limits, http2=self.http2),
+                TokenBucket(settings.RATE_LIMIT_REQUESTS_PER_SECOND, settings.RATE_LIMIT_BURST),
+                max_retries=settings.HTTP_MAX_RETRIES,
+                backoff_base=settings.HTTP_BACKOFF_BASE,
+                backoff_max=settings.HTTP_BACKOFF_MAX,
+                max_wait=settings.HTTP_RATE_LIMIT_MAX_WAIT,
+            )
+            if self.cache is not None:
+                transport = ConditionalCacheTransport(transport, self.cache)
+            client = httpx.AsyncClient(transport=transport, timeout=settings.HTTP_TIMEOUT)
+            self._clients[key] = client
+        return client
+
+    async def aclose(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+
+http_clients = HTTPClientRegistry()
+
@@ -1,14 +1,79 @@
 from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 class GitProvider(ABC):
+    """
+    A Git hosting API. A provider instance is created per review, so PR
+    metadata it fetches (e.g. the head commit) is reused for the rest of
+    that review.
+    """
+
     @abstractmethod
     async def get_pr_diff(self, workspace: str, repo_slug: str, pr_id: int) -> str:
         pass
 
+    async def stream_pr_diff(self, workspace: str, repo_slug: str, pr_id: int) -> AsyncIterator[str]:
+        """
+        Yields the lines of the PR diff as they are downloaded. Providers that
+        cannot stream fall back to splitting the full diff.
+        """
+        diff_text = await self.get_pr_diff(workspace, repo_slug, pr_id)
+        for line in diff_text.split('\n'):
+            yield line
+
+    @abstractmethod
+    async def list_open_prs(self, workspace: str, repo_slug: str) -> List[Dict[str, Any]]:
+        """
+        Returns the repository's open PRs as dicts with "id" and "head_sha".
+        Pages are fetched concurrently where the API allows it.
+        """
+        pass
+
+    @abstractmethod
+    async def get_pr_head_sha(self, workspace: str, repo_slug: str, pr_id: int) -> str:
+        pass
+
+    @abstractmethod
+    async def get_incremental_diff(self, workspace: str, repo_slug: str, base_sha: str, head_sha: str) -> Optional[str]:
+        """
+        Returns the diff of the commits from `base_sha` to `head_sha`, or None
+        if `base_sha` is no longer an ancestor of `head_sha` (e.g. after a force-push).
+        """
+        pass
+
     @abstractmethod
     async def post_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str):
         pass
 
     @abstractmethod
-    async def post_inline_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str, path: str, line: int):
+    async def post_inline_comment(self, workspace: str, repo_slug: str, pr_id: int, content: str, path: str, line: int,
+                                  commit_id: Optional[str] = None):
+        pass
+
+    @abstractmethod
+    async def list_bot_comments(self, workspace: str, repo_slug: str, pr_id: int) -> List[Dict[str, Any]]:
+        """
+        Returns every comment on the PR that carries the bot's marker, as dicts
+        with "id", "body", and for inline comments "path", "line" and
+        "outdated". Pages are fetched concurrently where the API allows it.
+        """
+        pass
+
+    @abstractmethod
+    async def update_comment(self, workspace: str, repo_slug: str, pr_id: int, comment: Dict[str, Any], body: str):
+        """Replaces the body of a comment returned by `list_bot_comments`."""
+        pass
+
+    @abstractmethod
+    async def delete_comment(self, workspace: str, repo_slug: str, pr_id: int, comment: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    async def publish_review(self, workspace: str, repo_slug: str, pr_id: int, summary: str,
+                             comments: List[Dict[str, Any]], commit_id: Optional[str] = None):
+        """
+        Publishes a summary and a batch of inline comments in as few requests
+        as possible. Each comment is a dict with "path", "line" and "body".
+        An empty summary publishes only the comments.
+        """
         pass
@@ -0,0 +1,296 @@
+import asyncio
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from src.interfaces import GitProvider
+from src.leases import LeaseBackend, acquire_lease, keep_lease, make_owner_id, release_lease
+from src.utils.logger import logger
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class ReviewJob:
+    job_id: int
+    provider: str
+    workspace: str
+    repo_slug: str
+    pr_id: int
+    enqueued_at: float
+
+    @staticmethod
+    def make_key(provider: str, workspace: str, repo_slug: str, pr_id: int) -> str:
+        return f"{provider}:{workspace}/{repo_slug}#{pr_id}"
+
+    @property
+    def pr_key(self) -> str:
+        return self.make_key(self.provider, self.workspace, self.repo_slug, self.pr_id)
+
+
+ReviewHandler = Callable[[GitProvider, str, str, int], Awaitable[None]]
+
+
+class ReviewQueue:
+    """
+    Durable review queue with a bounded worker pool and per-PR coalescing.
+
+    Jobs are persisted to SQLite so pending reviews survive a restart. Only
+    the newest event per PR is kept: enqueueing a PR that is already pending
+    replaces the pending job, and a review already in flight for that PR is
+    cancelled since its result would be stale.
+
+    Several processes (e.g. uvicorn workers) may share one queue file. Each
+    row is claimed by the process that enqueued it, or atomically by one
+    process when it is unclaimed or its claim is older than `lease_ttl`, and
+    only the claiming process runs it. Claims are refreshed every third of
+    `lease_ttl`, released on a clean stop, and those of a crashed process
+    are taken over once they expire.
+
+    With a lease backend, each review also holds a per-PR lease, renewed by
+    a heartbeat while it runs, so other workers and nodes never review the
+    same PR at the same time. A job whose PR is leased elsewhere is retried
+    after `lease_retry_interval`; a review that loses its lease is stopped
+    and retried the same way.
+    """
+
+    def __init__(self, path: str, handler: ReviewHandler,
+                 providers: Dict[str, Callable[[], GitProvider]],
+                 workers: int = 4, max_size: int = 100,
+                 leases: Optional[LeaseBackend] = None, lease_ttl: float = 60.0,
+                 lease_retry_interval: float = 5.0):
+        self.path = path
+        self.handler = handler
+        self.providers = providers
+        self.workers = workers
+        self.max_size = max_size
+        self.leases = leases
+        self.lease_ttl = lease_ttl
+        self.lease_retry_interval = lease_retry_interval
+        self._pending: "OrderedDict[str, ReviewJob]" = OrderedDict()
+        self._running: Dict[str, asyncio.Task] = {}
+        self._condition: Optional[asyncio.Condition] = None
+        self._worker_tasks = []
+        self._retry_tasks: Set[asyncio.Task] = set()
+        self._claims_task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # Identifies this process's claims on shared queue rows
+        self.owner = make_owner_id()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            # enqueue() runs on the webhook path: don't fsync every commit.
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS review_jobs ("
+                "job_id INTEGER PRIMARY KEY AUTOINCREMENT, pr_key TEXT UNIQUE NOT NULL, "
+                "provider TEXT NOT NULL, workspace TEXT NOT NULL, repo_slug TEXT NOT NULL, "
+                "pr_id INTEGER NOT NULL, enqueued_at REAL NOT NULL, owner TEXT, claimed_at REAL)"
+            )
+            # Queue files from before claims were added
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(review_jobs)")}
+            for column, kind in (("owner", "TEXT"), ("claimed_at", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE review_jobs ADD COLUMN {column} {kind}")
+            self._conn.commit()
+        return self._conn
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    async def start(self):
+        self._condition = asyncio.Condition()
+
+        # Resume jobs persisted by a previous process, oldest first
+        jobs = self._claim()
+        for job in jobs:
+            self._pending[job.pr_key] = job
+        if jobs:
+            logger.info(f"Resumed {len(jobs)} pending review jobs.")
+
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._claims_task = asyncio.create_task(self._maintain_claims())
+
+    async def stop(self):
+        # In-flight jobs stay persisted and are resumed on the next start, or
+        # by another process sharing the queue file.
+        tasks = self._worker_tasks + list(self._running.values()) + list(self._retry_tasks)
+        if self._claims_task is not None:
+            tasks.append(self._claims_task)
+            self._claims_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._conn is not None:
+            try:
+                self._conn.execute("UPDATE review_jobs SET owner = NULL WHERE owner = ?", (self.owner,))
+                self._conn.commit()
+            except Exception as e:
+                logger.warning(f"Failed to release review queue claims: {e}")
+            self._conn.close()
+            self._conn = None
+
+    def _claim(self) -> List[ReviewJob]:
+        """Atomically claims unclaimed and expired rows; returns them oldest first."""
+        conn = self._connect()
+        now = time.time()
+        rows = conn.execute(
+            "UPDATE review_jobs SET owner = ?, claimed_at = ? WHERE owner IS NULL OR claimed_at < ? "
+            "RETURNING job_id, provider, workspace, repo_slug, pr_id, enqueued_at",
+            (self.owner, now, now - self.lease_ttl)
+        ).fetchall()
+        conn.commit()
+        return sorted((ReviewJob(*row) for row in rows), key=lambda job: job.enqueued_at)
+
+    async def _maintain_claims(self):
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                conn = self._connect()
+                conn.execute("UPDATE review_jobs SET claimed_at = ? WHERE owner = ?", (time.time(), self.owner))
+                conn.commit()
+                # Take over the jobs of processes that stopped or crashed.
+                jobs = self._claim()
+            except Exception as e:
+                logger.warning(f"Review queue claim refresh failed: {e}")
+                continue
+            if jobs:
+                async with self._condition:
+                    for job in jobs:
+                        self._pending[job.pr_key] = job
+                    self._condition.notify_all()
+                logger.info(f"Took over {len(jobs)} pending review jobs from other workers.")
+
+    async def enqueue(self, provider: str, workspace: str, repo_slug: str, pr_id: int) -> ReviewJob:
+        if provider not in self.providers:
+            raise ValueError(f"Unknown provider: {provider}")
+
+        async with self._condition:
+            pr_key = ReviewJob.make_key(provider, workspace, repo_slug, pr_id)
+            if pr_key not in self._pending and len(self._pending) >= self.max_size:
+                raise QueueFullError(f"Review queue is full ({self.max_size} pending jobs)")
+
+            conn = self._connect()
+            now = time.time()
+            cursor = conn.execute(
+                "INSERT OR REPLACE INTO review_jobs "
+                "(pr_key, provider, workspace, repo_slug, pr_id, enqueued_at, owner, claimed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (pr_key, provider, workspace, repo_slug, pr_id, now, self.owner, now)
+            )
+            conn.commit()
+            job = ReviewJob(cursor.lastrowid, provider, workspace, repo_slug, pr_id, now)
+
+            if pr_key in self._pending:
+                # Keep the queue position of the superseded job
+                logger.info(f"Coalesced pending review for {pr_key}.")
+            self._pending[pr_key] = job
+
+            running = self._running.get(pr_key)
+            if running is not None:
+                logger.info(f"Cancelling stale in-flight review for {pr_key}.")
+                running.cancel()
+
+            self._condition.notify()
+            return job
+
+    def _next_job(self) -> Optional[ReviewJob]:
+        # Never run two reviews of the same PR at once
+        for pr_key, job in self._pending.items():
+            if pr_key not in self._running:
+                del self._pending[pr_key]
+                return job
+        return None
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                job = self._next_job()
+                while job is None:
+                    await self._condition.wait()
+                    job = self._next_job()
+                task = asyncio.create_task(self._run(job))
+                self._running[job.pr_key] = task
+
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    # The worker itself is being stopped
+                    task.cancel()
+                    raise
+            finally:
+                async with self._condition:
+                    if self._running.get(job.pr_key) is task:
+                        del self._running[job.pr_key]
+                    self._condition.notify_all()
+
+    async def _run(self, job: ReviewJob):
+        owner = None
+        if self.leases is not None:
+            owner = make_owner_id()
+            if not await acquire_lease(self.leases, job.pr_key, owner, self.lease_ttl):
+                logger.info(f"Retrying {job.pr_key} in {self.lease_retry_interval:g}s.")
+                self._retry_later(job)
+                return
+
+        heartbeat = None
+        try:
+            provider = self.providers[job.provider]()
+            review = asyncio.ensure_future(self.handler(provider, job.workspace, job.repo_slug, job.pr_id))
+            if owner is not None:
+                heartbeat = asyncio.create_task(keep_lease(self.leases, job.pr_key, owner, self.lease_ttl, review))
+            await review
+        except asyncio.CancelledError:
+            if heartbeat is not None and heartbeat.done():
+                # The heartbeat stopped the review after losing the lease.
+                self._retry_later(job)
+                return
+            logger.info(f"Review for {job.pr_key} was cancelled.")
+            raise
+        except Exception as e:
+            logger.error(f"Review job for {job.pr_key} failed: {e}")
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            if owner is not None:
+                await release_lease(self.leases, job.pr_key, owner)
+        self._complete(job)
+
+    def _retry_later(self, job: ReviewJob):
+        async def retry():
+            await asyncio.sleep(self.lease_retry_interval)
+            async with self._condition:
+                # Skip if superseded by a newer event (its row was replaced), claimed
+                # by another process, or already pending.
+                row = self._connect().execute(
+                    "SELECT 1 FROM review_jobs WHERE job_id = ? AND owner = ?", (job.job_id, self.owner)
+                ).fetchone()
+                if row is not None and job.pr_key not in self._pending:
+                    self._pending[job.pr_key] = job
+                    self._condition.notify()
+
+        task = asyncio.create_task(retry())
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    def _complete(self, job: ReviewJob):
+        # A newer job for the same PR has a different job_id and is kept.
+        conn = self._connect()
+        conn.execute("DELETE FROM review_jobs WHERE job_id = ?", (job.job_id,))
+        conn.commit()
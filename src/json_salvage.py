@@ -0,0 +1,160 @@
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from src.json_stream import IssueStreamParser
+
+SEVERITIES = ("error", "warning", "info")
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+fence_pattern = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+# A complete "summary" string, for output cut off after it
+summary_pattern = re.compile(r'"summary"\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+@dataclass
+class Salvage:
+    """A parsed review response and how it was obtained."""
+    result: Optional[Dict[str, Any]]
+    outcome: str            # "clean", "repaired", "partial" or "failed"
+    truncated: bool = False
+    discarded: int = 0      # issues dropped by validation
+
+
+def repair(text: str) -> Tuple[Optional[str], bool]:
+    """
+    Returns the first JSON object in `text` with common model mistakes fixed,
+    and whether it was cut off before its closing brace. Prose around the
+    object and code fences are dropped; trailing commas, Python literals and
+    raw control characters inside strings are fixed. A truncated object is
+    returned as far as it goes, still unclosed.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None, False
+
+    out: List[str] = []
+    depth = 0
+    in_string = False
+    escape = False
+    i = start
+    n = len(text)
+    while i < n:
+        char = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            elif char < " ":
+                char = json.dumps(char)[1:-1]
+            out.append(char)
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            depth += 1
+            out.append(char)
+        elif char in "}]":
+            # Drop a trailing comma before the closing bracket.
+            j = len(out) - 1
+            while j >= 0 and out[j].isspace():
+                j -= 1
+            if j >= 0 and out[j] == ",":
+                del out[j]
+            out.append(char)
+            depth -= 1
+            if depth == 0:
+                return "".join(out), False
+        elif char.isalpha():
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(PYTHON_LITERALS.get(word, word))
+            i = j
+            continue
+        else:
+            out.append(char)
+        i += 1
+    return "".join(out), True
+
+
+def validate_issue(issue: Any) -> Optional[Dict[str, Any]]:
+    """Returns `issue` normalized to the review schema, or None if it cannot be placed or shown."""
+    if not isinstance(issue, dict):
+        return None
+    file = issue.get("file")
+    message = issue.get("message")
+    if not isinstance(file, str) or not file.strip() or not isinstance(message, str) or not message.strip():
+        return None
+    line = issue.get("line")
+    if isinstance(line, bool):
+        return None
+    try:
+        line = int(line)
+    except (TypeError, ValueError):
+        return None
+    if line < 1:
+        return None
+    severity = str(issue.get("severity") or "info").lower()
+    suggestion = issue.get("suggestion")
+    return {
+        **issue,
+        "file": file.strip(),
+        "line": line,
+        "severity": severity if severity in SEVERITIES else "info",
+        "message": message.strip(),
+        "suggestion": suggestion if isinstance(suggestion, str) else "",
+    }
+
+
+def _validated(parsed: Dict[str, Any], outcome: str, truncated: bool = False) -> Salvage:
+    raw_issues = parsed.get("issues")
+    if not isinstance(raw_issues, list):
+        raw_issues = []
+    issues = [issue for issue in map(validate_issue, raw_issues) if issue is not None]
+    summary = parsed.get("summary")
+    result = {**parsed, "summary": summary if isinstance(summary, str) else "", "issues": issues}
+    return Salvage(result, outcome, truncated, len(raw_issues) - len(issues))
+
+
+def salvage(text: str) -> Salvage:
+    """
+    Parses a review response, recovering as much as possible from output
+    that is not clean JSON: the object is located and repaired, and if the
+    output was cut off, every complete issue (and the summary, if it was
+    finished) is kept. Fails only when nothing usable is left.
+    """
+    try:
+        parsed = json.loads(fence_pattern.sub("", text.strip()))
+        if isinstance(parsed, dict):
+            return _validated(parsed, "clean")
+    except json.JSONDecodeError:
+        pass
+
+    repaired, truncated = repair(text)
+    if repaired is None:
+        return Salvage(None, "failed")
+    if not truncated:
+        try:
+            parsed = json.loads(repaired)
+            if isinstance(parsed, dict):
+                return _validated(parsed, "repaired")
+        except json.JSONDecodeError:
+            pass
+
+    # Truncated (or still broken): keep whatever finished before the damage.
+    issues = IssueStreamParser().feed(repaired)
+    summary = ""
+    summary_match = summary_pattern.search(repaired)
+    if summary_match:
+        try:
+            summary = json.loads(summary_match.group(1))
+        except json.JSONDecodeError:
+            pass
+    if not issues and not summary:
+        return Salvage(None, "failed", truncated)
+    return _validated({"summary": summary, "issues": issues}, "partial", truncated)
@@ -0,0 +1,86 @@
+import json
+import re
+from typing import Any, Dict, List
+
+# Start of the issues array; the lookbehind skips an escaped "issues" inside a string.
+issues_array_pattern = re.compile(r'(?<!\\)"issues"\s*:\s*\[')
+
+
+class IssueStreamParser:
+    """
+    Incremental extractor for the `issues` array of a streamed review response.
+
+    Text deltas are fed as they arrive and every complete issue object is
+    returned as soon as its closing brace is seen, without waiting for the
+    rest of the document. Each delta is scanned once; only the object being
+    parsed is buffered, and the full text is joined when `text` is read for
+    the final parse.
+    """
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._tail = ""
+        self._state = "seek"
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj: List[str] = []
+
+    @property
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, delta: str) -> List[Dict[str, Any]]:
+        self._chunks.append(delta)
+        issues: List[Dict[str, Any]] = []
+
+        if self._state == "seek":
+            window = self._tail + delta
+            match = issues_array_pattern.search(window)
+            if match is None:
+                # Keep a small overlap in case the key is split across deltas
+                self._tail = window[-32:]
+                return issues
+            self._tail = ""
+            delta = window[match.end():]
+            self._state = "array"
+
+        if self._state != "array":
+            return issues
+
+        # Start of the current object within this delta; it began in an earlier one if open.
+        obj_start = 0
+        for i, char in enumerate(delta):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    obj_start = i
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._obj.append(delta[obj_start:i + 1])
+                    try:
+                        issue = json.loads("".join(self._obj))
+                        if isinstance(issue, dict):
+                            issues.append(issue)
+                    except json.JSONDecodeError:
+                        pass
+                    self._obj = []
+            elif char == "]" and self._depth == 0:
+                self._state = "done"
+                return issues
+
+        if self._depth:
+            self._obj.append(delta[obj_start:])
+        return issues
@@ -0,0 +1,292 @@
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, List, Optional
+from urllib.parse import unquote, urlsplit
+from src.metrics import LEASE_CONFLICTS_TOTAL
+from src.utils.logger import logger
+
+# Compare-and-set scripts: only the current owner may extend or drop a lease.
+RENEW_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+)
+RELEASE_SCRIPT = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+
+def make_owner_id() -> str:
+    """A lease owner identity unique to this process and acquisition."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+
+class LeaseBackend(ABC):
+    """
+    Per-key leases with expiry, used so only one worker or node reviews a
+    given PR at a time. A lease that is not renewed before its TTL runs out
+    can be taken over, so a crashed holder never blocks a PR for long.
+    """
+
+    @abstractmethod
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        """Takes the lease if it is free or expired; returns whether `owner` now holds it."""
+        pass
+
+    @abstractmethod
+    async def renew(self, key: str, owner: str, ttl: float) -> bool:
+        """Extends the lease; returns False if `owner` no longer holds it."""
+        pass
+
+    @abstractmethod
+    async def release(self, key: str, owner: str):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """
+    Leases in a SQLite file, shared by every process on the same host
+    (e.g. several uvicorn workers). Queries can wait on another process's
+    write lock, so they run in a worker thread, one at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Other processes may hold the write lock briefly.
+            self._conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "lease_key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple) -> int:
+        """Runs one write statement and returns the number of rows it changed."""
+        with self._lock:
+            conn = self._connect()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        changed = await asyncio.to_thread(
+            self._execute,
+            "INSERT INTO leases (lease_key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(lease_key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.expires_at < ? OR leases.owner = excluded.owner",
+            (key, owner, now + ttl, now)
+        )
+        return changed == 1
+
+    async def renew(self, key: str, owner: str, ttl: float) -> bool:
+        changed = await asyncio.to_thread(
+            self._execute,
+            "UPDATE leases SET expires_at = ? WHERE lease_key = ? AND owner = ?",
+            (time.time() + ttl, key, owner)
+        )
+        return changed == 1
+
+    async def release(self, key: str, owner: str):
+        await asyncio.to_thread(
+            self._execute, "DELETE FROM leases WHERE lease_key = ? AND owner = ?", (key, owner)
+        )
+
+    def _close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def aclose(self):
+        await asyncio.to_thread(self._close)
+
+
+# Failures after which a Redis command's outcome is unknown
+CONNECTION_ERRORS = (ConnectionError, OSError, asyncio.IncompleteReadError)
+
+
+class RedisLeaseBackend(LeaseBackend):
+    """
+    Leases in Redis (or any server speaking the Redis protocol), shared by
+    every node. Uses `SET NX PX` to acquire and compare-and-set scripts to
+    renew and release. Speaks RESP directly over a single connection, so
+    no client library is needed.
+    """
+
+    def __init__(self, url: str, key_prefix: str = "review-lease:"):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.key_prefix = key_prefix
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _open(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._roundtrip("AUTH", self.password)
+        if self.db:
+            await self._roundtrip("SELECT", self.db)
+
+    @staticmethod
+    def _encode(args: List[Any]) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    async def _read_reply(self) -> Any:
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {rest.decode()}")
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            count = int(rest)
+            if count < 0:
+                return None
+            return [await self._read_reply() for _ in range(count)]
+        raise ConnectionError(f"Unexpected Redis reply: {line!r}")
+
+    async def _roundtrip(self, *args) -> Any:
+        self._writer.write(self._encode(list(args)))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _command(self, *args, retry: bool = True) -> Any:
+        """Sends one command; with `retry`, resends it once on a new connection if the connection is lost."""
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._writer is None:
+                        await self._open()
+                    return await self._roundtrip(*args)
+                except CONNECTION_ERRORS as e:
+                    await self._drop()
+                    if attempt or not retry:
+                        raise
+                    logger.warning(f"Redis lease connection lost ({e!r}); reconnecting.")
+
+    async def _drop(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+        self._reader = self._writer = None
+
+    async def acquire(self, key: str, owner: str, ttl: float) -> bool:
+        name = self.key_prefix + key
+        command = ("SET", name, owner, "NX", "PX", int(ttl * 1000))
+        try:
+            return await self._command(*command, retry=False) == "OK"
+        except CONNECTION_ERRORS as e:
+            # The SET may have landed before the connection dropped, and a blind
+            # retry would then lose to our own key: check who holds it first.
+            logger.warning(f"Redis lease connection lost during acquire ({e!r}); checking {name}.")
+        holder = await self._command("GET", name)
+        if holder is not None:
+            return holder == owner
+        return await self._command(*command, retry=False) == "OK"
+
+    async def renew(self, key: str, owner: str, ttl: float) -> bool:
+        reply = await self._command("EVAL", RENEW_SCRIPT, 1, self.key_prefix + key, owner, int(ttl * 1000))
+        return reply == 1
+
+    async def release(self, key: str, owner: str):
+        await self._command("EVAL", RELEASE_SCRIPT, 1, self.key_prefix + key, owner)
+
+    async def aclose(self):
+        async with self._lock:
+            await self._drop()
+
+
+async def acquire_lease(leases: LeaseBackend, key: str, owner: str, ttl: float) -> bool:
+    """Takes the lease for `key`; a conflict or a backend error means it was not acquired."""
+    try:
+        acquired = await leases.acquire(key, owner, ttl)
+    except Exception as e:
+        logger.error(f"Lease backend error for {key}: {e}")
+        return False
+    if not acquired:
+        LEASE_CONFLICTS_TOTAL.inc()
+        logger.info(f"{key} is being reviewed elsewhere.")
+    return acquired
+
+
+async def keep_lease(leases: LeaseBackend, key: str, owner: str, ttl: float, review: asyncio.Future):
+    """
+    Renews the lease every third of its TTL while `review` runs. If the
+    lease is taken over, or cannot be renewed before it may have expired,
+    `review` is cancelled and this returns; otherwise it runs until cancelled.
+    """
+    last_renewed = time.monotonic()
+    while True:
+        await asyncio.sleep(ttl / 3)
+        try:
+            if await leases.renew(key, owner, ttl):
+                last_renewed = time.monotonic()
+                continue
+            logger.warning(f"Lease for {key} was taken over; stopping the review.")
+        except Exception as e:
+            # Keep going while the lease is certainly still ours.
+            if time.monotonic() - last_renewed < ttl * 2 / 3:
+                logger.warning(f"Lease renewal for {key} failed: {e}")
+                continue
+            logger.warning(f"Could not renew the lease for {key} ({e}); stopping the review.")
+        review.cancel()
+        return
+
+
+async def release_lease(leases: LeaseBackend, key: str, owner: str):
+    try:
+        await leases.release(key, owner)
+    except Exception as e:
+        logger.warning(f"Failed to release lease for {key}: {e}")
+
+
+def create_lease_backend(name: str, sqlite_path: str, redis_url: str) -> Optional[LeaseBackend]:
+    """Returns the configured backend ("sqlite", "redis" or "none")."""
+    if name == "sqlite":
+        return SQLiteLeaseBackend(sqlite_path)
+    if name == "redis":
+        return RedisLeaseBackend(redis_url)
+    if name != "none":
+        logger.warning(f"Unknown lease backend '{name}'; reviews are not coordinated across processes.")
+    return None
@@ -0,0 +1,100 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+from typing import Optional, Tuple
+from src.metrics import EVENT_LOOP_BLOCKS_TOTAL, EVENT_LOOP_LAG_SECONDS
+from src.utils.logger import logger
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(SRC_DIR)
+
+
+def _describe(frame: FrameType) -> Tuple[str, str]:
+    """Returns (site, description) for the stack of a blocked loop thread."""
+    frames = traceback.extract_stack(frame)
+    ours = [f for f in frames if f.filename.startswith(SRC_DIR)]
+    picked = ours[-3:] if ours else frames[-1:]
+    # Name the library call the project code was stuck in (e.g. ast.parse).
+    if ours and frames[-1] is not ours[-1]:
+        picked.append(frames[-1])
+
+    def location(f: traceback.FrameSummary) -> str:
+        return f"{f.name} ({os.path.relpath(f.filename, PROJECT_DIR)}:{f.lineno})"
+
+    innermost = ours[-1] if ours else frames[-1]
+    site = f"{os.path.relpath(innermost.filename, PROJECT_DIR)}:{innermost.name}"
+    return site, " <- ".join(location(f) for f in reversed(picked))
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag with a timer that should fire every `interval`
+    seconds. A watchdog thread samples the loop thread's stack while the
+    timer is overdue, so each stall above `threshold` is logged and counted
+    with the code seen holding the loop most often. C calls that keep the
+    GIL block the watchdog too, so short stalls may go unsampled.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self._beat = 0.0
+        self._samples: Tuple[float, Counter] = (0.0, Counter())  # (beat, {(site, description): count})
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    async def start(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            beat = self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - beat - self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if lag < self.threshold:
+                continue
+            sampled_beat, samples = self._samples
+            if sampled_beat == beat and samples:
+                (site, description), _ = samples.most_common(1)[0]
+            else:
+                site, description = "unknown", "code that was not sampled"
+            EVENT_LOOP_BLOCKS_TOTAL.inc(site=site)
+            logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms in {description}")
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 4):
+            beat = self._beat
+            if time.monotonic() - beat - self.interval < self.threshold / 2:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            if self._samples[0] != beat:
+                self._samples = (beat, Counter())
+            self._samples[1][_describe(frame)] += 1
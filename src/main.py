@@ -1,75 +1,138 @@
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse
 from src.comment_mapper import CommentMapper
 from src.bitbucket import AsyncBitbucketClient
 from src.github import GitHubClient
+from src.http_client import http_clients
+from src.delivery_store import DeliveryStore
+from src.job_queue import QueueFullError, ReviewQueue
+from src.leases import create_lease_backend
+from src.loop_monitor import LoopLagMonitor
+from src.metrics import QUEUE_DEPTH, REVIEWS_IN_FLIGHT, metrics
+from src.offload import offloader
+from src.webhook import loads, verify_signature
 from src.utils.logger import logger
 from src.config import settings
 
-app = FastAPI(title="AI PR Review Bot")
-mapper = CommentMapper()
+mapper = CommentMapper(http_clients)
+leases = create_lease_backend(settings.LEASE_BACKEND, settings.LEASE_SQLITE_PATH, settings.LEASE_REDIS_URL)
+review_queue = ReviewQueue(
+    settings.REVIEW_QUEUE_PATH,
+    mapper.process_review,
+    providers={
+        "bitbucket": lambda: AsyncBitbucketClient(http_clients),
+        "github": lambda: GitHubClient(http_clients),
+    },
+    workers=settings.REVIEW_WORKERS,
+    max_size=settings.REVIEW_QUEUE_MAX_SIZE,
+    leases=leases,
+    lease_ttl=settings.LEASE_TTL,
+    lease_retry_interval=settings.LEASE_RETRY_INTERVAL,
+)
+deliveries = DeliveryStore(
+    settings.WEBHOOK_DEDUP_PATH,
+    cache_size=settings.WEBHOOK_DEDUP_CACHE_SIZE,
+    max_age_seconds=settings.WEBHOOK_DEDUP_MAX_AGE_DAYS * 86400,
+)
+QUEUE_DEPTH.set_function(lambda: review_queue.depth)
+REVIEWS_IN_FLIGHT.set_function(lambda: review_queue.in_flight)
+loop_monitor = None
+if settings.LOOP_LAG_MONITOR_ENABLED:
+    loop_monitor = LoopLagMonitor(settings.LOOP_LAG_INTERVAL, settings.LOOP_LAG_THRESHOLD)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled HTTP clients are shared by every provider and the AI engine
+    # for the lifetime of the process; close their sockets on shutdown.
+    if loop_monitor is not None:
+        await loop_monitor.start()
+    await review_queue.start()
+    yield
+    await review_queue.stop()
+    if leases is not None:
+        await leases.aclose()
+    deliveries.close()
+    await http_clients.aclose()
+    offloader.shutdown()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+
+app = FastAPI(title="AI PR Review Bot", lifespan=lifespan)
+
+PROVIDER_NAMES = {"bitbucket": "Bitbucket", "github": "GitHub"}
+
+async def _enqueue(provider: str, delivery_id: Optional[str], workspace: str, repo_slug: str, pr_id: int):
+    # Redeliveries of an event that was already queued are acknowledged without a new review.
+    delivery_key = f"{provider}:{delivery_id}" if delivery_id else None
+    if delivery_key is not None and not deliveries.add(delivery_key):
+        return {"message": "Duplicate delivery ignored"}
 
-@app.post("/webhook")
-async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
     try:
-        payload = await request.json()
-        print(f"DEBUG: Received Webhook Payload: {payload.keys()}")
-        print(f"DEBUG: Headers: {request.headers}")
-    except Exception:
-        print("DEBUG: Invalid JSON payload")
+        await review_queue.enqueue(provider, workspace, repo_slug, pr_id)
+    except QueueFullError as e:
+        if delivery_key is not None:
+            deliveries.discard(delivery_key)
+        logger.warning(f"Rejecting {PROVIDER_NAMES[provider]} webhook: {e}")
+        raise HTTPException(status_code=503, detail="Review queue is full", headers={"Retry-After": "30"})
+    except Exception as e:
+        if delivery_key is not None:
+            deliveries.discard(delivery_key)
+        logger.error(f"Error processing {PROVIDER_NAMES[provider]} webhook: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+    return {"message": f"{PROVIDER_NAMES[provider]} review queued for PR #{pr_id}"}
+
+async def _read_payload(request: Request, secret: Optional[str], signature_header: str) -> Dict[str, Any]:
+    body = await request.body()
+    if secret and not verify_signature(secret, body, request.headers.get(signature_header)):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    try:
+        payload = await offloader.run("webhook_decode", loads, body, size=len(body))
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    return payload
 
-    # Detect Provider
+@app.post("/webhook")
+async def handle_webhook(request: Request):
+    # Detect Provider; irrelevant events are answered from the headers alone.
     headers = request.headers
-    
+
     # --- Bitbucket ---
     if "X-Event-Key" in headers:
-        event_key = headers.get("X-Event-Key")
-        if event_key not in ["pullrequest:created", "pullrequest:updated"]:
+        if headers.get("X-Event-Key") not in ("pullrequest:created", "pullrequest:updated"):
             return {"message": "Event ignored"}
-            
-        try:
-            pr = payload.get("pullrequest", {})
-            repo = payload.get("repository", {})
-            pr_id = pr.get("id")
-            repo_slug = repo.get("slug")
-            workspace = repo.get("workspace", {}).get("slug")
-            
-            if not pr_id or not repo_slug or not workspace:
-                return {"message": "Invalid Bitbucket payload"}
-
-            provider = AsyncBitbucketClient()
-            background_tasks.add_task(mapper.process_review, provider, workspace, repo_slug, pr_id)
-            return {"message": f"Bitbucket review queued for PR #{pr_id}"}
-        except Exception as e:
-            logger.error(f"Error processing Bitbucket webhook: {e}")
-            raise HTTPException(status_code=500, detail="Internal Server Error")
+
+        payload = await _read_payload(request, settings.BITBUCKET_WEBHOOK_SECRET, "X-Hub-Signature")
+        pr = payload.get("pullrequest") or {}
+        repo = payload.get("repository") or {}
+        pr_id = pr.get("id")
+        repo_slug = repo.get("slug")
+        workspace = (repo.get("workspace") or {}).get("slug")
+        if not pr_id or not repo_slug or not workspace:
+            return {"message": "Invalid Bitbucket payload"}
+
+        return await _enqueue("bitbucket", headers.get("X-Request-UUID"), workspace, repo_slug, pr_id)
 
     # --- GitHub ---
     elif "X-GitHub-Event" in headers:
-        event_type = headers.get("X-GitHub-Event")
-        if event_type == "pull_request":
-            action = payload.get("action")
-            if action not in ["opened", "reopened", "synchronize"]:
-                return {"message": "Event ignored"}
-            
-            try:
-                pr = payload.get("pull_request", {})
-                repo = payload.get("repository", {})
-                pr_id = pr.get("number")
-                repo_name = repo.get("name")
-                owner = repo.get("owner", {}).get("login")
-                
-                if not pr_id or not repo_name or not owner:
-                    return {"message": "Invalid GitHub payload"}
-
-                provider = GitHubClient()
-                background_tasks.add_task(mapper.process_review, provider, owner, repo_name, pr_id)
-                return {"message": f"GitHub review queued for PR #{pr_id}"}
-            except Exception as e:
-                logger.error(f"Error processing GitHub webhook: {e}")
-                raise HTTPException(status_code=500, detail="Internal Server Error")
-        else:
-             return {"message": "Event ignored"}
+        if headers.get("X-GitHub-Event") != "pull_request":
+            return {"message": "Event ignored"}
+
+        payload = await _read_payload(request, settings.GITHUB_WEBHOOK_SECRET, "X-Hub-Signature-256")
+        if payload.get("action") not in ("opened", "reopened", "synchronize"):
+            return {"message": "Event ignored"}
+        pr = payload.get("pull_request") or {}
+        repo = payload.get("repository") or {}
+        pr_id = pr.get("number")
+        repo_name = repo.get("name")
+        owner = (repo.get("owner") or {}).get("login")
+        if not pr_id or not repo_name or not owner:
+            return {"message": "Invalid GitHub payload"}
+
+        return await _enqueue("github", headers.get("X-GitHub-Delivery"), owner, repo_name, pr_id)
 
     else:
         return {"message": "Unknown webhook source"}
@@ -78,6 +141,10 @@ async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("src.main:app", host="0.0.0.0", port=settings.PORT, reload=True)
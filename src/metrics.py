@@ -0,0 +1,233 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.utils.logger import logger
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return self.header() + [f"{self.name}{_format_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[LabelKey, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]):
+        """Reads the value from `function` at scrape time instead."""
+        self._function = function
+
+    def render(self) -> List[str]:
+        if self._function is not None:
+            return self.header() + [f"{self.name} {self._function()}"]
+        with self._lock:
+            return self.header() + [f"{self.name}{_format_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = buckets
+        self._values: Dict[LabelKey, List[float]] = {}  # bucket counts + [sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            for key, state in self._values.items():
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', str(bound)))} {count:g}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {state[-1]:g}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {state[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {state[-1]:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """Minimal in-process metrics registry rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+REVIEW_STAGE_SECONDS = metrics.histogram(
+    "review_stage_duration_seconds", "Duration of each process_review stage.")
+REVIEW_SECONDS = metrics.histogram(
+    "review_duration_seconds", "End-to-end duration of process_review.")
+REVIEWS_TOTAL = metrics.counter(
+    "reviews_total", "Completed reviews by outcome.")
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_client_request_duration_seconds", "Outbound HTTP request duration by host, including retries.")
+HTTP_RETRIES_TOTAL = metrics.counter(
+    "http_client_retries_total", "Outbound HTTP retries by host and reason.")
+HTTP_CACHE_TOTAL = metrics.counter(
+    "http_client_cache_total", "Conditional-request cache results for GET requests by host.")
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "llm_request_duration_seconds", "Router completion request duration.")
+LLM_SLOT_WAIT_SECONDS = metrics.histogram(
+    "llm_slot_wait_seconds", "Time router requests waited for a scheduler slot.")
+LLM_HEDGES_TOTAL = metrics.counter(
+    "llm_hedged_requests_total", "Duplicate router requests sent for slow calls, by which request finished first.")
+LLM_TIMEOUTS_TOTAL = metrics.counter(
+    "llm_request_timeouts_total", "Router requests abandoned at their adaptive timeout.")
+LLM_RESPONSES_TOTAL = metrics.counter(
+    "llm_responses_parsed_total", "Review responses by how they were parsed: clean, repaired, partial, continued or failed.")
+LLM_ISSUES_DISCARDED_TOTAL = metrics.counter(
+    "llm_issues_discarded_total", "Issues dropped from review responses for missing or invalid fields.")
+LLM_INPUT_TOKENS_TOTAL = metrics.counter(
+    "llm_input_tokens_total", "Prompt tokens sent to the router.")
+LLM_OUTPUT_TOKENS_TOTAL = metrics.counter(
+    "llm_output_tokens_total", "Completion tokens received from the router.")
+TRIAGE_FILES_TOTAL = metrics.counter(
+    "triage_files_total", "Files classified by local triage, by result.")
+COMMENTS_POSTED_TOTAL = metrics.counter(
+    "review_comments_posted_total", "Inline comments published.")
+COMMENTS_SKIPPED_TOTAL = metrics.counter(
+    "review_comments_skipped_total", "Inline comments skipped by reason.")
+COMMENTS_REMAPPED_TOTAL = metrics.counter(
+    "review_comments_remapped_total", "Inline comments moved to the nearest line inside a hunk.")
+COMMENTS_RECONCILED_TOTAL = metrics.counter(
+    "review_comments_reconciled_total", "Comments from earlier reviews kept, updated, resolved or deleted.")
+LEASE_CONFLICTS_TOTAL = metrics.counter(
+    "review_lease_conflicts_total", "Reviews deferred because another worker or node held the PR's lease.")
+QUEUE_DEPTH = metrics.gauge(
+    "review_queue_depth", "Reviews waiting in the queue.")
+REVIEWS_IN_FLIGHT = metrics.gauge(
+    "reviews_in_flight", "Reviews currently running.")
+OFFLOAD_SECONDS = metrics.histogram(
+    "offload_duration_seconds", "CPU-bound work run in the offload pool, by stage.")
+EVENT_LOOP_LAG_SECONDS = metrics.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer scheduled by the lag monitor.")
+EVENT_LOOP_BLOCKS_TOTAL = metrics.counter(
+    "event_loop_blocks_total", "Event-loop stalls above the lag threshold, by the code that was running.")
+
+
+class ReviewTrace:
+    """Collects timed spans for one review; written as a JSON line when finished."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.time()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: float, duration: float, **attrs):
+        self.spans.append({"name": name, "start": round(start - self.start, 6),
+                           "duration": round(duration, 6), **attrs})
+
+    def write(self, path: str):
+        record = {"review": self.name, "start": self.start, "duration": round(time.time() - self.start, 6),
+                  "spans": self.spans}
+        try:
+            with open(path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write review trace: {e}")
+
+
+# Trace of the review running in the current task (inherited by child tasks)
+current_trace: ContextVar[Optional[ReviewTrace]] = ContextVar("current_trace", default=None)
+
+
+def record_span(name: str, start: float, duration: float, **attrs):
+    """Adds a span to the current review trace, if one is active."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, start, duration, **attrs)
+
+
+@contextmanager
+def stage(name: str):
+    """Times a process_review stage into the stage histogram and the trace."""
+    wall_start = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        REVIEW_STAGE_SECONDS.observe(duration, stage=name)
+        record_span(f"stage:{name}", wall_start, duration)
@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from src.config import settings
+from src.metrics import OFFLOAD_SECONDS, record_span
+from src.utils.logger import logger
+
+
+class Offloader:
+    """
+    Runs CPU-bound functions in a thread or process pool once their input
+    passes `min_bytes`, so large diffs and payloads do not stall the event
+    loop. Smaller inputs run inline, where a pool round-trip would cost more
+    than it saves.
+
+    With a process pool, functions and arguments must be picklable. A thread
+    pool still shares the GIL, but lets the loop run between the interpreter's
+    switch intervals instead of waiting for the whole call.
+    """
+
+    def __init__(self, kind: str, workers: int, min_bytes: int):
+        if kind not in ("thread", "process", "none"):
+            logger.warning(f"Unknown offload executor '{kind}'; using a thread pool.")
+            kind = "thread"
+        self.kind = kind
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="offload")
+        return self._executor
+
+    async def run(self, stage: str, func: Callable[..., Any], *args, size: int = 0) -> Any:
+        """Calls `func(*args)`, in the pool if `size` (in bytes) reaches the threshold."""
+        if self.kind == "none" or size < self.min_bytes:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        wall_start = time.time()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args))
+        finally:
+            duration = time.perf_counter() - start
+            OFFLOAD_SECONDS.observe(duration, stage=stage, executor=self.kind)
+            record_span(f"offload:{stage}", wall_start, duration, bytes=size)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+offloader = Offloader(settings.OFFLOAD_EXECUTOR, settings.OFFLOAD_WORKERS, settings.OFFLOAD_MIN_BYTES)
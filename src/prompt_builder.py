@@ -0,0 +1,162 @@
+import posixpath
+import re
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+from typing import Callable, Dict, List, Optional, Tuple
+from src.utils.logger import logger
+
+TokenEstimator = Callable[[str], int]
+
+# Blank lines and lines made only of closing brackets/terminators
+trivial_line_pattern = re.compile(r'^[\s\)\]\}\;\,]*$')
+
+REVIEW_PROMPT_TEMPLATE = """
+You are an expert code reviewer. Analyze the following code diff and provide a review.
+Focus on correctness, bugs, security issues, performance issues, and best coding practices.
+
+Diff Input:
+{diff_str}
+
+Return ONLY valid JSON:
+
+{{
+  "summary": "text summary in markdown",
+  "issues": [
+    {{
+      "file": "path/to/file",
+      "line": 123,
+      "severity": "error|warning|info",
+      "message": "issue description",
+      "suggestion": "how to fix it"
+    }}
+  ]
+}}
+
+If no issues:
+
+{{
+  "summary": "summary",
+  "issues": []
+}}
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough heuristic: ~4 characters per token for code.
+    return len(text) // 4 + 1
+
+
+def get_token_estimator(name: str) -> TokenEstimator:
+    """Returns the named local token estimator ("chars" or "tiktoken")."""
+    if name == "tiktoken":
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except ImportError:
+            logger.warning("tiktoken is not installed; falling back to the character-based token estimator.")
+    elif name != "chars":
+        logger.warning(f"Unknown token estimator '{name}'; using the character-based estimator.")
+    return estimate_tokens
+
+
+@dataclass
+class PromptBuild:
+    prompt: str
+    tokens: int
+    omitted: List[Dict[str, str]] = field(default_factory=list)
+    collapsed_lines: int = 0
+
+
+def match_glob(file_path: str, globs: List[str]) -> Optional[str]:
+    """Returns the first glob matching `file_path`; globs without a "/" match the basename."""
+    basename = posixpath.basename(file_path)
+    for pattern in globs:
+        if "/" not in pattern:
+            if fnmatch(basename, pattern):
+                return pattern
+        elif fnmatch(file_path, pattern) or fnmatch(file_path, f"*/{pattern}"):
+            return pattern
+    return None
+
+
+class PromptBuilder:
+    """
+    Builds review prompts that fit the model's context window.
+
+    Files matching the exclude globs (lockfiles, vendored, minified and
+    generated code) are dropped, runs of trivial lines are collapsed, and
+    files that would overflow the remaining token budget are left out. Every
+    omission is reported so it can be surfaced in the review.
+    """
+
+    def __init__(self, context_window: int, max_output_tokens: int, exclude_globs: List[str],
+                 estimator: TokenEstimator = estimate_tokens, collapse_threshold: int = 3):
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+        self.exclude_globs = exclude_globs
+        self.estimator = estimator
+        self.collapse_threshold = collapse_threshold
+
+    def excluded_by(self, file_path: str) -> Optional[str]:
+        """Returns the glob that excludes `file_path`, if any."""
+        return match_glob(file_path, self.exclude_globs)
+
+    def build(self, diff_data: Dict[str, List[Tuple[int, str]]]) -> PromptBuild:
+        overhead = self.estimator(REVIEW_PROMPT_TEMPLATE.format(diff_str=""))
+        budget = self.context_window - self.max_output_tokens - overhead
+        parts: List[str] = []
+        omitted: List[Dict[str, str]] = []
+        collapsed_total = 0
+        used = 0
+
+        for file_path, lines in diff_data.items():
+            pattern = self.excluded_by(file_path)
+            if pattern is not None:
+                omitted.append({"file": file_path, "reason": f"excluded by {pattern}"})
+                continue
+
+            block, collapsed = self._render_file(file_path, lines)
+            tokens = self.estimator(block)
+            if used + tokens > budget:
+                omitted.append({"file": file_path, "reason": "exceeds context window"})
+                continue
+            parts.append(block)
+            used += tokens
+            collapsed_total += collapsed
+
+        if omitted:
+            logger.info(f"Prompt omitted {len(omitted)} files: {', '.join(o['file'] for o in omitted)}")
+
+        return PromptBuild(
+            prompt=REVIEW_PROMPT_TEMPLATE.format(diff_str="".join(parts)),
+            tokens=overhead + used,
+            omitted=omitted,
+            collapsed_lines=collapsed_total
+        )
+
+    def _render_file(self, file_path: str, lines: List[Tuple[int, str]]) -> Tuple[str, int]:
+        parts = [f"\nFile: {file_path}\n"]
+        collapsed = 0
+        run: List[Tuple[int, str]] = []
+
+        def flush_run():
+            nonlocal collapsed
+            if len(run) >= self.collapse_threshold:
+                parts.append(f"{run[0][0]}-{run[-1][0]}: ... ({len(run)} blank/closing lines)\n")
+                collapsed += len(run)
+            else:
+                parts.extend(f"{line_num}: {content}\n" for line_num, content in run)
+            run.clear()
+
+        for line_num, content in lines:
+            if trivial_line_pattern.match(content):
+                if run and run[-1][0] + 1 != line_num:
+                    flush_run()
+                run.append((line_num, content))
+                continue
+            flush_run()
+            parts.append(f"{line_num}: {content}\n")
+        flush_run()
+
+        return "".join(parts), collapsed
@@ -0,0 +1,176 @@
+import asyncio
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import httpx
+from src.metrics import HTTP_REQUEST_SECONDS, HTTP_RETRIES_TOTAL, record_span
+from src.utils.logger import logger
+
+# Statuses worth retrying; anything else (e.g. 400, 401, 404, 422) fails fast.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Methods that may be repeated without side effects. Other requests (e.g. a
+# POST that publishes a review) are only retried when the server cannot have
+# acted on them, unless the request sets the "idempotent" extension.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"}
+# Failures that happen before the request is sent
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class TokenBucket:
+    """
+    Per-host token bucket. Callers wait in FIFO order for a token instead of
+    failing, and the whole host can be paused until a rate-limit reset.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def block_for(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self._blocked_until > now:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    """Returns the server-requested wait in seconds, if the response carries one."""
+    value = response.headers.get("Retry-After")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if remaining == "0" and reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+    return None
+
+
+def _is_idempotent(request: httpx.Request) -> bool:
+    return request.method in IDEMPOTENT_METHODS or bool(request.extensions.get("idempotent"))
+
+
+def _is_rate_limited(response: httpx.Response) -> bool:
+    # GitHub reports primary and secondary rate limits as 403 as well as 429.
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and (
+        "Retry-After" in response.headers or response.headers.get("X-RateLimit-Remaining") == "0"
+    )
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that schedules every outbound request through a per-host
+    token bucket and retries rate-limited or transient failures with
+    exponential backoff and jitter, honouring `Retry-After` and
+    `X-RateLimit-Reset` when the server provides them.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, bucket: TokenBucket,
+                 max_retries: int = 4, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, max_wait: float = 300.0):
+        self.transport = transport
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_wait = max_wait
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        wall_start = time.time()
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._send(request)
+            status = response.status_code
+            return response
+        finally:
+            duration = time.perf_counter() - start
+            HTTP_REQUEST_SECONDS.observe(duration, host=host)
+            record_span(f"http:{host}", wall_start, duration, method=request.method, status=status)
+
+    def _retryable_status(self, request: httpx.Request, response: httpx.Response, rate_limited: bool) -> bool:
+        if rate_limited:
+            return True
+        if _is_idempotent(request):
+            return response.status_code in RETRYABLE_STATUSES
+        # A 503 with Retry-After was refused outright; other 5xx may have been acted on.
+        return response.status_code == 503 and "Retry-After" in response.headers
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        idempotent = _is_idempotent(request)
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                # A read timeout or dropped connection may come after the server acted on the request.
+                if attempt >= self.max_retries or not (idempotent or isinstance(e, UNSENT_ERRORS)):
+                    raise
+                delay = self._backoff(attempt)
+                HTTP_RETRIES_TOTAL.inc(host=request.url.host, reason="transport_error")
+                logger.warning(f"{request.method} {request.url.host} failed ({e!r}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            server_wait = _retry_after(response)
+            if server_wait is not None and response.headers.get("X-RateLimit-Remaining") == "0":
+                # Quota exhausted: hold back every request to this host until reset.
+                self.bucket.block_for(min(server_wait, self.max_wait))
+
+            rate_limited = _is_rate_limited(response)
+            if not self._retryable_status(request, response, rate_limited) or attempt >= self.max_retries:
+                return response
+
+            delay = server_wait if server_wait is not None else self._backoff(attempt)
+            if delay > self.max_wait:
+                return response
+
+            await response.aclose()
+            if rate_limited:
+                self.bucket.block_for(delay)
+            HTTP_RETRIES_TOTAL.inc(host=request.url.host, reason="rate_limited" if rate_limited else str(response.status_code))
+            logger.warning(
+                f"{request.method} {request.url.host} returned {response.status_code}; "
+                f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
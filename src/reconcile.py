@@ -0,0 +1,99 @@
+import hashlib
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+# Comments carry an invisible markdown link definition so the bot can find
+# its own comments on later reviews. GitHub and Bitbucket both hide it.
+MARKER_TAG = "ai-review-bot"
+SUMMARY_MARKER = f"[//]: # ({MARKER_TAG} summary)"
+marker_pattern = re.compile(r"\[//\]: # \(" + MARKER_TAG + r" (summary|fp=([0-9a-f]+)|resolved fp=([0-9a-f]+))\)")
+
+
+def fingerprint(path: str, message: str) -> str:
+    """A stable identity for an issue: its file and normalized message."""
+    normalized = " ".join(message.lower().split())
+    return hashlib.sha1(f"{path}\0{normalized}".encode()).hexdigest()[:16]
+
+
+def issue_marker(fp: str) -> str:
+    return f"[//]: # ({MARKER_TAG} fp={fp})"
+
+
+def with_marker(body: str, marker: str) -> str:
+    return f"{body}\n\n{marker}"
+
+
+def strip_marker(body: str) -> str:
+    return marker_pattern.sub("", body).rstrip()
+
+
+def parse_marker(body: str) -> Optional[Dict[str, Any]]:
+    """Returns {"summary": bool, "fingerprint": str, "resolved": bool}, or None for foreign comments."""
+    match = marker_pattern.search(body or "")
+    if match is None:
+        return None
+    if match.group(1) == "summary":
+        return {"summary": True, "fingerprint": None, "resolved": False}
+    if match.group(2):
+        return {"summary": False, "fingerprint": match.group(2), "resolved": False}
+    return {"summary": False, "fingerprint": match.group(3), "resolved": True}
+
+
+def resolved_body(body: str, fp: str, head_sha: Optional[str]) -> str:
+    where = f" as of {head_sha[:7]}" if head_sha else ""
+    return with_marker(
+        f"✅ _Resolved: no longer reported{where}._\n\n{strip_marker(body)}",
+        f"[//]: # ({MARKER_TAG} resolved fp={fp})"
+    )
+
+
+class CommentReconciler:
+    """
+    Indexes the bot's comments from earlier reviews so a new review only
+    posts issues that are not already on the PR, edits the summary in place
+    and finds comments whose issue is no longer reported.
+
+    `existing` holds the provider's comment dicts ("id", "body", "path",
+    "line", "outdated"). An issue matches an open comment with the same
+    fingerprint within `line_window` lines, since unrelated edits above it
+    shift the line between reviews.
+    """
+
+    def __init__(self, existing: List[Dict[str, Any]], line_window: int):
+        self.line_window = line_window
+        self.summary: Optional[Dict[str, Any]] = None
+        self._open: Dict[str, List[Dict[str, Any]]] = {}
+        self._matched = set()
+        for comment in existing:
+            marker = parse_marker(comment.get("body"))
+            if marker is None or marker["resolved"]:
+                continue
+            if marker["summary"]:
+                # Keep the most recent summary if several were posted.
+                if self.summary is None or comment["id"] > self.summary["id"]:
+                    self.summary = comment
+            elif comment.get("path"):
+                comment["fingerprint"] = marker["fingerprint"]
+                self._open.setdefault(marker["fingerprint"], []).append(comment)
+
+    def match(self, comment: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Returns the open comment already reporting `comment`'s issue, if any."""
+        best, best_distance = None, 0
+        for candidate in self._open.get(comment["fingerprint"], ()):
+            if candidate["id"] in self._matched or candidate.get("outdated") or candidate["path"] != comment["path"]:
+                continue
+            distance = abs((candidate.get("line") or 0) - comment["line"])
+            if distance <= self.line_window and (best is None or distance < best_distance):
+                best, best_distance = candidate, distance
+        if best is not None:
+            self._matched.add(best["id"])
+        return best
+
+    def stale(self, covered: Callable[[Dict[str, Any]], bool]) -> List[Dict[str, Any]]:
+        """Open comments that no issue matched, limited to code this review actually re-analyzed."""
+        return [
+            comment
+            for comments in self._open.values()
+            for comment in comments
+            if comment["id"] not in self._matched and covered(comment)
+        ]
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from src.utils.logger import logger
+
+
+class ReviewCache:
+    """
+    Persistent, content-addressed cache of per-file review results.
+
+    Entries are keyed on a hash of a file's added lines together with the model
+    and prompt version, so unchanged files are not re-analyzed when a PR is
+    updated. Old entries are evicted by age, and the least recently used ones
+    are evicted once the cache grows past `max_entries`.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, max_age_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def make_key(file_path: str, lines: List[Tuple[int, str]], model: str, prompt_version: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{model}\0{prompt_version}\0{file_path}\0".encode())
+        for line_num, content in lines:
+            digest.update(f"{line_num}:{content}\n".encode())
+        return digest.hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS review_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS review_cache_accessed ON review_cache (accessed_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, created_at FROM review_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            now = time.time()
+            if now - created_at > self.max_age_seconds:
+                conn.execute("DELETE FROM review_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE review_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return json.loads(value)
+        except Exception as e:
+            logger.error(f"Review cache read failed: {e}")
+            return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        try:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO review_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._evict(conn, now)
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Review cache write failed: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM review_cache WHERE created_at < ?", (now - self.max_age_seconds,))
+        conn.execute(
+            "DELETE FROM review_cache WHERE key IN ("
+            "SELECT key FROM review_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
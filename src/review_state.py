@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import time
+from typing import Optional
+from src.utils.logger import logger
+
+
+class ReviewStateStore:
+    """
+    Persistent record of the head commit SHA last reviewed for each PR.
+
+    Used to review only the commits pushed since the previous review.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def make_key(provider: str, workspace: str, repo_slug: str, pr_id: int) -> str:
+        return f"{provider}:{workspace}/{repo_slug}#{pr_id}"
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS review_state ("
+                "pr_key TEXT PRIMARY KEY, head_sha TEXT NOT NULL, reviewed_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get_last_reviewed_sha(self, pr_key: str) -> Optional[str]:
+        try:
+            row = self._connect().execute(
+                "SELECT head_sha FROM review_state WHERE pr_key = ?", (pr_key,)
+            ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Review state read failed: {e}")
+            return None
+
+    def set_last_reviewed_sha(self, pr_key: str, head_sha: str):
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO review_state (pr_key, head_sha, reviewed_at) VALUES (?, ?, ?)",
+                (pr_key, head_sha, time.time())
+            )
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Review state write failed: {e}")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
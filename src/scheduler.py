@@ -0,0 +1,133 @@
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from src.config import settings
+from src.metrics import LLM_SLOT_WAIT_SECONDS, record_span
+
+
+class ReviewCost:
+    """Estimated size of one review: bytes of changed content sent to the model, grown as the diff is parsed."""
+
+    def __init__(self, repo: str):
+        self.repo = repo
+        self.bytes = 0
+
+    def add(self, size: int):
+        self.bytes += size
+
+
+# Review running in the current task (inherited by child tasks)
+current_review: ContextVar[Optional[ReviewCost]] = ContextVar("current_review", default=None)
+
+
+class _Waiter:
+    __slots__ = ("repo", "deadline", "seq", "future")
+
+    def __init__(self, repo: str, deadline: float, seq: int, future: asyncio.Future):
+        self.repo = repo
+        self.deadline = deadline
+        self.seq = seq
+        self.future = future
+
+
+class LLMScheduler:
+    """
+    Process-wide limit on concurrent router requests that hands free slots
+    to the cheapest review first, so one-line fixes are not stuck behind
+    monorepo reviews.
+
+    Waiting requests are ranked by a virtual deadline: the time they started
+    waiting plus their review's estimated cost divided by `aging_rate`
+    (bytes per second). Small reviews go first, but a large one only yields
+    to work that arrived less than cost / aging_rate seconds after it, so it
+    is never starved.
+
+    Slots are also shared fairly between repositories: a repository already
+    holding its share (slots / active repositories) only gets another slot
+    when no other repository is waiting.
+    """
+
+    def __init__(self, slots: int, aging_rate: float):
+        self.slots = max(1, slots)
+        self.aging_rate = aging_rate
+        self._held: Dict[str, int] = {}
+        self._in_use = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one router slot for the review in `current_review`."""
+        review = current_review.get()
+        repo = review.repo if review is not None else ""
+        cost = review.bytes if review is not None else 0
+        await self._acquire(repo, cost)
+        try:
+            yield
+        finally:
+            self._release(repo)
+
+    async def _acquire(self, repo: str, cost: int):
+        if self._in_use < self.slots and not self._waiters:
+            self._grant(repo)
+            return
+
+        wall_start = time.time()
+        start = time.perf_counter()
+        deadline = time.monotonic() + cost / self.aging_rate
+        waiter = _Waiter(repo, deadline, next(self._seq), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.cancelled():
+                self._waiters.remove(waiter)
+            else:
+                # Granted just before the cancellation: pass the slot on.
+                self._release(repo)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            LLM_SLOT_WAIT_SECONDS.observe(duration)
+            record_span("llm_slot_wait", wall_start, duration, cost=cost)
+
+    def _grant(self, repo: str):
+        self._in_use += 1
+        self._held[repo] = self._held.get(repo, 0) + 1
+
+    def _release(self, repo: str):
+        self._in_use -= 1
+        held = self._held[repo] - 1
+        if held:
+            self._held[repo] = held
+        else:
+            del self._held[repo]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._waiters and self._in_use < self.slots:
+            waiter = self._pick()
+            self._waiters.remove(waiter)
+            self._grant(waiter.repo)
+            waiter.future.set_result(None)
+
+    def _pick(self) -> _Waiter:
+        repos = set(self._held)
+        repos.update(w.repo for w in self._waiters)
+        share = max(1, self.slots // len(repos))
+        below_share = [w for w in self._waiters if self._held.get(w.repo, 0) < share]
+        return min(below_share or self._waiters, key=lambda w: (w.deadline, w.seq))
+
+
+llm_scheduler = LLMScheduler(settings.LLM_MAX_CONCURRENCY, settings.LLM_AGING_BYTES_PER_SECOND)
@@ -0,0 +1,164 @@
+import ast
+import posixpath
+import re
+from typing import List, Optional, Tuple
+from src.diff_parser import FileDiff
+from src.prompt_builder import match_glob
+
+# Lines that only set a version string, e.g. `version = "1.2.3"`, `"version": "1.2.3",`
+version_line_pattern = re.compile(
+    r'''^\s*["']?(?:__version__|version|VERSION)["']?\s*[:=]\s*["']?v?[\w.+-]+["']?\s*,?\s*$'''
+)
+
+VERSION_FILES = {
+    "setup.py", "setup.cfg", "pyproject.toml", "package.json", "Cargo.toml", "Chart.yaml",
+    "version.py", "_version.py", "__version__.py", "__init__.py", "VERSION", "version.txt",
+}
+
+# Comment prefixes by file extension. "* " covers block-comment continuation lines.
+_HASH = ("#",)
+_C_LIKE = ("//", "/*", "*/", "* ")
+COMMENT_PREFIXES = {
+    **dict.fromkeys([".py", ".sh", ".rb", ".yml", ".yaml", ".toml"], _HASH),
+    **dict.fromkeys([".cfg", ".ini"], ("#", ";")),
+    **dict.fromkeys([".js", ".jsx", ".ts", ".tsx", ".java", ".kt", ".go", ".rs", ".c", ".h", ".cpp", ".hpp",
+                     ".cs", ".swift", ".scala"], _C_LIKE),
+    ".php": _C_LIKE + _HASH,
+    **dict.fromkeys([".sql", ".lua"], ("--",)),
+    **dict.fromkeys([".html", ".xml"], ("<!--",)),
+}
+# Block comment prefixes and the marker that closes them
+BLOCK_COMMENT_CLOSERS = {"/*": "*/", "* ": "*/", "*/": "*/", "<!--": "-->"}
+
+# Files where indentation or spacing carries meaning; whitespace changes there are never trivial.
+INDENT_SIGNIFICANT_EXTENSIONS = {".py", ".pyi", ".yml", ".yaml", ".mk", ".haml", ".pug", ".sass", ".coffee"}
+INDENT_SIGNIFICANT_FILES = {"Makefile", "makefile", "GNUmakefile"}
+
+triple_quote_pattern = re.compile(r'''^[rRuUbBfF]{0,2}("""|\'\'\')''')
+# A string literal, or a run of whitespace outside one
+string_or_space_pattern = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)|\s+''')
+
+
+def _normalized(lines: List[str]) -> List[str]:
+    """
+    Drops blank lines and trailing whitespace, keeps leading indentation and
+    collapses other runs of whitespace to one space outside string literals.
+    """
+    normalized = []
+    for line in lines:
+        code = line.rstrip()
+        if not code:
+            continue
+        body = code.lstrip()
+        indent = code[:len(code) - len(body)]
+        normalized.append(indent + string_or_space_pattern.sub(lambda m: m.group(1) or " ", body))
+    return normalized
+
+
+def _is_comment(line: str, prefixes: Tuple[str, ...]) -> bool:
+    """True if the whole line is a comment, e.g. not `/* x */ int b = 1;`."""
+    stripped = line.strip()
+    if not stripped:
+        return True
+    for prefix in prefixes:
+        # The trailing space lets a lone "*" match "* " without matching "*ptr".
+        if not (stripped + " ").startswith(prefix):
+            continue
+        closer = BLOCK_COMMENT_CLOSERS.get(prefix)
+        if closer is None:
+            return True
+        # A block comment that closes on this line must end it.
+        close = stripped.find(closer, 0 if prefix == closer else len(prefix.rstrip()))
+        return close < 0 or close + len(closer) == len(stripped)
+    return False
+
+
+def _python_fingerprint(lines: List[str]) -> Optional[str]:
+    """
+    Returns an AST dump of a Python fragment with docstrings removed, or None
+    if the fragment does not parse on its own. Comments and formatting are
+    not part of the AST, so equal fingerprints mean no code change.
+    """
+    source = "\n".join(lines)
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+
+    source_lines = source.split("\n")
+
+    def is_docstring(node: ast.AST) -> bool:
+        if not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str)):
+            return False
+        # Bare strings can also be pieces of an implicitly concatenated
+        # expression from the surrounding code; only triple-quoted ones count.
+        return bool(triple_quote_pattern.match(source_lines[node.lineno - 1].lstrip()))
+
+    for node in ast.walk(tree):
+        body = getattr(node, "body", None)
+        if isinstance(body, list):
+            node.body = [child for child in body if not is_docstring(child)]
+    return ast.dump(tree)
+
+
+def _same_python(removed: List[str], added: List[str]) -> bool:
+    # Strip only the indentation both sides share: a line that moved in or out
+    # of a block then fails to parse instead of comparing equal.
+    indents = [line[:len(line) - len(line.lstrip())] for line in removed + added if line.strip()]
+    margin = len(posixpath.commonprefix(indents))
+    new = _python_fingerprint([line[margin:] for line in added])
+    return new is not None and new == _python_fingerprint([line[margin:] for line in removed])
+
+
+class DiffTriage:
+    """
+    Cheap local pre-analysis that decides which files need the model.
+
+    Files whose changes are documentation, whitespace, comments (or, for
+    Python, anything that leaves the AST unchanged) or a version bump are
+    classified as trivial. Changes are compared block by block (each run of
+    removed and added lines between context lines) and in order, so moved or
+    reordered code always goes to the model. Whitespace changes are never
+    trivial in files where indentation is significant (Python, YAML,
+    Makefiles), and whitespace inside string literals always counts.
+    """
+
+    def __init__(self, doc_globs: List[str]):
+        self.doc_globs = doc_globs
+
+    def classify(self, file_path: str, changes: FileDiff) -> Optional[str]:
+        """Returns why the file's changes are trivial, or None if the model should see them."""
+        return self.classify_lines(file_path, changes.change_blocks())
+
+    def classify_lines(self, file_path: str, blocks: List[Tuple[List[str], List[str]]]) -> Optional[str]:
+        """`classify` on the file's (removed, added) change blocks, which are cheap to send to a worker process."""
+        basename = posixpath.basename(file_path)
+        extension = posixpath.splitext(file_path)[1].lower()
+
+        if match_glob(file_path, self.doc_globs):
+            return "documentation"
+
+        if not blocks:
+            return None
+        removed = [line for block_removed, _ in blocks for line in block_removed]
+        added = [line for _, block_added in blocks for line in block_added]
+
+        indent_significant = extension in INDENT_SIGNIFICANT_EXTENSIONS or basename in INDENT_SIGNIFICANT_FILES
+        if not indent_significant and all(_normalized(block_removed) == _normalized(block_added)
+                                          for block_removed, block_added in blocks):
+            return "whitespace only"
+
+        prefixes = COMMENT_PREFIXES.get(extension)
+        if prefixes and all(_is_comment(line, prefixes) for line in added + removed):
+            return "comments only"
+
+        if extension == ".py" and all(_same_python(*block) for block in blocks):
+            return "no code change"
+
+        if basename in VERSION_FILES and len(added) == len(removed):
+            changed = [line for line in added + removed if line.strip()]
+            if changed and all(version_line_pattern.match(line) for line in changed):
+                return "version bump"
+
+        return None
@@ -0,0 +1,23 @@
+import hashlib
+import hmac
+import json
+from typing import Any, Callable, Optional
+from src.utils.logger import logger
+
+try:
+    import orjson
+    loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:
+    logger.debug("orjson is not installed; decoding webhooks with the standard json module.")
+    loads = json.loads
+
+
+def verify_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """
+    Checks an `X-Hub-Signature-256` (GitHub) or `X-Hub-Signature`
+    (Bitbucket) header of the form `sha256=<hex digest>` against the raw body.
+    """
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[7:])